@@ -0,0 +1,204 @@
+"""
+Geriye dönük test – modelleri birden çok kesim noktasında (rolling origin) paralel süreçlerde eğitip hata metriklerini hesaplar
+"""
+from __future__ import annotations
+
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+from sqlmodel import Session
+
+from .ml_service import MODEL_DIR, MODEL_TYPE, _training_data
+
+# Kesim noktaları: en son ufuktan geriye BACKTEST_STEP_HOURS aralıkla BACKTEST_FOLDS adet
+BACKTEST_FOLDS = max(int(os.getenv("ML_BACKTEST_FOLDS", "4")), 1)
+BACKTEST_STEP_HOURS = max(int(os.getenv("ML_BACKTEST_STEP_HOURS", "168")), 1)
+# Havuz ayarları: aynı anda BACKTEST_WORKERS kesim, her biri BACKTEST_THREADS thread ile
+BACKTEST_WORKERS = max(int(os.getenv("ML_BACKTEST_WORKERS", "2")), 1)
+BACKTEST_THREADS = max(int(os.getenv("ML_BACKTEST_THREADS", str((os.cpu_count() or 1) // BACKTEST_WORKERS))), 1)
+# Kesim tahminleri (model, konfigürasyon, eğitim verisi) özetiyle saklanır; tekrar eden testler yeniden eğitmez
+BACKTEST_CACHE_DIR = Path(os.getenv("ML_BACKTEST_CACHE_DIR", str(MODEL_DIR / "backtests")))
+BACKTEST_CACHE_ENABLED = os.getenv("ML_BACKTEST_CACHE", "1").lower() in ("1", "true", "yes")
+
+# Kesim önbelleği anahtarına giren girdi sütunları
+FINGERPRINT_COLUMNS = ("site_id", "timestamp", "wind_speed", "ghi", "power_mw", "battery_soc", "battery_power_mw")
+
+
+def fold_cutoffs(df: pd.DataFrame, horizon: int, folds: int, step_hours: int, min_history: int) -> List[pd.Timestamp]:
+    """Tüm sahalarda ufku gerçek veriyle kapanan ve en az `min_history` saat geçmişi olan kesimler."""
+    bounds = df.groupby("site_id")["timestamp"].agg(["min", "max"])
+    last = bounds["max"].min() - pd.Timedelta(hours=horizon)
+    earliest = bounds["min"].max() + pd.Timedelta(hours=min_history)
+    cutoffs = [last - pd.Timedelta(hours=step_hours * i) for i in range(folds)]
+    return sorted(cutoff for cutoff in cutoffs if cutoff >= earliest)
+
+
+def _fold_key(model_type: str, config: Any, cutoff: pd.Timestamp, train_df: pd.DataFrame, target_col: str) -> str:
+    """Model tipi, konfigürasyon, özellik sürümü ve eğitim verisinin özeti."""
+    from .ml_models import feature_pipeline_version
+
+    digest = hashlib.sha1(repr((model_type, config, feature_pipeline_version(), str(cutoff), target_col)).encode())
+    columns = [col for col in FINGERPRINT_COLUMNS if col in train_df.columns]
+    digest.update(pd.util.hash_pandas_object(train_df[columns], index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:24]
+
+
+def _read_cached(key: str) -> Optional[pd.DataFrame]:
+    path = BACKTEST_CACHE_DIR / f"{key}.parquet"
+    if not BACKTEST_CACHE_ENABLED or not path.exists():
+        return None
+    try:
+        return pd.read_parquet(path)
+    except (OSError, ValueError) as exc:
+        logger.warning(f"Geriye dönük test önbelleği okunamadı ({path}): {exc}")
+        return None
+
+
+def _write_cached(key: str, forecast: pd.DataFrame) -> None:
+    if not BACKTEST_CACHE_ENABLED:
+        return
+    BACKTEST_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = BACKTEST_CACHE_DIR / f"{key}.parquet.tmp"
+    forecast.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, BACKTEST_CACHE_DIR / f"{key}.parquet")
+
+
+def _run_fold(model_type: str, config: Any, train_df: pd.DataFrame, raw_features: Any, target_col: str) -> pd.DataFrame:
+    """Worker sürecinde modeli kesime kadar eğitir ve sonraki ufkun bileşen tahminlerini döndürür."""
+    from .ml_models import ModelFactory
+
+    model = ModelFactory.create_model(model_type, config)
+    model.fit(train_df, target_col=target_col, raw_features=raw_features)
+    history = train_df.groupby("site_id", sort=False).tail(model.required_history())
+    return model.predict_components(history, target_col)
+
+
+def _json_metrics(metrics: Dict[str, Any], index: int) -> Dict[str, Optional[float]]:
+    """Bileşen metriklerini JSON'a uygun (NaN -> None) değerlere çevirir."""
+    values = {name: float(np.asarray(value)[index]) for name, value in metrics.items()}
+    return {name: (value if np.isfinite(value) else None) for name, value in values.items()}
+
+
+def _score(forecasts: Dict[Tuple[str, pd.Timestamp], pd.DataFrame], actual: pd.DataFrame, horizon: int,
+           target_col: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Kesim tahminlerini gerçek değerlerle hizalayıp bileşen başına (tüm kesimler ve kesim bazında) puanlar."""
+    from .ml_models import error_metrics
+
+    merged_by_model: Dict[str, List[pd.DataFrame]] = {}
+    per_fold = []
+    for (model_type, cutoff), forecast in sorted(forecasts.items(), key=lambda item: (item[0][1], item[0][0])):
+        forecast = forecast.assign(timestamp=pd.to_datetime(forecast["timestamp"]))
+        window = forecast[(forecast["timestamp"] > cutoff) & (forecast["timestamp"] <= cutoff + pd.Timedelta(hours=horizon))]
+        merged = window.merge(actual, on=["site_id", "timestamp"], how="inner")
+        components = [col for col in forecast.columns if col not in ("site_id", "timestamp")]
+        metrics = error_metrics(merged[target_col].to_numpy(), merged[components].to_numpy())
+        for j, component in enumerate(components):
+            per_fold.append({"cutoff": cutoff.isoformat(), "model": component, **_json_metrics(metrics, j)})
+        merged_by_model.setdefault(model_type, []).append(merged[[target_col, *components]])
+
+    # Tüm kesimler birlikte: her model tipinin bileşenleri tek vektörel çağrıda
+    overall = {}
+    for frames in merged_by_model.values():
+        merged = pd.concat(frames, ignore_index=True)
+        components = [col for col in merged.columns if col != target_col]
+        metrics = error_metrics(merged[target_col].to_numpy(), merged[components].to_numpy())
+        for j, component in enumerate(components):
+            overall[component] = _json_metrics(metrics, j)
+    return overall, per_fold
+
+
+def run_backtest(
+    db: Session,
+    site_ids: Optional[List[int]] = None,
+    model_types: Optional[Sequence[str]] = None,
+    folds: int = BACKTEST_FOLDS,
+    step_hours: int = BACKTEST_STEP_HOURS,
+    target_col: str = "power_mw",
+    progress: Optional[Callable[[str, float], None]] = None,
+) -> Dict[str, Any]:
+    """Rolling-origin geriye dönük testi çalıştırır.
+
+    Özellikler bir kez (veya özellik deposundan) hesaplanır; lag/rolling
+    özellikleri yalnızca geçmişe baktığından her kesim bu matrisin bir
+    dilimini kullanır. Her (model, kesim) ayrı bir süreçte eğitilir.
+    """
+    from .fast_models import FAST_MODEL_TYPES
+    from .ml_models import AdvancedFeatureEngineer, ModelFactory
+    from .training import _init_worker
+    from .tuning import load_tuned_config
+
+    report = progress or (lambda stage, fraction: None)
+    if model_types is None:
+        model_types = [*FAST_MODEL_TYPES, "ensemble"] if MODEL_TYPE == "auto" else [MODEL_TYPE]
+    unknown = set(model_types) - set(ModelFactory.model_types())
+    if unknown:
+        raise ValueError(f"Desteklenmeyen model tipi: {', '.join(sorted(unknown))}")
+
+    report("loading_data", 0.02)
+    df, raw_features = _training_data(db, site_ids)
+    df = df.assign(timestamp=pd.to_datetime(df["timestamp"]))
+    if raw_features is None:
+        raw_features = AdvancedFeatureEngineer().raw_features(df, [target_col])
+    raw_timestamps = pd.to_datetime(raw_features.frame["timestamp"]).to_numpy()
+
+    tuned = load_tuned_config(site_ids[0]) if site_ids and len(site_ids) == 1 else None
+    config = tuned or ModelFactory.get_default_config()
+    cutoffs = fold_cutoffs(df, config.horizon, folds, step_hours, config.input_size + config.horizon)
+    if not cutoffs:
+        raise ValueError("Geriye dönük test için veri yetersiz")
+
+    forecasts: Dict[Tuple[str, pd.Timestamp], pd.DataFrame] = {}
+    pending = {}
+    context = multiprocessing.get_context("spawn")
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=BACKTEST_WORKERS, mp_context=context,
+                             initializer=_init_worker, initargs=(BACKTEST_THREADS, None)) as executor:
+        for cutoff in cutoffs:
+            train_df = df[df["timestamp"] <= cutoff]
+            fold_raw = raw_features.take(raw_timestamps <= cutoff.to_datetime64())
+            for model_type in model_types:
+                key = _fold_key(model_type, config, cutoff, train_df, target_col)
+                cached = _read_cached(key)
+                if cached is not None:
+                    forecasts[(model_type, cutoff)] = cached
+                    continue
+                future = executor.submit(_run_fold, model_type, config, train_df, fold_raw, target_col)
+                pending[future] = (model_type, cutoff, key)
+
+        total = len(cutoffs) * len(model_types)
+        for future in as_completed(pending):
+            model_type, cutoff, key = pending[future]
+            try:
+                forecast = future.result()
+            except Exception as exc:
+                logger.warning(f"Geriye dönük test kesimi başarısız | model={model_type} cutoff={cutoff}: {exc}")
+                continue
+            forecasts[(model_type, cutoff)] = forecast
+            _write_cached(key, forecast)
+            report("backtesting", 0.05 + 0.9 * len(forecasts) / total)
+
+    if not forecasts:
+        raise ValueError("Hiçbir geriye dönük test kesimi tamamlanamadı")
+
+    report("scoring", 0.97)
+    actual = df[["site_id", "timestamp", target_col]]
+    overall, per_fold = _score(forecasts, actual, config.horizon, target_col)
+    logger.info(f"Geriye dönük test tamamlandı | {len(cutoffs)} kesim, {len(forecasts)} tahmin, "
+                f"{time.perf_counter() - started:.1f}s")
+    return {
+        "site_ids": sorted(int(site_id) for site_id in df["site_id"].unique()),
+        "cutoffs": [cutoff.isoformat() for cutoff in cutoffs],
+        "horizon": config.horizon,
+        "models": overall,
+        "folds": per_fold,
+        "cached_folds": total - len(pending),
+        "failed_folds": total - len(forecasts),
+    }
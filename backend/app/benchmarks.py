@@ -0,0 +1,417 @@
+"""
+Mikro benchmark'lar – performans değişikliklerinin istek başına CPU kazancını ölçer
+
+Kullanım:
+    python -m app.benchmarks serialization
+    python -m app.benchmarks import_time
+    python -m app.benchmarks features
+    python -m app.benchmarks data_loading
+    BENCH_MODEL_SITE=1 python -m app.benchmarks inference
+"""
+from __future__ import annotations
+
+import multiprocessing
+import os
+import resource
+import subprocess
+import tempfile
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def _timeit(fn: Callable[[], object], repeat: int = 20) -> float:
+    """Fonksiyonun en iyi çalışma süresini milisaniye olarak döndürür."""
+    fn()  # ısınma
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def _peak_memory_mb(fn: Callable[[], object]) -> float:
+    """Fonksiyonun tepe bellek kullanımını (tracemalloc, NumPy dahil) MB olarak döndürür."""
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1024 / 1024
+
+
+def _report(title: str, results: Dict[str, float]) -> None:
+    baseline = next(iter(results.values()))
+    print(f"\n{title}")
+    for name, ms in results.items():
+        print(f"  {name:<28} {ms:9.3f} ms   x{baseline / ms:5.1f}")
+
+
+def bench_serialization(n_rows: int = 168, n_sites: int = 200) -> None:
+    """read_forecast ve /api/sites için eski ve hızlı serileştirme yollarını karşılaştırır."""
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+
+    from .main import SiteResponse, SITE_RESPONSE_FIELDS
+    from .models import ForecastRecord
+    from .responses import dumps, frame_to_records
+
+    start = datetime(2024, 1, 1)
+    records = [
+        ForecastRecord(
+            site_id=1,
+            timestamp=start + timedelta(hours=h),
+            wind_speed=8.0 + h % 5,
+            ghi=300.0 + h % 7,
+            power_mw=1.5 + h % 3,
+            revenue_eur=120.0 + h,
+            co2_saved_kg=650.0 + h,
+        )
+        for h in range(n_rows)
+    ]
+    frame = pd.DataFrame({
+        "timestamp": pd.date_range(start, periods=n_rows, freq="h"),
+        "wind_speed": np.array([r.wind_speed for r in records]),
+        "ghi": np.array([r.ghi for r in records]),
+        "power_mw": np.array([r.power_mw for r in records]),
+        "revenue_eur": np.array([r.revenue_eur for r in records]),
+        "co2_saved_kg": np.array([r.co2_saved_kg for r in records]),
+        "battery_soc": np.full(n_rows, np.nan),
+        "battery_power_mw": np.full(n_rows, np.nan),
+    })
+
+    def legacy_forecast():
+        data = [
+            {
+                "timestamp": f.timestamp.isoformat(),
+                "wind_speed": f.wind_speed,
+                "ghi": f.ghi,
+                "power_mw": f.power_mw,
+                "revenue_eur": f.revenue_eur,
+                "co2_saved_kg": f.co2_saved_kg,
+                "battery_soc": None,
+                "battery_power_mw": None,
+            }
+            for f in records
+        ]
+        return JSONResponse(jsonable_encoder({"site_id": 1, "forecasts": data})).body
+
+    def fast_forecast():
+        return dumps({"site_id": 1, "forecasts": frame_to_records(frame)})
+
+    _report(f"read_forecast gövdesi ({n_rows} satır)", {
+        "legacy (dict + jsonable)": _timeit(legacy_forecast),
+        "fast (columnar + orjson)": _timeit(fast_forecast),
+    })
+
+    rows = [
+        (i, f"Site {i}", "Turkey", 50.0, "wind", 39.9 + i / 1000, 32.8 + i / 1000)
+        for i in range(n_sites)
+    ]
+
+    def legacy_sites():
+        validated = [SiteResponse(**dict(zip(SITE_RESPONSE_FIELDS, row))) for row in rows]
+        return JSONResponse(jsonable_encoder(validated)).body
+
+    def fast_sites():
+        return dumps([dict(zip(SITE_RESPONSE_FIELDS, row)) for row in rows])
+
+    _report(f"/api/sites gövdesi ({n_sites} saha)", {
+        "legacy (pydantic per row)": _timeit(legacy_sites),
+        "fast (rows + orjson)": _timeit(fast_sites),
+    })
+
+
+def _legacy_features(df: pd.DataFrame, target_col: str = "power_mw") -> pd.DataFrame:
+    """Eski pandas pipeline'ı: her adımda kopya, pencere başına dört rolling, sütun başına ölçekleyici."""
+    from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+    df = df.copy()
+    ts = pd.to_datetime(df["timestamp"])
+    df["timestamp"] = ts
+    for name, values in (("hour", ts.dt.hour), ("day_of_week", ts.dt.dayofweek), ("day_of_month", ts.dt.day),
+                         ("month", ts.dt.month), ("quarter", ts.dt.quarter), ("year", ts.dt.year)):
+        df[name] = values
+    for name, col, period in (("hour", "hour", 24), ("day", "day_of_week", 7), ("month", "month", 12)):
+        df[f"{name}_sin"] = np.sin(2 * np.pi * df[col] / period)
+        df[f"{name}_cos"] = np.cos(2 * np.pi * df[col] / period)
+    df["is_weekend"] = (df["day_of_week"] >= 5).astype(int)
+    df["is_business_hour"] = ((df["hour"] >= 8) & (df["hour"] <= 18)).astype(int)
+    df["is_peak_hour"] = ((df["hour"] >= 17) & (df["hour"] <= 21)).astype(int)
+
+    df = df.copy()
+    df["wind_power_theoretical"] = np.where((df["wind_speed"] >= 3) & (df["wind_speed"] <= 25),
+                                            np.minimum(((df["wind_speed"] - 3) / 9) ** 3, 1.0), 0.0)
+    df["wind_category"] = pd.cut(df["wind_speed"], bins=[0, 3, 7, 12, 18, 25, 100], labels=list("abcdef"))
+    df["solar_power_theoretical"] = np.maximum(df["ghi"] / 1000, 0) * 0.2 * 0.85
+    df["solar_category"] = pd.cut(df["ghi"], bins=[0, 100, 300, 600, 800, 1200], labels=list("abcde"))
+
+    df = df.copy().sort_values("timestamp")
+    for lag in (1, 3, 6, 12, 24, 48, 168):
+        df[f"{target_col}_lag_{lag}"] = df[target_col].shift(lag)
+    df = df.copy().sort_values("timestamp")
+    for window in (3, 6, 12, 24, 48, 168):
+        df[f"{target_col}_rolling_mean_{window}"] = df[target_col].rolling(window=window).mean()
+        df[f"{target_col}_rolling_std_{window}"] = df[target_col].rolling(window=window).std()
+        df[f"{target_col}_rolling_min_{window}"] = df[target_col].rolling(window=window).min()
+        df[f"{target_col}_rolling_max_{window}"] = df[target_col].rolling(window=window).max()
+
+    for col in ("wind_category", "solar_category"):
+        df[col] = LabelEncoder().fit_transform(df[col].astype(str))
+    for col in [c for c in df.select_dtypes(include=[np.number]).columns if c not in ("site_id", "id")]:
+        df[col] = StandardScaler().fit_transform(df[[col]])
+    return df
+
+
+def bench_features(n_hours: int = 24 * 365, n_sites: int = 1) -> None:
+    """Bir yıllık saatlik veri için özellik üretim süresini ve tepe belleğini ölçer."""
+    from .ml_models import AdvancedFeatureEngineer
+
+    rng = np.random.default_rng(0)
+    frames = []
+    for site_id in range(1, n_sites + 1):
+        frames.append(pd.DataFrame({
+            "timestamp": pd.date_range("2024-01-01", periods=n_hours, freq="h"),
+            "site_id": site_id,
+            "wind_speed": rng.normal(8, 3, n_hours),
+            "ghi": np.maximum(rng.normal(400, 200, n_hours), 0),
+            "power_mw": rng.normal(2.5, 1.2, n_hours),
+            "price_eur_mwh": None,
+            "battery_soc": np.nan,
+            "battery_power_mw": np.nan,
+        }))
+    df = pd.concat(frames, ignore_index=True)
+
+    legacy = lambda: _legacy_features(df)
+    fast = lambda: AdvancedFeatureEngineer().fit_transform(df, ["power_mw"])
+
+    title = f"özellik üretimi ({n_hours} saat x {n_sites} saha)"
+    _report(title, {
+        "legacy (pandas, kopyalar)": _timeit(legacy, repeat=3),
+        "single-pass float32": _timeit(fast, repeat=3),
+    })
+    print(f"  tepe bellek: legacy {_peak_memory_mb(legacy):.1f} MB, "
+          f"single-pass {_peak_memory_mb(fast):.1f} MB (girdi {df.memory_usage(deep=True).sum() / 1e6:.1f} MB)")
+
+
+def _legacy_site_data(db, site_id: int) -> pd.DataFrame:
+    """Eski yükleyici: tüm ORM nesneleri, satır başına dict, sonra DataFrame."""
+    from sqlmodel import select
+
+    from .models import ForecastRecord
+
+    records = db.exec(
+        select(ForecastRecord).where(ForecastRecord.site_id == site_id).order_by(ForecastRecord.timestamp)
+    ).all()
+    return pd.DataFrame([
+        {
+            "timestamp": r.timestamp,
+            "site_id": r.site_id,
+            "wind_speed": r.wind_speed,
+            "ghi": r.ghi,
+            "power_mw": r.power_mw,
+            "price_eur_mwh": None,
+            "battery_soc": r.battery_soc,
+            "battery_power_mw": r.battery_power_mw,
+        }
+        for r in records
+    ])
+
+
+def _seed_forecast_db(url: str, n_hours: int) -> None:
+    """Benchmark veritabanına tek saha için saatlik ForecastRecord satırları yazar."""
+    from sqlalchemy import create_engine, insert
+    from sqlmodel import SQLModel
+
+    from .models import ForecastRecord, Site
+
+    engine = create_engine(url)
+    SQLModel.metadata.create_all(engine)
+    rng = np.random.default_rng(0)
+    start = datetime(2022, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(insert(Site), [{"id": 1, "name": "bench", "country": "TR", "capacity_mw": 50.0,
+                                     "site_type": "wind", "latitude": 39.9, "longitude": 32.8}])
+        for offset in range(0, n_hours, 50_000):
+            hours = range(offset, min(offset + 50_000, n_hours))
+            conn.execute(insert(ForecastRecord), [
+                {"site_id": 1, "timestamp": start + timedelta(hours=h), "wind_speed": float(rng.normal(8, 3)),
+                 "ghi": float(rng.uniform(0, 800)), "power_mw": float(rng.normal(2.5, 1.2)),
+                 "revenue_eur": 100.0, "co2_saved_kg": 500.0, "battery_soc": None, "battery_power_mw": None}
+                for h in hours
+            ])
+    engine.dispose()
+
+
+def _current_rss_kb() -> float:
+    """Sürecin anlık RSS'i (KB); /proc yoksa tepe değer kullanılır."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _load_in_child(mode: str, url: str, results) -> None:
+    """Ayrı süreçte yükleyiciyi çalıştırır; süre ve tepe RSS artışını bildirir."""
+    from sqlalchemy import create_engine
+    from sqlmodel import Session
+
+    from .ml_service import _get_site_data
+
+    loaders = {
+        "legacy": lambda db: _legacy_site_data(db, 1),
+        "columnar": lambda db: _get_site_data(db, 1),
+        "columnar_downcast": lambda db: _get_site_data(db, 1, downcast=True),
+    }
+    engine = create_engine(url)
+    with Session(engine) as db:
+        _get_site_data(db, 1, tail=10)  # import ve bağlantı ısınması
+        baseline = _current_rss_kb()
+        start = time.perf_counter()
+        df = loaders[mode](db)
+        elapsed = time.perf_counter() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux'ta ru_maxrss KB cinsindendir
+    results.put((mode, elapsed * 1000, (peak - baseline) / 1024, df.memory_usage(deep=True).sum() / 1e6))
+
+
+def bench_data_loading(n_hours: int = 24 * 365 * 3) -> None:
+    """Eğitim verisi yükleme süresini ve tepe RSS'i eski ORM yolu ile karşılaştırır.
+
+    Her yükleyici temiz bir süreçte çalışır; RSS artışı yüklemeden önceki
+    anlık RSS'e göredir.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        _seed_forecast_db(url, n_hours)
+
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        rows = []
+        for mode in ("legacy", "columnar", "columnar_downcast"):
+            proc = context.Process(target=_load_in_child, args=(mode, url, results))
+            proc.start()
+            rows.append(results.get())
+            proc.join()
+
+    _report(f"eğitim verisi yükleme ({n_hours} saat, SQLite)", {mode: ms for mode, ms, _, _ in rows})
+    for mode, _, rss_mb, frame_mb in rows:
+        print(f"  {mode:<28} tepe RSS +{rss_mb:7.1f} MB   DataFrame {frame_mb:6.1f} MB")
+
+
+def bench_inference(repeat: int = 10) -> None:
+    """Eğitilmiş bir modelde nf.predict ile aktarılmış TorchScript yolunun gecikme/throughput ve paritesini ölçer.
+
+    Model anahtarı BENCH_MODEL_SITE ile verilir (saha id'si veya "fleet").
+    """
+    from sqlmodel import Session
+
+    from .ml_service import FLEET_MODEL_KEY, _get_panel_data, _get_site_data, load_model
+    from .models import get_engine
+
+    key = os.getenv("BENCH_MODEL_SITE", "1")
+    model_key = key if key == FLEET_MODEL_KEY else int(key)
+    model = load_model(model_key)
+    if model.inference is None:
+        print(f"\n{key}: aktarılmış çıkarım modülü yok (ML_EXPORT_INFERENCE ile yeniden eğitin)")
+        return
+
+    rows = model.required_history()
+    with Session(get_engine()) as db:
+        if model_key == FLEET_MODEL_KEY:
+            df = _get_panel_data(db, tail=rows)
+        else:
+            df = _get_site_data(db, model_key, tail=rows)
+    predict = model.predict_panel if model_key == FLEET_MODEL_KEY else model.predict
+    series = int(df["site_id"].nunique())
+
+    reference = predict(df, lean=False)["predicted_power_mw"].to_numpy()
+    lean = predict(df, lean=True)["predicted_power_mw"].to_numpy()
+    meta = model.inference[1]
+
+    results = {
+        "nf.predict (Lightning)": _timeit(lambda: predict(df, lean=False), repeat=repeat),
+        f"TorchScript (int8={meta['quantized']})": _timeit(lambda: predict(df, lean=True), repeat=repeat),
+    }
+    _report(f"tahmin gecikmesi ({key}, {series} seri x {model.config.horizon} adım)", results)
+    for name, ms in results.items():
+        print(f"  {name:<28} {series / (ms / 1000):9.1f} seri/s")
+    print(f"  parite: max mutlak fark {np.max(np.abs(reference - lean)):.5f} MW")
+
+
+# API sürecinde import edilmemesi gereken ağır ML modülleri
+HEAVY_ML_MODULES = ("torch", "neuralforecast", "pytorch_lightning", "mlflow", "evidently", "sklearn", "app.ml_models")
+
+# Regresyon eşiği (ms); IMPORT_BUDGET_MS ile değiştirilebilir
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "3000"))
+
+
+def _parse_importtime(stderr: str) -> List[Tuple[str, float, float]]:
+    """`-X importtime` çıktısını (modül, self ms, kümülatif ms) listesine çevirir."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+    return rows
+
+
+def bench_import_time(module: str = "app.main", top: int = 15) -> None:
+    """`python -X importtime` ile API modülünün import süresini ölçer.
+
+    Toplam süre IMPORT_BUDGET_MS'i aşarsa veya ağır ML modüllerinden biri
+    import edilirse sıfırdan farklı kodla çıkar (CI'da regresyon kontrolü).
+    """
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=backend_dir,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        print(proc.stderr.splitlines()[-1] if proc.stderr else "import başarısız")
+        sys.exit(proc.returncode)
+
+    rows = _parse_importtime(proc.stderr)
+    total_ms = next((cum for name, _, cum in rows if name == module), sum(s for _, s, _ in rows))
+    heavy = sorted({name for name, _, _ in rows if name.split(".")[0] in HEAVY_ML_MODULES or name in HEAVY_ML_MODULES})
+
+    print(f"\n{module} import süresi: {total_ms:.1f} ms (eşik {IMPORT_BUDGET_MS:.0f} ms, {len(rows)} modül)")
+    top_level = [row for row in rows if "." not in row[0]]
+    for name, _, cum in sorted(top_level, key=lambda row: row[2], reverse=True)[:top]:
+        print(f"  {name:<28} {cum:9.1f} ms")
+
+    failed = False
+    if heavy:
+        print(f"  HATA: ağır ML modülleri import edildi: {', '.join(heavy[:10])}")
+        failed = True
+    if total_ms > IMPORT_BUDGET_MS:
+        print("  HATA: import süresi eşiği aştı")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+BENCHMARKS = {
+    "serialization": bench_serialization,
+    "import_time": bench_import_time,
+    "features": bench_features,
+    "data_loading": bench_data_loading,
+    "inference": bench_inference,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
@@ -0,0 +1,188 @@
+"""
+Yanıt önbelleği – tahmin endpoint'leri için serileştirilmiş gövdeleri ve ETag'leri tutar
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+from fastapi import Request, Response
+
+# Önbellek ayarları
+CACHE_TTL_SECONDS = float(os.getenv("FORECAST_CACHE_TTL", "300"))
+CACHE_MAX_ENTRIES = int(os.getenv("FORECAST_CACHE_MAX_ENTRIES", "2048"))
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    """Önbellekteki tek bir yanıt gövdesi."""
+    body: bytes
+    etag: str
+    media_type: str
+    created_at: float
+
+
+def make_etag(body: bytes) -> str:
+    """Gövde içeriğinden güçlü (strong) ETag üretir."""
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match başlığının verilen ETag ile eşleşip eşleşmediğini kontrol eder."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        # If-None-Match zayıf karşılaştırma kullanır (RFC 9110 13.1.2)
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class ForecastResponseCache:
+    """(site_id, battery, varyant, veri versiyonu) anahtarlı LRU yanıt önbelleği.
+
+    Veri versiyonu saha başına tutulan bir sayaçtır; yenileme döngüsü yeni
+    tahminleri commit ettiğinde `invalidate` ile artırılır ve eski girdiler düşer.
+    """
+
+    def __init__(self, ttl_seconds: float = CACHE_TTL_SECONDS, max_entries: int = CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, CachedResponse]" = OrderedDict()
+        self._versions: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def data_version(self, site_id: int) -> int:
+        """Sahanın güncel veri versiyonunu döndürür."""
+        with self._lock:
+            return self._versions.get(site_id, 0)
+
+    def get(self, site_id: int, battery: bool, variant: Hashable = "json") -> Optional[CachedResponse]:
+        """Güncel versiyon için önbellekteki yanıtı döndürür, yoksa None."""
+        with self._lock:
+            key = (site_id, battery, variant, self._versions.get(site_id, 0))
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if self.ttl_seconds > 0 and time.monotonic() - entry.created_at > self.ttl_seconds:
+                # Sorgu penceresi "şimdi"ye göre kaydığı için eski gövdeleri düşür
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(
+        self,
+        site_id: int,
+        battery: bool,
+        body: bytes,
+        media_type: str = "application/json",
+        variant: Hashable = "json",
+        version: Optional[int] = None,
+    ) -> CachedResponse:
+        """Serileştirilmiş gövdeyi önbelleğe yazar.
+
+        `version` gövde üretilmeden önce okunan veri versiyonudur; arada bir
+        yenileme olduysa girdi zaten eskimiş sayılır ve hiç okunmaz.
+        """
+        entry = CachedResponse(
+            body=body,
+            etag=make_etag(body),
+            media_type=media_type,
+            created_at=time.monotonic(),
+        )
+        with self._lock:
+            if version is None:
+                version = self._versions.get(site_id, 0)
+            if version != self._versions.get(site_id, 0):
+                return entry
+
+            key = (site_id, battery, variant, version)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, site_id: int) -> None:
+        """Sahanın veri versiyonunu artırır ve eski girdilerini siler."""
+        with self._lock:
+            self._versions[site_id] = self._versions.get(site_id, 0) + 1
+            for key in [k for k in self._entries if k[0] == site_id]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        """Tüm önbelleği temizler."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Önbellek istatistiklerini döndürür."""
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def build_cached_response(request: Request, entry: CachedResponse) -> Response:
+    """ETag başlıklı yanıt oluşturur; istemcinin kopyası güncelse 304 döndürür."""
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type=entry.media_type, headers=headers)
+
+
+class SingleFlight:
+    """Aynı anahtar için eşzamanlı hesaplamaları tek bir çağrıda birleştirir.
+
+    İlk çağıran hesaplamayı ayrı bir task olarak başlatır; hesaplama sürerken
+    gelen diğer çağrılar aynı task'ın sonucunu (veya hatasını) bekler. Task
+    istekten bağımsız olduğu için ilk istemcinin bağlantıyı kesmesi diğerlerini
+    etkilemez.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, "asyncio.Task"] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def in_flight(self, key: Hashable) -> bool:
+        """Anahtar için süren bir hesaplama olup olmadığını döndürür."""
+        return key in self._inflight
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """`fn`'i anahtar başına en fazla bir kez eşzamanlı çalıştırır."""
+        task = self._inflight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.followers += 1
+
+        return await asyncio.shield(task)
+
+
+# Global önbellek instance'ları
+forecast_cache = ForecastResponseCache()
+forecast_flights = SingleFlight()
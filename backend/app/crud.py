@@ -1,10 +1,17 @@
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any
+from itertools import groupby
+from typing import List, Optional, Dict, Any, Iterator, Sequence, Tuple
 
+import pandas as pd
+from sqlalchemy import Integer, cast, delete, func, insert, update
 from sqlmodel import Session, select
 from fastapi import HTTPException
 
-from .models import Site, ForecastRecord, BatteryConfig
+from .models import Site, ForecastRecord, BatteryConfig, SiteDataVersion
+from .cache import forecast_cache
+from .events import event_hub
+from .metrics import observe_stage, RECORDS_WRITTEN
+from .services import column_aggregation
 
 # CRUD işlemleri için yardımcı fonksiyonlar
 
@@ -15,6 +22,12 @@ async def get_sites(db: Session) -> List[Site]:
     return sites
 
 
+async def get_site_rows(db: Session, fields: Sequence[str]) -> List[tuple]:
+    """Tüm sahaları ORM nesnesi oluşturmadan yalnızca istenen sütunlarla döndürür."""
+    statement = select(*[getattr(Site, field) for field in fields]).order_by(Site.id)
+    return db.exec(statement).all()
+
+
 async def get_site(db: Session, site_id: int) -> Site:
     """ID'ye göre sahayı döndürür."""
     site = db.get(Site, site_id)
@@ -42,6 +55,7 @@ async def update_site(db: Session, site_id: int, site_data: Dict[str, Any]) -> S
     db.add(site)
     db.commit()
     db.refresh(site)
+    forecast_cache.invalidate(site_id)
     return site
 
 
@@ -50,6 +64,7 @@ async def delete_site(db: Session, site_id: int) -> None:
     site = await get_site(db, site_id)
     db.delete(site)
     db.commit()
+    forecast_cache.invalidate(site_id)
 
 
 async def get_forecast(
@@ -74,6 +89,164 @@ async def get_forecast(
     return forecasts
 
 
+FORECAST_FRAME_COLUMNS = (
+    "timestamp", "wind_speed", "ghi", "power_mw", "revenue_eur",
+    "co2_saved_kg", "battery_soc", "battery_power_mw",
+)
+
+
+async def get_forecast_frame(
+    db: Session, 
+    site_id: int, 
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None
+) -> pd.DataFrame:
+    """Tahmin kayıtlarını ORM nesnesi üretmeden sütun bazlı DataFrame olarak döndürür."""
+    if not start_time:
+        start_time = datetime.now()
+    if not end_time:
+        end_time = start_time + timedelta(days=7)
+    
+    columns = [getattr(ForecastRecord, name) for name in FORECAST_FRAME_COLUMNS]
+    statement = select(*columns).where(
+        ForecastRecord.site_id == site_id,
+        ForecastRecord.timestamp >= start_time,
+        ForecastRecord.timestamp <= end_time
+    ).order_by(ForecastRecord.timestamp)
+    
+    rows = db.exec(statement).all()
+    df = pd.DataFrame.from_records(rows, columns=FORECAST_FRAME_COLUMNS, coerce_float=True)
+    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    return df
+
+
+# Sunucu tarafı toplama pencereleri (saniye) ve SQL toplama fonksiyonları
+AGGREGATION_BUCKETS = {"1h": 3600, "3h": 3 * 3600, "6h": 6 * 3600, "1d": 24 * 3600}
+AGGREGATIONS = {"sum": func.sum, "mean": func.avg, "min": func.min, "max": func.max}
+
+
+def _bucket_expression(db: Session, bucket_seconds: int):
+    """Zaman damgasını pencere başlangıcına (epoch saniye) yuvarlayan SQL ifadesi."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        epoch = cast(func.strftime("%s", ForecastRecord.timestamp), Integer)
+        return (epoch // bucket_seconds) * bucket_seconds
+    # PostgreSQL
+    epoch = func.extract("epoch", ForecastRecord.timestamp)
+    return func.floor(epoch / bucket_seconds) * bucket_seconds
+
+
+def _aggregated_value_columns(agg: str) -> list:
+    """Tahmin değer sütunlarının toplanmış SQL ifadeleri (timestamp hariç; `sum` yoğun sütunlarda ortalamadır)."""
+    return [
+        AGGREGATIONS[column_aggregation(name, agg)](getattr(ForecastRecord, name)).label(name)
+        for name in FORECAST_FRAME_COLUMNS[1:]
+    ]
+
+
+async def get_forecast_aggregated(
+    db: Session, 
+    site_id: int, 
+    bucket: str,
+    agg: str = "mean",
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None
+) -> pd.DataFrame:
+    """Tahminleri SQL tarafında zaman penceresine göre toplayıp DataFrame döndürür."""
+    if not start_time:
+        start_time = datetime.now()
+    if not end_time:
+        end_time = start_time + timedelta(days=7)
+    
+    bucket_col = _bucket_expression(db, AGGREGATION_BUCKETS[bucket]).label("bucket")
+    statement = (
+        select(bucket_col, *_aggregated_value_columns(agg))
+        .where(
+            ForecastRecord.site_id == site_id,
+            ForecastRecord.timestamp >= start_time,
+            ForecastRecord.timestamp <= end_time
+        )
+        .group_by(bucket_col)
+        .order_by(bucket_col)
+    )
+    
+    rows = db.exec(statement).all()
+    df = pd.DataFrame.from_records(rows, columns=FORECAST_FRAME_COLUMNS, coerce_float=True)
+    df["timestamp"] = pd.to_datetime(df["timestamp"].astype("float64"), unit="s")
+    return df
+
+
+# Filo akışında sunucu tarafı cursor'dan tek seferde çekilecek satır sayısı
+FLEET_STREAM_CHUNK_SIZE = 2000
+
+FLEET_SITE_COLUMNS = ("id", "name", "country", "capacity_mw", "site_type")
+
+
+def iter_fleet_forecasts(
+    db: Session,
+    site_ids: Optional[Sequence[int]] = None,
+    country: Optional[str] = None,
+    site_type: Optional[str] = None,
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    bucket: Optional[str] = None,
+    agg: str = "mean",
+    chunk_size: int = FLEET_STREAM_CHUNK_SIZE,
+) -> Iterator[Tuple[Dict[str, Any], Iterator[tuple]]]:
+    """Filtrelenen tüm sahaların tahminlerini tek sıralı sorguyla saha saha döndürür.
+
+    Satırlar sunucu tarafı cursor ile `chunk_size`'lık parçalar halinde okunur,
+    böylece bellek kullanımı filo büyüklüğünden bağımsız kalır. Her eleman
+    (saha bilgisi, tahmin satırları iteratörü) çiftidir; iteratör bir sonraki
+    sahaya geçmeden önce tüketilmelidir. `bucket` verilirse satırlar SQL
+    tarafında pencere başına toplanır ve timestamp pencere başlangıcı olur.
+    """
+    if not start_time:
+        start_time = datetime.now()
+    if not end_time:
+        end_time = start_time + timedelta(days=7)
+    
+    site_cols = [getattr(Site, name) for name in FLEET_SITE_COLUMNS]
+    if bucket:
+        bucket_col = _bucket_expression(db, AGGREGATION_BUCKETS[bucket]).label("bucket")
+        forecast_cols = [bucket_col, *_aggregated_value_columns(agg)]
+    else:
+        forecast_cols = [getattr(ForecastRecord, name) for name in FORECAST_FRAME_COLUMNS]
+    
+    statement = (
+        select(*site_cols, *forecast_cols)
+        .join(Site, Site.id == ForecastRecord.site_id)
+        .where(
+            ForecastRecord.timestamp >= start_time,
+            ForecastRecord.timestamp <= end_time,
+        )
+    )
+    if site_ids:
+        statement = statement.where(ForecastRecord.site_id.in_(list(site_ids)))
+    if country:
+        statement = statement.where(Site.country == country)
+    if site_type:
+        statement = statement.where(Site.site_type == site_type)
+    
+    if bucket:
+        statement = statement.group_by(*site_cols, bucket_col).order_by(Site.id, bucket_col)
+    else:
+        statement = statement.order_by(ForecastRecord.site_id, ForecastRecord.timestamp)
+    statement = statement.execution_options(stream_results=True, yield_per=chunk_size)
+    
+    n_site_cols = len(FLEET_SITE_COLUMNS)
+    rows = db.exec(statement)
+    for site_key, site_rows in groupby(rows, key=lambda row: tuple(row[:n_site_cols])):
+        site_info = dict(zip(FLEET_SITE_COLUMNS, site_key))
+        if bucket:
+            yield site_info, (
+                (datetime.utcfromtimestamp(float(row[n_site_cols])), *row[n_site_cols + 1:])
+                for row in site_rows
+            )
+        else:
+            yield site_info, (tuple(row[n_site_cols:]) for row in site_rows)
+
+
 async def create_forecast(db: Session, forecast_data: Dict[str, Any]) -> ForecastRecord:
     """Yeni bir tahmin kaydı oluşturur."""
     forecast = ForecastRecord(**forecast_data)
@@ -83,6 +256,73 @@ async def create_forecast(db: Session, forecast_data: Dict[str, Any]) -> Forecas
     return forecast
 
 
+def _forecast_mappings(site_id: int, forecast_df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """Hesaplanmış tahmin DataFrame'ini ForecastRecord satır sözlüklerine çevirir."""
+    columns = [col for col in FORECAST_FRAME_COLUMNS if col in forecast_df.columns]
+    df = forecast_df[columns].copy()
+    
+    # Tablo zaman dilimsiz; saat değerini koruyarak tz bilgisini düşür
+    timestamps = pd.to_datetime(df["timestamp"])
+    if timestamps.dt.tz is not None:
+        timestamps = timestamps.dt.tz_localize(None)
+    df["timestamp"] = timestamps
+    
+    df = df.astype(object).where(df.notna(), None)
+    df["site_id"] = site_id
+    return df.to_dict(orient="records")
+
+
+@observe_stage("db_write_forecasts")
+def _bump_data_versions(db: Session, site_ids: Sequence[int]) -> None:
+    """Sahaların paylaşılan veri sürümünü artırır (commit çağıranın transaction'ında yapılır)."""
+    for site_id in set(site_ids):
+        updated = db.execute(
+            update(SiteDataVersion)
+            .where(SiteDataVersion.site_id == site_id)
+            .values(version=SiteDataVersion.version + 1)
+        )
+        if updated.rowcount == 0:
+            db.execute(insert(SiteDataVersion).values(site_id=site_id, version=1))
+
+
+async def replace_site_forecasts(db: Session, site_id: int, forecast_df: pd.DataFrame) -> int:
+    """Sahanın tahminlerini tek transaction'da toplu olarak yazar.
+
+    Yeni tahminlerin kapsadığı zaman aralığındaki eski kayıtlar önce silinir,
+    böylece yenileme döngüsü ve istek anında hesaplanan tahminler aynı saatler
+    için mükerrer satır oluşturmaz. Yazılan satır sayısını döndürür.
+    """
+    records = _forecast_mappings(site_id, forecast_df)
+    if not records:
+        return 0
+    
+    timestamps = [record["timestamp"] for record in records]
+    db.execute(
+        delete(ForecastRecord).where(
+            ForecastRecord.site_id == site_id,
+            ForecastRecord.timestamp >= min(timestamps),
+            ForecastRecord.timestamp <= max(timestamps)
+        )
+    )
+    db.execute(insert(ForecastRecord), records)
+    _bump_data_versions(db, [site_id])
+    db.commit()
+    RECORDS_WRITTEN.inc(len(records))
+    
+    # Yeni tahminler commit edildi, sahanın yanıt önbelleğini geçersiz kıl
+    forecast_cache.invalidate(site_id)
+    
+    # Abonelere kısa değişiklik bildirimi gönder (istemci ETag ile yeniden çeker)
+    event_hub.publish("forecast", {
+        "site_id": site_id,
+        "records": len(records),
+        "start": min(timestamps).isoformat(),
+        "end": max(timestamps).isoformat(),
+        "version": forecast_cache.data_version(site_id),
+    })
+    return len(records)
+
+
 async def create_or_update_battery_config(
     db: Session, 
     site_id: int, 
@@ -115,6 +355,7 @@ async def get_battery_config(db: Session, site_id: int) -> Optional[BatteryConfi
     return battery_config
 
 
+@observe_stage("db_delete_old_forecasts")
 async def delete_old_forecasts(db: Session, older_than: datetime) -> int:
     """Belirli bir tarihten eski tahmin kayıtlarını siler."""
     statement = select(ForecastRecord).where(ForecastRecord.timestamp < older_than)
@@ -123,6 +364,7 @@ async def delete_old_forecasts(db: Session, older_than: datetime) -> int:
     
     for forecast in old_forecasts:
         db.delete(forecast)
+    _bump_data_versions(db, [forecast.site_id for forecast in old_forecasts])
     
     db.commit()
     return count
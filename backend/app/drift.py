@@ -0,0 +1,450 @@
+"""
+Drift izleme – saha girdilerinin ve tahmin hatasının dağılımını sabit bellekli akış özetleriyle takip eder
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+from sqlmodel import Session, select
+
+from .events import event_hub
+from .models import PredictionRecord, Site
+
+# Referans (model sonrası ilk N saat) ve karşılaştırma penceresi boyutları, saat/gözlem.
+# Pencere tam haftadır: eksik pencere gün içi döngü nedeniyle (ör. yalnızca gece saatleri) yanıltır
+DRIFT_REFERENCE_HOURS = max(int(os.getenv("ML_DRIFT_REFERENCE_HOURS", "720")), 1)
+DRIFT_WINDOW_HOURS = max(int(os.getenv("ML_DRIFT_WINDOW_HOURS", "168")), 1)
+# Eşikler: PSI (0.1 / 0.25 yaygın kabul) ve pencere/referans hata RMSE oranı
+DRIFT_PSI_WARNING = float(os.getenv("ML_DRIFT_PSI_WARNING", "0.1"))
+DRIFT_PSI_ALERT = float(os.getenv("ML_DRIFT_PSI_ALERT", "0.25"))
+DRIFT_ERROR_WARNING = float(os.getenv("ML_DRIFT_ERROR_WARNING", "1.25"))
+DRIFT_ERROR_ALERT = float(os.getenv("ML_DRIFT_ERROR_ALERT", "1.5"))
+# Drift tespit edildiğinde saha modeli için eğitim işi otomatik açılsın mı
+DRIFT_AUTO_RETRAIN = os.getenv("ML_DRIFT_AUTO_RETRAIN", "0").lower() in ("1", "true", "yes")
+DRIFT_STATE_FILE = Path(os.getenv(
+    "ML_DRIFT_STATE_FILE", str(Path(os.getenv("ML_MODEL_DIR", "./models")) / "drift_state.json")
+))
+
+# İzlenen değişkenler ve histogram aralıkları; güç ve hata saha kapasitesine oranlanır
+DRIFT_FEATURES: Dict[str, Tuple[float, float]] = {
+    "wind_speed": (0.0, 30.0),
+    "ghi": (0.0, 1100.0),
+    "power_mw": (0.0, 1.0),
+    "forecast_error": (-1.0, 1.0),
+}
+DRIFT_BINS = 10
+DRIFT_QUANTILES = (0.05, 0.5, 0.95)
+STATUS_LEVELS = ("ok", "warning", "drift")
+
+
+class RunningMoments:
+    """Welford/Chan yöntemiyle sayı, ortalama, varyans, min ve max."""
+
+    def __init__(self, count: int = 0, mean: float = 0.0, m2: float = 0.0,
+                 minimum: float = float("inf"), maximum: float = float("-inf")):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def update(self, values: np.ndarray) -> None:
+        """Bir grup gözlemi tek geçişte birleştirir."""
+        if values.size == 0:
+            return
+        batch_count = values.size
+        batch_mean = float(values.mean())
+        batch_m2 = float(((values - batch_mean) ** 2).sum())
+
+        total = self.count + batch_count
+        delta = batch_mean - self.mean
+        self.mean += delta * batch_count / total
+        self.m2 += batch_m2 + delta * delta * self.count * batch_count / total
+        self.count = total
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(self.m2 / (self.count - 1))) if self.count > 1 else 0.0
+
+    @property
+    def rms(self) -> float:
+        """Karekök ortalama kare (hata için RMSE)."""
+        return float(np.sqrt(self.m2 / self.count + self.mean ** 2)) if self.count else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"count": self.count, "mean": self.mean, "m2": self.m2,
+                "minimum": self.minimum if self.count else None, "maximum": self.maximum if self.count else None}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RunningMoments":
+        return cls(data["count"], data["mean"], data["m2"],
+                   data["minimum"] if data["minimum"] is not None else float("inf"),
+                   data["maximum"] if data["maximum"] is not None else float("-inf"))
+
+
+class P2Quantile:
+    """Jain & Chlamtac P² algoritması: tek bir yüzdeliği 5 işaretçiyle tahmin eder."""
+
+    def __init__(self, p: float, heights: Optional[List[float]] = None, positions: Optional[List[float]] = None,
+                 desired: Optional[List[float]] = None):
+        self.p = p
+        self.heights = heights or []
+        self.positions = positions or [0.0, 1.0, 2.0, 3.0, 4.0]
+        self.desired = desired or [0.0, 2 * p, 4 * p, 2 + 2 * p, 4.0]
+        self.increments = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+
+    def update(self, values: Iterable[float]) -> None:
+        for x in values:
+            self._add(float(x))
+
+    def _add(self, x: float) -> None:
+        q, n = self.heights, self.positions
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # İç işaretçileri istenen konumlarına parabolik (olmazsa doğrusal) olarak kaydır
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                step = 1 if d > 0 else -1
+                parabolic = q[i] + step / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + step) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - step) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if q[i - 1] < parabolic < q[i + 1]:
+                    q[i] = parabolic
+                else:
+                    q[i] += step * (q[i + step] - q[i]) / (n[i + step] - n[i])
+                n[i] += step
+
+    @property
+    def value(self) -> Optional[float]:
+        if not self.heights:
+            return None
+        if len(self.heights) < 5:
+            return float(np.quantile(self.heights, self.p))
+        return self.heights[2]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"p": self.p, "heights": self.heights, "positions": self.positions, "desired": self.desired}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "P2Quantile":
+        return cls(data["p"], data["heights"], data["positions"], data["desired"])
+
+
+class StreamSketch:
+    """Tek bir değişkenin akış özeti: momentler, P² yüzdelikleri ve sabit kenarlı histogram."""
+
+    def __init__(self, low: float, high: float, bins: int = DRIFT_BINS):
+        self.low = low
+        self.high = high
+        self.edges = np.linspace(low, high, bins + 1)
+        # İlk ve son kutu aralık dışı (alt/üst taşma) gözlemleri tutar
+        self.counts = np.zeros(bins + 2, dtype=np.int64)
+        self.moments = RunningMoments()
+        self.quantiles = [P2Quantile(p) for p in DRIFT_QUANTILES]
+
+    @property
+    def count(self) -> int:
+        return self.moments.count
+
+    def update(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return
+        self.moments.update(values)
+        self.counts += np.bincount(np.searchsorted(self.edges, values, side="right"), minlength=self.counts.size)
+        for quantile in self.quantiles:
+            quantile.update(values)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": self.moments.mean if self.count else None,
+            "std": self.moments.std if self.count else None,
+            "min": self.moments.minimum if self.count else None,
+            "max": self.moments.maximum if self.count else None,
+            **{f"p{round(q.p * 100):02d}": q.value for q in self.quantiles},
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "low": self.low, "high": self.high, "counts": self.counts.tolist(),
+            "moments": self.moments.to_dict(), "quantiles": [q.to_dict() for q in self.quantiles],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "StreamSketch":
+        sketch = cls(data["low"], data["high"], len(data["counts"]) - 2)
+        sketch.counts = np.asarray(data["counts"], dtype=np.int64)
+        sketch.moments = RunningMoments.from_dict(data["moments"])
+        sketch.quantiles = [P2Quantile.from_dict(q) for q in data["quantiles"]]
+        return sketch
+
+
+def population_stability_index(reference: np.ndarray, current: np.ndarray, epsilon: float = 1e-4) -> float:
+    """İki histogram arasındaki PSI; boş kutular epsilon ile yumuşatılır."""
+    expected = np.maximum(reference / max(reference.sum(), 1), epsilon)
+    actual = np.maximum(current / max(current.sum(), 1), epsilon)
+    return float(((actual - expected) * np.log(actual / expected)).sum())
+
+
+def _compare(feature: str, reference: StreamSketch, window: StreamSketch) -> Dict[str, Any]:
+    """Tamamlanan pencereyi referansla karşılaştırır."""
+    result: Dict[str, Any] = {"reference": reference.summary(), "window": window.summary()}
+    psi = population_stability_index(reference.counts, window.counts)
+    std = reference.moments.std
+    result["psi"] = psi
+    result["mean_shift"] = (window.moments.mean - reference.moments.mean) / std if std > 0 else None
+    level = 2 if psi >= DRIFT_PSI_ALERT else 1 if psi >= DRIFT_PSI_WARNING else 0
+
+    if feature == "forecast_error" and reference.moments.rms > 0:
+        ratio = window.moments.rms / reference.moments.rms
+        result["rmse_ratio"] = ratio
+        level = max(level, 2 if ratio >= DRIFT_ERROR_ALERT else 1 if ratio >= DRIFT_ERROR_WARNING else 0)
+    result["status"] = STATUS_LEVELS[level]
+    return result
+
+
+class SiteDrift:
+    """Bir sahanın referans ve pencere özetleri.
+
+    Her değişkenin ilk DRIFT_REFERENCE_HOURS gözlemi referansı oluşturur,
+    sonrakiler pencereye gider. Pencere DRIFT_WINDOW_HOURS gözleme ulaşınca
+    referansla karşılaştırılır ve sıfırlanır; bellek gözlem sayısından
+    bağımsızdır.
+    """
+
+    def __init__(self, site_id: int):
+        self.site_id = site_id
+        self.watermark: Optional[pd.Timestamp] = None
+        self.reference = {name: StreamSketch(*bounds) for name, bounds in DRIFT_FEATURES.items()}
+        self.window = {name: StreamSketch(*bounds) for name, bounds in DRIFT_FEATURES.items()}
+        self.features: Dict[str, Dict[str, Any]] = {}
+        self.status = "ok"
+        self.retrain_recommended = False
+        self.updated_at: Optional[float] = None
+
+    def update(self, observations: Dict[str, np.ndarray]) -> None:
+        for name, values in observations.items():
+            values = np.asarray(values, dtype=np.float64)
+            values = values[np.isfinite(values)]
+            reference, window = self.reference[name], self.window[name]
+            free = max(DRIFT_REFERENCE_HOURS - reference.count, 0)
+            if free:
+                reference.update(values[:free])
+                values = values[free:]
+
+            while values.size:
+                take = DRIFT_WINDOW_HOURS - window.count
+                window.update(values[:take])
+                values = values[take:]
+                if window.count >= DRIFT_WINDOW_HOURS:
+                    self.features[name] = _compare(name, reference, window)
+                    window = self.window[name] = StreamSketch(*DRIFT_FEATURES[name])
+
+        level = max((STATUS_LEVELS.index(f["status"]) for f in self.features.values()), default=0)
+        self.status = STATUS_LEVELS[level]
+        # Öneri yeniden eğitime (rebaseline) kadar kalır
+        self.retrain_recommended = self.retrain_recommended or self.status == "drift"
+        self.updated_at = time.time()
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "site_id": self.site_id,
+            "status": self.status,
+            "retrain_recommended": self.retrain_recommended,
+            "watermark": self.watermark.isoformat() if self.watermark is not None else None,
+            "updated_at": self.updated_at,
+            "features": self.features,
+            "reference_counts": {name: sketch.count for name, sketch in self.reference.items()},
+            "window_counts": {name: sketch.count for name, sketch in self.window.items()},
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            **self.report(),
+            "reference": {name: sketch.to_dict() for name, sketch in self.reference.items()},
+            "window": {name: sketch.to_dict() for name, sketch in self.window.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SiteDrift":
+        site = cls(data["site_id"])
+        site.watermark = pd.Timestamp(data["watermark"]) if data.get("watermark") else None
+        site.status = data.get("status", "ok")
+        site.retrain_recommended = data.get("retrain_recommended", False)
+        site.updated_at = data.get("updated_at")
+        site.features = data.get("features", {})
+        for name in DRIFT_FEATURES:
+            if name in data.get("reference", {}):
+                site.reference[name] = StreamSketch.from_dict(data["reference"][name])
+            if name in data.get("window", {}):
+                site.window[name] = StreamSketch.from_dict(data["window"][name])
+        return site
+
+
+class DriftMonitor:
+    """Saha başına drift özetlerini tutan, yenileme döngüsünde güncellenen izleyici.
+
+    Yalnızca sahanın filigranından (son işlenen zaman) sonraki saatler
+    işlenir; örtüşen yenilemeler aynı saati iki kez saymaz. Tahmin hatası,
+    yeni saatler için kayıtlı toplu tahminlerle (PredictionRecord)
+    hesaplanır. Durum küçük bir JSON dosyasında saklanır.
+    """
+
+    def __init__(self, state_file: Path = DRIFT_STATE_FILE):
+        self.state_file = state_file
+        self._sites: Dict[int, SiteDrift] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.state_file.exists():
+            return
+        try:
+            data = json.loads(self.state_file.read_text(encoding="utf-8"))
+            self._sites = {int(site_id): SiteDrift.from_dict(site) for site_id, site in data.items()}
+        except (OSError, ValueError, KeyError) as exc:
+            logger.warning(f"Drift durumu okunamadı, sıfırdan başlanıyor ({self.state_file}): {exc}")
+
+    def _save(self) -> None:
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_file.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({site_id: site.to_dict() for site_id, site in self._sites.items()}),
+                            encoding="utf-8")
+        os.replace(tmp_path, self.state_file)
+
+    @staticmethod
+    def _observations(db: Session, site: Site, frame: pd.DataFrame) -> Dict[str, np.ndarray]:
+        capacity = site.capacity_mw or 1.0
+        observations = {
+            name: frame[name].to_numpy(dtype=np.float64, na_value=np.nan)
+            for name in ("wind_speed", "ghi") if name in frame.columns
+        }
+        observations["power_mw"] = frame["power_mw"].to_numpy(dtype=np.float64) / capacity
+
+        predictions = db.exec(
+            select(PredictionRecord.timestamp, PredictionRecord.predicted_power_mw).where(
+                PredictionRecord.site_id == site.id,
+                PredictionRecord.timestamp >= frame["timestamp"].min().to_pydatetime(),
+                PredictionRecord.timestamp <= frame["timestamp"].max().to_pydatetime(),
+            )
+        ).all()
+        if predictions:
+            predicted = pd.DataFrame(predictions, columns=["timestamp", "predicted_power_mw"])
+            merged = frame.merge(predicted.assign(timestamp=pd.to_datetime(predicted["timestamp"])), on="timestamp")
+            observations["forecast_error"] = (
+                (merged["predicted_power_mw"] - merged["power_mw"]).to_numpy(dtype=np.float64) / capacity
+            )
+        return observations
+
+    def observe(self, db: Session, site: Site, forecast_df: pd.DataFrame) -> Optional[Dict[str, Any]]:
+        """Yenilemede yazılan satırlardan filigran sonrasını özetlere işler ve sahanın raporunu döndürür."""
+        frame = forecast_df.assign(timestamp=pd.to_datetime(forecast_df["timestamp"]))
+        if frame["timestamp"].dt.tz is not None:
+            frame["timestamp"] = frame["timestamp"].dt.tz_localize(None)
+
+        with self._lock:
+            self._ensure_loaded()
+            state = self._sites.get(site.id) or SiteDrift(site.id)
+            if state.watermark is not None:
+                frame = frame[frame["timestamp"] > state.watermark]
+            if frame.empty:
+                return None
+            frame = frame.sort_values("timestamp")
+
+            previous = state.retrain_recommended
+            state.update(self._observations(db, site, frame))
+            state.watermark = frame["timestamp"].iloc[-1]
+            self._sites[site.id] = state
+            self._save()
+            report = state.report()
+
+        if state.retrain_recommended and not previous:
+            self._alert(report)
+        return report
+
+    @staticmethod
+    def _alert(report: Dict[str, Any]) -> None:
+        drifted = [name for name, feature in report["features"].items() if feature["status"] == "drift"]
+        logger.warning(f"Drift tespit edildi | site_id={report['site_id']} değişkenler={', '.join(drifted)}")
+        event_hub.publish("drift", {"site_id": report["site_id"], "status": report["status"], "features": drifted})
+        if DRIFT_AUTO_RETRAIN:
+            from .training import training_jobs
+            training_jobs.submit(report["site_id"])
+
+    def report(self, site_id: int) -> Optional[Dict[str, Any]]:
+        """Sahanın drift raporu (henüz gözlem yoksa None)."""
+        with self._lock:
+            self._ensure_loaded()
+            state = self._sites.get(site_id)
+            return state.report() if state is not None else None
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Tüm sahaların kısa durumu."""
+        with self._lock:
+            self._ensure_loaded()
+            return [
+                {"site_id": site_id, "status": state.status, "retrain_recommended": state.retrain_recommended,
+                 "updated_at": state.updated_at}
+                for site_id, state in sorted(self._sites.items())
+            ]
+
+    def rebaseline(self, site_id: Optional[int] = None) -> None:
+        """Yeniden eğitim sonrası sahanın (None ise tüm sahaların) özetlerini sıfırlar; filigran korunur."""
+        with self._lock:
+            self._ensure_loaded()
+            site_ids = list(self._sites) if site_id is None else [site_id]
+            for key in site_ids:
+                state = self._sites.get(key)
+                if state is None:
+                    continue
+                fresh = SiteDrift(key)
+                fresh.watermark = state.watermark
+                self._sites[key] = fresh
+            self._save()
+
+    def gauge(self) -> Dict[Tuple[str, str], float]:
+        """Prometheus göstergesi için (site_id, değişken) -> PSI."""
+        with self._lock:
+            self._ensure_loaded()
+            return {
+                (str(site_id), name): feature["psi"]
+                for site_id, state in self._sites.items()
+                for name, feature in state.features.items() if "psi" in feature
+            }
+
+
+# Global drift izleyicisi
+drift_monitor = DriftMonitor()
@@ -0,0 +1,144 @@
+"""
+Olay yayını – tahmin ve fiyat değişikliklerini Server-Sent Events ile abonelere iletir
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import os
+import threading
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Set
+
+from loguru import logger
+
+from .responses import dumps
+
+# Abone başına kuyruk sınırı ve yavaş istemci toleransı
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "64"))
+MAX_LAG_EVENTS = int(os.getenv("STREAM_MAX_LAG_EVENTS", "3"))
+HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", "15"))
+
+_CLOSE = b""
+
+
+class Subscriber:
+    """Tek bir SSE bağlantısının kuyruğu ve filtresi."""
+
+    def __init__(self, site_ids: Optional[Iterable[int]] = None, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue: "asyncio.Queue[bytes]" = asyncio.Queue(maxsize=queue_size)
+        self.site_ids: Optional[Set[int]] = set(site_ids) if site_ids else None
+        self.lag_events = 0
+        self.closed = False
+
+    def wants(self, site_id: Optional[int]) -> bool:
+        """Olayın bu aboneye gönderilip gönderilmeyeceğini döndürür."""
+        return self.site_ids is None or site_id is None or site_id in self.site_ids
+
+
+class EventHub:
+    """Her mesajı bir kez serileştirip tüm abonelere dağıtan fan-out merkezi.
+
+    `publish` herhangi bir thread'den çağrılabilir (ör. fiyat scheduler'ı);
+    dağıtım her zaman event loop üzerinde yapılır. Kuyruğu dolan yavaş
+    istemcilerin bekleyen mesajları atılır ve tek bir `resync` olayı
+    gönderilir; istemci arada hiç okumadan bu MAX_LAG_EVENTS kez olursa
+    bağlantı kapatılır.
+    """
+
+    def __init__(self):
+        self._subscribers: Set[Subscriber] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped_subscribers = 0
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Dağıtımın yapılacağı event loop'u kaydeder (uygulama başlangıcında)."""
+        self._loop = loop
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self, site_ids: Optional[Iterable[int]] = None) -> Subscriber:
+        """Yeni bir abone oluşturur (event loop içinden çağrılmalı)."""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        subscriber = Subscriber(site_ids)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        """Aboneyi listeden çıkarır."""
+        subscriber.closed = True
+        self._subscribers.discard(subscriber)
+
+    def _encode(self, event: str, data: Dict[str, Any]) -> bytes:
+        with self._lock:
+            event_id = next(self._ids)
+        return b"id: %d\nevent: %s\ndata: %s\n\n" % (event_id, event.encode("utf-8"), dumps(data))
+
+    def publish(self, event: str, data: Dict[str, Any]) -> None:
+        """Olayı serileştirir ve abonelere dağıtılmak üzere loop'a iletir."""
+        loop = self._loop
+        if loop is None or loop.is_closed() or not self._subscribers:
+            return
+
+        frame = self._encode(event, data)
+        site_id = data.get("site_id")
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is loop:
+            self._fanout(frame, site_id)
+        else:
+            loop.call_soon_threadsafe(self._fanout, frame, site_id)
+
+    def _fanout(self, frame: bytes, site_id: Optional[int]) -> None:
+        self.published += 1
+        for subscriber in list(self._subscribers):
+            if subscriber.closed or not subscriber.wants(site_id):
+                continue
+            try:
+                subscriber.queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                self._handle_slow_subscriber(subscriber)
+
+    def _handle_slow_subscriber(self, subscriber: Subscriber) -> None:
+        """Yavaş aboneye geri basınç uygular: kuyruğu boşaltır, resync ister veya keser."""
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+
+        subscriber.lag_events += 1
+        if subscriber.lag_events >= MAX_LAG_EVENTS:
+            logger.warning("Yavaş SSE abonesi bağlantısı kesiliyor")
+            self.dropped_subscribers += 1
+            self.unsubscribe(subscriber)
+            subscriber.queue.put_nowait(_CLOSE)
+            return
+
+        subscriber.queue.put_nowait(self._encode("resync", {"reason": "lagging"}))
+
+    async def stream(self, subscriber: Subscriber) -> AsyncIterator[bytes]:
+        """Abonenin kuyruğunu SSE çerçeveleri olarak akıtır, boşta heartbeat gönderir."""
+        try:
+            yield b"retry: 5000\n\n"
+            while not subscriber.closed:
+                try:
+                    frame = await asyncio.wait_for(subscriber.queue.get(), timeout=HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                if frame is _CLOSE:
+                    break
+                subscriber.lag_events = 0
+                yield frame
+        finally:
+            self.unsubscribe(subscriber)
+
+
+# Global olay merkezi
+event_hub = EventHub()
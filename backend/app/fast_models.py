@@ -0,0 +1,287 @@
+"""
+Hafif tahmin modelleri – tek çekirdekte saniyeler içinde eğitilen mevsimsel-naif, fiziksel ve gradyan artırma modelleri
+"""
+from __future__ import annotations
+
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from .ml_models import AdvancedFeatureEngineer, BaseForecaster, ModelConfig, ModelFactory, RawFeatures
+from .services import calc_power
+
+# Otomatik seçim: ensemble'ın ayrılmış son ufuktaki MAE'sine göre tolerans (oran)
+MODEL_SELECTION_TOLERANCE = float(os.getenv("ML_MODEL_SELECTION_TOLERANCE", "0.1"))
+FAST_MODEL_TYPES = ("seasonal_naive", "physics", "gbm")
+
+# Gradyan artırma: eğitim kökenleri arası saat ve en fazla ağaç sayısı
+GBM_ORIGIN_STRIDE = max(int(os.getenv("ML_GBM_ORIGIN_STRIDE", "24")), 1)
+GBM_MAX_ITER = int(os.getenv("ML_GBM_MAX_ITER", "200"))
+
+# Unix epoch'u (1970-01-01) perşembedir; haftanın günü (pazartesi = 0) için kaydırma
+EPOCH_DAY_OF_WEEK = 3
+
+
+def _sorted(df: pd.DataFrame) -> pd.DataFrame:
+    """Özellik matrisiyle aynı sıra: (panelde) sahaya, sonra zamana göre."""
+    df = df.copy(deep=False)
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    return AdvancedFeatureEngineer._sort_series(df)[0]
+
+
+class SeasonalNaiveForecaster(BaseForecaster):
+    """Mevsimsel-naif model: son günlük veya haftalık profil ileriye tekrarlanır"""
+
+    model_type = "seasonal_naive"
+    cost_rank = 1
+    seasons = (24, 168)
+
+    def __init__(self, config: ModelConfig):
+        super().__init__(config)
+        self.season = max(self.seasons)
+
+    def required_history(self) -> int:
+        return self.season
+
+    def fit(self, df: pd.DataFrame, target_col: str = 'power_mw', raw_features: Optional[RawFeatures] = None,
+            callbacks: Optional[List[Any]] = None) -> None:
+        """Geçmişte en düşük tek-mevsim hatasını veren periyodu seçer"""
+        errors = {}
+        for season in self.seasons:
+            diffs = [
+                np.abs(values[season:] - values[:-season])[-self.config.horizon:]
+                for values in (group[target_col].to_numpy(dtype=np.float64)
+                               for _, group in _sorted(df).groupby('site_id', sort=False))
+                if len(values) > season
+            ]
+            if diffs:
+                errors[season] = float(np.nanmean(np.concatenate(diffs)))
+        self.season = min(errors, key=errors.get) if errors else min(self.seasons)
+        self.is_fitted = True
+        logger.info(f"Mevsimsel-naif model: periyot {self.season} saat (hatalar {errors})")
+
+    def predict(self, df: pd.DataFrame, target_col: str = 'power_mw', incremental: bool = True,
+                lean: bool = True) -> pd.DataFrame:
+        if not self.is_fitted:
+            raise ValueError("Model önce eğitilmelidir!")
+
+        history = _sorted(df)[target_col].to_numpy(dtype=np.float64)[-self.season:]
+        return pd.DataFrame({
+            'timestamp': self._future_timestamps(df),
+            'predicted_power_mw': np.resize(np.nan_to_num(history), self.config.horizon),
+        })
+
+
+class PhysicsForecaster(BaseForecaster):
+    """Fiziksel model: hava tahmininden `calc_power` güç eğrisi, saha başına kapasite ölçeğiyle
+
+    Saha tipi (rüzgar/güneş) ve efektif kapasite geçmiş üretime en küçük
+    kareler uyumuyla seçilir. Tahmin penceresinin hava verisi verilmezse son
+    ufkun havası ileriye taşınır.
+    """
+
+    model_type = "physics"
+    cost_rank = 2
+    site_types = ('wind', 'solar')
+
+    def __init__(self, config: ModelConfig):
+        super().__init__(config)
+        self.sites: Dict[Any, Dict[str, Any]] = {}
+        self.default: Dict[str, Any] = {'site_type': 'wind', 'scale': 0.0}
+
+    def required_history(self) -> int:
+        return self.config.horizon
+
+    @staticmethod
+    def _unit_power(weather: pd.DataFrame, site_type: str) -> np.ndarray:
+        """1 MW kapasite için güç eğrisi çıktısı."""
+        weather = weather[['wind_speed', 'ghi']].astype(float).fillna(0.0).reset_index(drop=True)
+        return calc_power(weather, 1.0, site_type)['power_mw'].to_numpy(dtype=np.float64)
+
+    def fit(self, df: pd.DataFrame, target_col: str = 'power_mw', raw_features: Optional[RawFeatures] = None,
+            callbacks: Optional[List[Any]] = None) -> None:
+        """Her saha için tip ve kapasite ölçeğini uydurur"""
+        for site_id, group in _sorted(df).groupby('site_id', sort=True):
+            actual = np.nan_to_num(group[target_col].to_numpy(dtype=np.float64))
+            best = None
+            for site_type in self.site_types:
+                unit = self._unit_power(group, site_type)
+                norm = float(unit @ unit)
+                scale = float(unit @ actual) / norm if norm > 0 else 0.0
+                sse = float(np.sum((actual - scale * unit) ** 2))
+                if best is None or sse < best['sse']:
+                    best = {'site_type': site_type, 'scale': max(scale, 0.0), 'sse': sse}
+            self.sites[site_id] = best
+        if self.sites:
+            self.default = min(self.sites.values(), key=lambda fit: fit['sse'])
+        self.is_fitted = True
+        logger.info(f"Fiziksel model uyduruldu: {len(self.sites)} saha")
+
+    def predict(self, df: pd.DataFrame, target_col: str = 'power_mw', incremental: bool = True,
+                lean: bool = True, weather: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """Ufuk için tahmin; `weather` (timestamp, wind_speed, ghi) verilirse onu kullanır"""
+        if not self.is_fitted:
+            raise ValueError("Model önce eğitilmelidir!")
+
+        df = _sorted(df)
+        site_id = df['site_id'].iloc[-1] if 'site_id' in df.columns else None
+        fit = self.sites.get(site_id, self.default)
+        timestamps = self._future_timestamps(df)
+        if weather is None:
+            # Kalıcılık: son ufkun havası bir ufuk ileri taşınır
+            recent = df[['wind_speed', 'ghi']].tail(self.config.horizon)
+            weather = pd.DataFrame({
+                column: np.resize(recent[column].to_numpy(dtype=np.float64), self.config.horizon)
+                for column in ('wind_speed', 'ghi')
+            })
+        else:
+            weather = (weather.set_index(pd.to_datetime(weather['timestamp']))[['wind_speed', 'ghi']]
+                       .reindex(timestamps).ffill().bfill().reset_index(drop=True))
+        return pd.DataFrame({
+            'timestamp': timestamps,
+            'predicted_power_mw': fit['scale'] * self._unit_power(weather, fit['site_type']),
+        })
+
+
+class GradientBoostingForecaster(BaseForecaster):
+    """scikit-learn gradyan artırma; tek model tüm ufku doğrudan tahmin eder
+
+    Her eğitim kökeninin özellikleri, hedef saatin takvim özellikleri ve ufuk
+    adımıyla birleştirilir (kökenler GBM_ORIGIN_STRIDE saatte bir).
+    """
+
+    model_type = "gbm"
+    cost_rank = 3
+
+    def __init__(self, config: ModelConfig):
+        super().__init__(config)
+        self.feature_engineer = AdvancedFeatureEngineer()
+        self.columns: List[str] = []
+        self.model = None
+
+    def required_history(self) -> int:
+        return self.feature_engineer.required_history(1)
+
+    def _origin_matrix(self, processed: pd.DataFrame) -> np.ndarray:
+        return processed[self.columns].to_numpy(dtype=np.float32)
+
+    def _design(self, origins: np.ndarray, timestamps: np.ndarray, steps: np.ndarray) -> np.ndarray:
+        """(köken, adım) çiftleri için köken özellikleri + adım + hedef saatin takvim özellikleri."""
+        hours = timestamps.astype('datetime64[h]').astype(np.int64)[:, None] + steps[None, :]
+        hour_of_day = hours % 24
+        day_of_week = (hours // 24 + EPOCH_DAY_OF_WEEK) % 7
+        calendar = np.stack([
+            np.broadcast_to(steps, hours.shape),
+            np.sin(2 * np.pi * hour_of_day / 24), np.cos(2 * np.pi * hour_of_day / 24),
+            np.sin(2 * np.pi * day_of_week / 7), np.cos(2 * np.pi * day_of_week / 7),
+        ], axis=-1).reshape(-1, 5).astype(np.float32)
+        return np.hstack([np.repeat(origins, len(steps), axis=0), calendar])
+
+    def fit(self, df: pd.DataFrame, target_col: str = 'power_mw', raw_features: Optional[RawFeatures] = None,
+            callbacks: Optional[List[Any]] = None) -> None:
+        """Kökenler x ufuk adımları üzerinde tek bir regresör eğitir"""
+        from sklearn.ensemble import HistGradientBoostingRegressor
+
+        if raw_features is not None:
+            processed = self.feature_engineer.fit_transform_raw(raw_features)
+        else:
+            processed = self.feature_engineer.fit_transform(df, [target_col])
+        self.columns = [col for col in processed.columns if col not in ('timestamp', 'id')]
+
+        features = self._origin_matrix(processed)
+        target = _sorted(df)[target_col].to_numpy(dtype=np.float64)
+        timestamps = processed['timestamp'].to_numpy()
+        sites = processed['site_id'].to_numpy() if 'site_id' in processed.columns else np.zeros(len(processed))
+        horizon = self.config.horizon
+        steps = np.arange(1, horizon + 1)
+
+        # Seri başına, hedefleri seri içinde kalan kökenler
+        starts = np.flatnonzero(np.r_[True, sites[1:] != sites[:-1]])
+        ends = np.r_[starts[1:], len(sites)]
+        origins = np.concatenate([np.arange(end - horizon - 1, start - 1, -GBM_ORIGIN_STRIDE)
+                                  for start, end in zip(starts, ends) if end - start > horizon])
+        if len(origins) == 0:
+            raise ValueError(f"Gradyan artırma için seri en az {horizon + 1} saat olmalı")
+
+        X = self._design(features[origins], timestamps[origins], steps)
+        y = target[origins[:, None] + steps[None, :]].ravel()
+        mask = np.isfinite(y)
+
+        self.model = HistGradientBoostingRegressor(max_iter=GBM_MAX_ITER, learning_rate=0.1, random_state=0)
+        self.model.fit(X[mask], y[mask])
+        self.is_fitted = True
+        logger.info(f"Gradyan artırma modeli eğitildi: {len(origins)} köken, {int(mask.sum())} satır")
+
+    def predict_panel(self, df: pd.DataFrame, target_col: str = 'power_mw', incremental: bool = True,
+                      lean: bool = True) -> pd.DataFrame:
+        if not self.is_fitted:
+            raise ValueError("Model önce eğitilmelidir!")
+
+        # Seri başına son satırın özellikleri tek çağrıda
+        last = self.feature_engineer.transform_tail(df, [target_col], 1)
+        steps = np.arange(1, self.config.horizon + 1)
+        timestamps = last['timestamp'].to_numpy()
+        values = self.model.predict(self._design(self._origin_matrix(last), timestamps, steps))
+
+        return pd.DataFrame({
+            'site_id': np.repeat(last['site_id'].to_numpy(), len(steps)),
+            'timestamp': (timestamps[:, None] + steps[None, :] * np.timedelta64(1, 'h')).ravel(),
+            'predicted_power_mw': np.maximum(values, 0.0),
+        })
+
+    def predict(self, df: pd.DataFrame, target_col: str = 'power_mw', incremental: bool = True,
+                lean: bool = True) -> pd.DataFrame:
+        return self.predict_panel(df, target_col).drop(columns='site_id')
+
+
+def holdout_error(model_type: str, config: ModelConfig, df: pd.DataFrame, target_col: str = 'power_mw') -> float:
+    """Her sahanın son ufkunu ayırıp kalanla eğitilen modelin ayrılmış ufuktaki MAE'si."""
+    df = _sorted(df)
+    position = df.groupby('site_id', sort=False).cumcount(ascending=False)
+    train, holdout = df[position >= config.horizon], df[position < config.horizon]
+
+    model = ModelFactory.create_model(model_type, config)
+    model.fit(train, target_col=target_col)
+    forecast = model.predict_panel(train, target_col=target_col)
+    merged = forecast.merge(holdout[['site_id', 'timestamp', target_col]], on=['site_id', 'timestamp'], how='inner')
+    if merged.empty:
+        raise ValueError("Ayrılmış ufuk ile tahminler hizalanamadı")
+    return float(np.mean(np.abs(merged[target_col].to_numpy() - merged['predicted_power_mw'].to_numpy())))
+
+
+def select_model_type(df: pd.DataFrame, config: ModelConfig, target_col: str = 'power_mw',
+                      tolerance: float = MODEL_SELECTION_TOLERANCE,
+                      candidates: Sequence[str] = FAST_MODEL_TYPES) -> Dict[str, Any]:
+    """Ensemble'ın ayrılmış ufuk MAE'sine tolerans içinde kalan en ucuz modeli seçer.
+
+    Seriler ensemble'ın girdi + doğrulama pencerelerine yetmiyorsa (veya ensemble
+    eğitilemezse) referans hafif modellerin en doğrusudur.
+    """
+    types = ModelFactory.model_types()
+    evaluated = list(candidates)
+    if int(df.groupby('site_id').size().min()) >= config.input_size + 2 * config.horizon:
+        evaluated.append('ensemble')
+
+    errors: Dict[str, float] = {}
+    for model_type in evaluated:
+        try:
+            errors[model_type] = holdout_error(model_type, config, df, target_col)
+        except Exception as exc:
+            logger.warning(f"{model_type} modeli değerlendirilemedi: {exc}")
+    if not errors:
+        raise ValueError("Hiçbir model değerlendirilemedi")
+
+    # Ensemble değerlendirilemediyse hafif modellerin en doğrusu referanstır
+    reference = errors.get('ensemble', min(errors.values()))
+    eligible = [name for name in candidates if name in errors and errors[name] <= reference * (1 + tolerance)]
+    chosen = min(eligible, key=lambda name: types[name].cost_rank) if eligible else 'ensemble'
+    logger.info(f"Model seçimi: {chosen} (MAE {errors}, referans {reference:.4f})")
+    return {
+        'model_type': chosen,
+        'holdout_mae': errors,
+        'reference_mae': reference,
+        'tolerance': tolerance,
+    }
@@ -0,0 +1,350 @@
+"""
+Özellik deposu – saha başına ölçeklenmemiş ML özelliklerini diskte (memmap) tutar, yalnızca yeni saatleri ekler
+"""
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from .ml_models import AdvancedFeatureEngineer, RawFeatures, feature_pipeline_version
+from .ml_service import _get_site_data
+from .models import ForecastRecord
+
+try:
+    import fcntl
+except ImportError:  # Windows: süreçler arası kilit yok
+    fcntl = None
+
+# Depo ayarları
+FEATURE_STORE_DIR = Path(os.getenv("ML_FEATURE_STORE_DIR", "./feature_store"))
+FEATURE_STORE_ENABLED = os.getenv("ML_FEATURE_STORE", "1").lower() in ("1", "true", "yes")
+# Yenileme döngüsü son tahminleri yeniden yazar; watermark'tan bu kadar saat geriye DB ile karşılaştırılır
+FEATURE_STORE_REWRITE_HOURS = int(os.getenv("ML_FEATURE_STORE_REWRITE_HOURS", "192"))
+
+TARGET_COLUMN = "power_mw"
+PASSTHROUGH_COLUMNS = ("timestamp", "site_id")
+
+
+class SiteFeatureStore:
+    """Tek sahanın özellik dosyaları.
+
+    timestamps.bin (int64 ns), inputs.bin (float64 ham girdiler; ekleme
+    sırasında lag/rolling bağlamı ve değişiklik tespiti için) ve features.bin
+    (float32 ham özellikler) yalnızca sona eklenir. Satır sayısı meta.json'a
+    en son ve atomik yazılır; yarım kalan eklemeler açılışta kırpılır.
+    Dosyalar yerinde küçültülmez: kırpma, boşaltma ve sıkıştırma yeni dosya
+    yazıp os.replace ile değiştirir, böylece okuyuculara verilen memmap'ler
+    kilit bırakıldıktan sonra da geçerli kalır (SIGBUS veya yeniden yazılmış
+    satır okunmaz).
+    """
+
+    FILES = (("timestamps.bin", np.int64), ("inputs.bin", np.float64), ("features.bin", np.float32))
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.meta: Optional[Dict[str, Any]] = None
+        meta_path = directory / "meta.json"
+        if meta_path.exists():
+            try:
+                self.meta = json.loads(meta_path.read_text(encoding="utf-8"))
+                self._truncate_files(self.meta["rows"])
+            except (OSError, ValueError, KeyError):
+                logger.warning(f"Bozuk özellik deposu yeniden oluşturulacak: {directory}")
+                self.meta = None
+
+    @property
+    def rows(self) -> int:
+        return self.meta["rows"] if self.meta else 0
+
+    def _widths(self) -> Tuple[int, int, int]:
+        return 1, len(self.meta["input_columns"]), len(self.meta["feature_columns"])
+
+    def _write_meta(self) -> None:
+        path = self.directory / "meta.json"
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.meta), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def _replace_file(self, name: str, data: bytes) -> None:
+        tmp_path = self.directory / f"{name}.tmp"
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, self.directory / name)
+
+    def _truncate_files(self, rows: int) -> None:
+        for (name, dtype), width in zip(self.FILES, self._widths()):
+            path = self.directory / name
+            size = rows * width * np.dtype(dtype).itemsize
+            if not path.exists() or path.stat().st_size < size:
+                raise ValueError(f"{name} eksik")
+            if path.stat().st_size > size:
+                with open(path, "rb") as f:
+                    self._replace_file(name, f.read(size))
+
+    def _memmap(self, index: int) -> np.ndarray:
+        name, dtype = self.FILES[index]
+        width = self._widths()[index]
+        if self.rows == 0:
+            return np.empty((0, width), dtype=dtype)
+        return np.memmap(self.directory / name, dtype=dtype, mode="r", shape=(self.rows, width))
+
+    def timestamps(self) -> np.ndarray:
+        """Satır zaman damgaları (int64 ns, artan)."""
+        return self._memmap(0)[:, 0]
+
+    def inputs(self) -> np.ndarray:
+        return self._memmap(1)
+
+    def features(self) -> np.ndarray:
+        return self._memmap(2)
+
+    def reset(self, meta: Dict[str, Any]) -> None:
+        """Depoyu verilen şema ile boşaltır."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for name, _ in self.FILES:
+            self._replace_file(name, b"")
+        self.meta = {**meta, "rows": 0}
+        self._write_meta()
+
+    def append(self, timestamps: np.ndarray, inputs: np.ndarray, features: np.ndarray) -> None:
+        """Satırları dosyaların sonuna ekler; satır sayısı en son güncellenir."""
+        arrays = (timestamps.reshape(-1, 1), inputs, features)
+        for (name, dtype), array in zip(self.FILES, arrays):
+            with open(self.directory / name, "ab") as f:
+                f.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+        self.meta["rows"] += len(timestamps)
+        self.meta["updated_at"] = datetime.utcnow().isoformat()
+        self._write_meta()
+
+    def truncate(self, rows: int) -> None:
+        """İlk `rows` satırı tutar (yeniden yazılan tahminler için)."""
+        self.meta["rows"] = rows
+        self._write_meta()
+        self._truncate_files(rows)
+
+    def compact(self, start: int) -> None:
+        """İlk `start` satırı (DB'den silinmiş geçmiş) dosyalardan atar."""
+        arrays = [np.array(self._memmap(i)[start:]) for i in range(len(self.FILES))]
+        rows = self.rows - start
+        for (name, _), array in zip(self.FILES, arrays):
+            self._replace_file(name, array.tobytes())
+        self.meta["rows"] = rows
+        self._write_meta()
+
+
+class FeatureStore:
+    """Özellik sürümüne göre anahtarlanan, saha başına artımlı özellik deposu.
+
+    İlk senkronizasyonda sahanın tüm geçmişi için ham (ölçeklenmemiş)
+    özellikler hesaplanır. Sonrakilerde watermark'tan
+    FEATURE_STORE_REWRITE_HOURS geriye kadar olan satırlar DB ile
+    karşılaştırılır; değişen ilk satırdan itibaren kesilir ve yalnızca yeni
+    saatler, önceki `lookback` satır bağlam alınarak eklenir. Özellik tanımı
+    değişince (`feature_pipeline_version`) eski sürüm dizinleri silinir.
+    """
+
+    def __init__(self, root: Path = FEATURE_STORE_DIR, version: Optional[str] = None):
+        self.root = root
+        self.version = version or feature_pipeline_version()
+        self.directory = root / self.version
+        self.engineer = AdvancedFeatureEngineer()
+        self._locks: Dict[int, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self._purged = False
+
+    def _purge_stale_versions(self) -> None:
+        if self._purged or not self.root.exists():
+            return
+        for path in self.root.iterdir():
+            if path.is_dir() and path.name != self.version:
+                logger.info(f"Eski özellik deposu sürümü siliniyor: {path.name}")
+                shutil.rmtree(path, ignore_errors=True)
+        self._purged = True
+
+    @contextmanager
+    def _site_lock(self, site_id: int) -> Iterator[None]:
+        """Aynı sahaya thread'ler ve (eğitim worker'ları gibi) süreçler arasında tek yazar."""
+        with self._locks_guard:
+            lock = self._locks.setdefault(site_id, threading.Lock())
+        with lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(self.directory / f"site_{site_id}.lock", "w") as handle:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _schema(self, df: pd.DataFrame, raw: RawFeatures) -> Dict[str, Any]:
+        extra = [col for col in raw.frame.columns if col not in PASSTHROUGH_COLUMNS]
+        if extra:
+            raise ValueError(f"Özellik deposu sayısal olmayan sütunları saklayamaz: {extra}")
+        return {
+            "version": self.version,
+            "source_columns": list(df.columns),
+            "input_columns": [col for col in df.columns if col not in PASSTHROUGH_COLUMNS],
+            "order": raw.order,
+            "feature_columns": raw.columns,
+        }
+
+    def _append_frame(self, store: SiteFeatureStore, df: pd.DataFrame, skip: int = 0) -> int:
+        """`df` için ham özellikleri hesaplayıp ilk `skip` (bağlam) satırı hariç ekler."""
+        raw = self.engineer.raw_features(df, [TARGET_COLUMN])
+        if store.meta is None:
+            store.reset(self._schema(df, raw))
+        new = raw.frame.iloc[skip:]
+        if new.empty:
+            return 0
+        inputs = df.loc[new.index, store.meta["input_columns"]].to_numpy(dtype=np.float64, na_value=np.nan)
+        store.append(
+            new["timestamp"].to_numpy(dtype="datetime64[ns]").view(np.int64),
+            inputs,
+            raw.matrix[skip:],
+        )
+        return len(new)
+
+    def _context_frame(self, store: SiteFeatureStore, site_id: int, start: int, end: int) -> pd.DataFrame:
+        """Depodaki [start, end) satırlarını loader ile aynı sütun düzeninde DataFrame'e çevirir."""
+        data: Dict[str, Any] = {
+            "timestamp": store.timestamps()[start:end].view("datetime64[ns]"),
+            "site_id": np.full(end - start, site_id, dtype=np.int64),
+        }
+        inputs = np.array(store.inputs()[start:end])
+        for j, col in enumerate(store.meta["input_columns"]):
+            data[col] = inputs[:, j]
+        return pd.DataFrame({col: data[col] for col in store.meta["source_columns"]})
+
+    def _sync_locked(self, db: Session, site_id: int) -> SiteFeatureStore:
+        store = SiteFeatureStore(self.directory / f"site_{site_id}")
+        if store.meta is not None and store.meta.get("version") != self.version:
+            store.meta = None
+
+        if store.rows == 0:
+            # İlk yükleme: tüm geçmiş
+            df = _get_site_data(db, site_id)
+            store.meta = None
+            added = self._append_frame(store, df)
+            logger.info(f"Özellik deposu oluşturuldu | site_id={site_id} rows={added}")
+            return store
+
+        timestamps = store.timestamps()
+        watermark = pd.Timestamp(int(timestamps[-1]))
+        check_from = (watermark - timedelta(hours=FEATURE_STORE_REWRITE_HOURS)).to_pydatetime()
+        try:
+            fresh = _get_site_data(db, site_id, start=check_from)
+        except ValueError:
+            fresh = None
+
+        if fresh is not None and list(fresh.columns) != store.meta["source_columns"]:
+            # Loader şeması değişti: depo baştan kurulur
+            store.reset(store.meta)
+            return self._sync_locked(db, site_id)
+
+        # Yeniden yazılmış veya silinmiş satırlar: ilk farklı satırdan itibaren kes
+        first = int(np.searchsorted(timestamps, np.datetime64(check_from, "ns").view(np.int64)))
+        stored_ts = timestamps[first:]
+        stored_inputs = store.inputs()[first:]
+        if fresh is None:
+            fresh_ts = np.empty(0, dtype=np.int64)
+            fresh_inputs = np.empty((0, stored_inputs.shape[1]))
+        else:
+            fresh_ts = fresh["timestamp"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+            fresh_inputs = fresh[store.meta["input_columns"]].to_numpy(dtype=np.float64, na_value=np.nan)
+
+        m = min(len(stored_ts), len(fresh_ts))
+        same = (stored_ts[:m] == fresh_ts[:m]) & (
+            (stored_inputs[:m] == fresh_inputs[:m]) | (np.isnan(stored_inputs[:m]) & np.isnan(fresh_inputs[:m]))
+        ).all(axis=1)
+        diff = int(np.argmin(same)) if not same.all() else m
+        keep = first + diff
+        if keep < store.rows:
+            store.truncate(keep)
+
+        if fresh is None or diff >= len(fresh):
+            return store
+
+        # Yeni saatler: önceki lookback satırı bağlam olarak eklenip hesaplanır
+        context_start = max(keep - self.engineer.lookback, 0)
+        context = self._context_frame(store, site_id, context_start, keep)
+        new_rows = fresh.iloc[diff:]
+        combined = pd.concat([context, new_rows], ignore_index=True)
+        added = self._append_frame(store, combined, skip=len(context))
+        logger.debug(f"Özellik deposu güncellendi | site_id={site_id} +{added} satır")
+        return store
+
+    def sync(self, db: Session, site_id: int) -> SiteFeatureStore:
+        """Sahanın deposunu DB ile eşitler (yalnızca watermark sonrası ve yeniden yazılan saatler)."""
+        self._purge_stale_versions()
+        with self._site_lock(site_id):
+            return self._sync_locked(db, site_id)
+
+    def _site_ids(self, db: Session) -> List[int]:
+        return list(db.exec(select(ForecastRecord.site_id).distinct().order_by(ForecastRecord.site_id)).all())
+
+    def read(self, db: Session, site_ids: Optional[List[int]] = None) -> Tuple[pd.DataFrame, RawFeatures]:
+        """Sahaları eşitleyip ham girdileri ve memmap'li ham özellikleri döndürür.
+
+        DB'den silinmiş eski saatler okunmaz, böylece eğitim satırları DB ile
+        aynı kalır (ilk satırların lag/rolling değerleri silinen geçmişten
+        hesaplanmış olarak korunur); bu satırlar dosyaların yarısını geçince
+        sıkıştırılır.
+        """
+        if site_ids is None:
+            site_ids = self._site_ids(db)
+        self._purge_stale_versions()
+
+        frames: List[pd.DataFrame] = []
+        matrices: List[np.ndarray] = []
+        store: Optional[SiteFeatureStore] = None
+        for site_id in site_ids:
+            # Eşitleme ve satır aralığı aynı kilit altında alınır; dönen memmap
+            # yalnızca sona eklenen (hiç küçültülmeyen) dosyayı gösterir
+            with self._site_lock(site_id):
+                try:
+                    store = self._sync_locked(db, site_id)
+                except ValueError:
+                    # Verisi olmayan saha panelden çıkarılır (DB yükleyicisiyle aynı)
+                    continue
+                oldest = db.exec(select(func.min(ForecastRecord.timestamp)).where(ForecastRecord.site_id == site_id)).one()
+                start = 0
+                if oldest is not None:
+                    start = int(np.searchsorted(store.timestamps(), np.datetime64(oldest, "ns").view(np.int64)))
+                    if start > store.rows // 2:
+                        store.compact(start)
+                        start = 0
+                frames.append(self._context_frame(store, site_id, start, store.rows))
+                matrices.append(store.features()[start:])
+
+        if not frames:
+            raise ValueError("Seçilen saha için yeterli veri bulunamadı")
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        matrix = np.concatenate(matrices) if len(matrices) > 1 else matrices[0]
+        raw = RawFeatures(
+            frame=df[list(PASSTHROUGH_COLUMNS)],
+            order=store.meta["order"],
+            columns=store.meta["feature_columns"],
+            matrix=matrix,
+        )
+        return df, raw
+
+    def invalidate(self, site_id: Optional[int] = None) -> None:
+        """Bir sahanın (veya tüm sürümün) deposunu siler."""
+        target = self.directory if site_id is None else self.directory / f"site_{site_id}"
+        shutil.rmtree(target, ignore_errors=True)
+
+
+# Global özellik deposu
+feature_store = FeatureStore()
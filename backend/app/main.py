@@ -1,24 +1,44 @@
 import os
+import asyncio
 from contextlib import asynccontextmanager
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator
 from datetime import datetime
 
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, Query
+from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, Header, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
+import numpy as np
+import pandas as pd
 from sqlmodel import Session, SQLModel, create_engine
 from pydantic import BaseModel
 
 from .models import Site, BatteryConfig, create_db_and_tables, get_engine
 from .crud import (
-    get_sites, get_site, create_site, update_site, 
-    get_forecast, create_or_update_battery_config, get_battery_config
+    get_sites, get_site, get_site_rows, create_site, update_site, 
+    create_or_update_battery_config, get_battery_config,
+    iter_fleet_forecasts, get_forecast_frame, get_forecast_aggregated,
+    replace_site_forecasts, AGGREGATION_BUCKETS, FORECAST_FRAME_COLUMNS
 )
-from .services import fetch_forecast, calc_power, calc_revenue, calc_co2, battery_dispatch
-from .tasks import start_background_tasks  # , generate_pdf_report
-from .ml_service import train_model, predict_next_week
-from .scheduler import price_scheduler
+from .services import (
+    fetch_forecast, calc_power, calc_revenue, calc_co2, battery_dispatch,
+    aggregate_forecast, lttb_downsample, lttb_indices
+)
+from .tasks import start_background_tasks, update_forecasts  # , generate_pdf_report
+# ML yığını (ml_service -> ml_models -> sklearn/torch) yalnızca /api/ml route'larında import edilir
+from .scheduler import batch_prediction_scheduler, price_scheduler
 from .price_scraper import update_electricity_prices
+from .cache import forecast_cache, forecast_flights, build_cached_response
+from .events import event_hub
+from .drift import drift_monitor
+from .training import training_jobs
+from .metrics import registry, install_sqlalchemy_metrics, MetricsMiddleware, CONTENT_TYPE
+from .profiling import (
+    ProfilingMiddleware, profile_store, capture, admin_token_valid, PROFILE_ADMIN_TOKEN
+)
+from .responses import (
+    MEDIA_TYPES, FastJSONResponse, negotiate_format, encode_frame,
+    frame_to_records, iso_timestamps, dumps
+)
 
 # Uluslararasılaştırma için metin sözlüğü
 TEXTS = {
@@ -41,23 +61,45 @@ def get_db():
         yield session
 
 
+ML_PRELOAD = os.getenv("ML_PRELOAD", "").lower() in ("1", "true", "yes")
+
+
+def _preload_ml_stack() -> None:
+    """ML modüllerini import eder; hata uygulamayı durdurmaz."""
+    try:
+        from .ml_service import preload
+        preload()
+    except Exception as error:
+        print(f"ML preload error: {str(error)}")
+
+
 # FastAPI uygulama yaşam döngüsü
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Başlangıçta veritabanı tablolarını oluştur
     create_db_and_tables()
     
+    # Olay yayını için event loop'u kaydet (scheduler thread'inden de yayın yapılır)
+    event_hub.bind_loop(asyncio.get_running_loop())
+    
     # Arka plan görevlerini başlat
     background_tasks = BackgroundTasks()
     start_background_tasks(background_tasks, get_db)
     
-    # Elektrik fiyatı scheduler'ını başlat
+    # Elektrik fiyatı ve gece toplu tahmin scheduler'larını başlat
     price_scheduler.start()
+    batch_prediction_scheduler.start()
+    
+    # ML yığını varsayılan olarak ilk /api/ml isteğinde yüklenir; ML_PRELOAD=1 ise arka planda önceden
+    if ML_PRELOAD:
+        asyncio.get_running_loop().run_in_executor(None, _preload_ml_stack)
     
     yield
     
     # Uygulama kapanırken yapılacak işlemler
     price_scheduler.stop()
+    batch_prediction_scheduler.stop()
+    training_jobs.shutdown()
 
 
 # FastAPI uygulaması oluştur
@@ -68,6 +110,38 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# İstek süresi metrikleri ve SQL sorgu dinleyicileri
+install_sqlalchemy_metrics()
+app.add_middleware(MetricsMiddleware)
+
+# İsteğe bağlı örneklemeli profiler (admin başlığı veya gecikme eşiği ile)
+app.add_middleware(ProfilingMiddleware)
+
+# Kazıma anında okunan önbellek ve yayın göstergeleri
+registry.gauge_callback(
+    "greenfleet_forecast_cache",
+    "Tahmin yanıt önbelleği durumu",
+    lambda: {(name,): value for name, value in forecast_cache.stats().items()},
+    ("field",),
+)
+registry.gauge_callback(
+    "greenfleet_single_flight",
+    "Birleştirilen eşzamanlı tahmin hesaplamaları",
+    lambda: {("leaders",): forecast_flights.leaders, ("followers",): forecast_flights.followers},
+    ("role",),
+)
+registry.gauge_callback(
+    "greenfleet_sse_subscribers",
+    "Bağlı SSE abonesi sayısı",
+    lambda: {(): event_hub.subscriber_count},
+)
+registry.gauge_callback(
+    "greenfleet_ml_drift_psi",
+    "Saha girdilerinin ve tahmin hatasının referansa göre PSI değeri",
+    drift_monitor.gauge,
+    ("site_id", "feature"),
+)
+
 # CORS ayarları
 app.add_middleware(
     CORSMiddleware,
@@ -110,10 +184,22 @@ async def root():
     return {"message": TEXTS["en"]["welcome"]}
 
 
+# Liste yanıtında doğrudan seçilen sütunlar (SiteResponse şemasıyla birebir)
+SITE_RESPONSE_FIELDS = tuple(SiteResponse.__fields__)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metin formatında metrikler"""
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
+
+
 @app.get("/api/sites", response_model=List[SiteResponse])
 async def read_sites(db: Session = Depends(get_db)):
     """Tüm sahaları listeler."""
-    return await get_sites(db)
+    # Satırlar SiteResponse alanlarıyla seçildiği için eleman bazında doğrulama yapılmaz
+    rows = await get_site_rows(db, SITE_RESPONSE_FIELDS)
+    return FastJSONResponse([dict(zip(SITE_RESPONSE_FIELDS, row)) for row in rows])
 
 
 @app.post("/api/sites", response_model=SiteResponse)
@@ -128,89 +214,271 @@ async def read_site(site_id: int, db: Session = Depends(get_db)):
     return await get_site(db, site_id)
 
 
+@app.get("/api/forecast")
+async def read_fleet_forecast(
+    site_ids: Optional[List[int]] = Query(None, description="Site ids to include (repeatable)"),
+    country: Optional[str] = Query(None, description="Country filter, e.g. 'TR'"),
+    site_type: Optional[str] = Query(None, description="Site type filter: 'wind' or 'solar'"),
+    start_time: Optional[datetime] = Query(None, description="Start of time range (default: now)"),
+    end_time: Optional[datetime] = Query(None, description="End of time range (default: start + 7 days)"),
+    battery: bool = Query(False, description="Include battery fields"),
+    bucket: Optional[str] = Query(None, regex="^(1h|3h|6h|1d)$", description="Aggregation bucket: '1h', '3h', '6h' or '1d'"),
+    agg: str = Query("mean", regex="^(sum|mean|min|max)$", description="Aggregation: 'sum', 'mean', 'min' or 'max' ('sum' totals power, revenue, CO₂ and battery power; other fields are averaged)"),
+    downsample: Optional[int] = Query(None, ge=3, description="Downsample each site to N points (LTTB on power_mw)"),
+    format: str = Query("ndjson", regex="^(ndjson|json)$", description="'ndjson' or chunked 'json'"),
+):
+    """Filtrelenen tüm sahaların tahminlerini saha bazında gruplayıp akış olarak döndürür."""
+    if site_type is not None and site_type not in ["wind", "solar"]:
+        raise HTTPException(status_code=400, detail=TEXTS["en"]["invalid_type"])
+    
+    chunks = _iter_fleet_chunks(
+        site_ids, country, site_type, start_time, end_time, battery,
+        bucket, agg, downsample, format
+    )
+    media_type = "application/x-ndjson" if format == "ndjson" else "application/json"
+    return StreamingResponse(chunks, media_type=media_type)
+
+
+def _iter_fleet_chunks(
+    site_ids: Optional[List[int]],
+    country: Optional[str],
+    site_type: Optional[str],
+    start_time: Optional[datetime],
+    end_time: Optional[datetime],
+    battery: bool,
+    bucket: Optional[str],
+    agg: str,
+    downsample: Optional[int],
+    fmt: str,
+) -> Iterator[bytes]:
+    """Filo tahminlerini saha başına bir JSON nesnesi olarak parça parça üretir."""
+    # Yanıt akarken istek bağımlılıkları kapanmış olur; oturumu burada aç
+    with Session(get_engine()) as db:
+        groups = iter_fleet_forecasts(
+            db,
+            site_ids=site_ids,
+            country=country,
+            site_type=site_type,
+            start_time=start_time,
+            end_time=end_time,
+            bucket=bucket,
+            agg=agg,
+        )
+        
+        if fmt == "json":
+            yield b"["
+        
+        first = True
+        for site_info, rows in groups:
+            if downsample:
+                rows = _downsample_rows(list(rows), downsample)
+            payload = {
+                "site_id": site_info["id"],
+                "site_name": site_info["name"],
+                "country": site_info["country"],
+                "capacity_mw": site_info["capacity_mw"],
+                "site_type": site_info["site_type"],
+                "forecasts": [
+                    {
+                        "timestamp": timestamp.isoformat(),
+                        "wind_speed": wind_speed,
+                        "ghi": ghi,
+                        "power_mw": power_mw,
+                        "revenue_eur": revenue_eur,
+                        "co2_saved_kg": co2_saved_kg,
+                        "battery_soc": battery_soc if battery else None,
+                        "battery_power_mw": battery_power_mw if battery else None,
+                    }
+                    for (timestamp, wind_speed, ghi, power_mw, revenue_eur,
+                         co2_saved_kg, battery_soc, battery_power_mw) in rows
+                ],
+            }
+            chunk = dumps(payload)
+            
+            if fmt == "ndjson":
+                yield chunk + b"\n"
+            else:
+                yield chunk if first else b"," + chunk
+            first = False
+        
+        if fmt == "json":
+            yield b"]"
+
+
+def _downsample_rows(rows: List[tuple], n_out: int) -> List[tuple]:
+    """Filo akışındaki (timestamp, ..., power_mw, ...) satırlarını LTTB ile indirger."""
+    if len(rows) <= n_out:
+        return rows
+    x = np.array([row[0].timestamp() for row in rows], dtype=np.float64)
+    power_idx = FORECAST_FRAME_COLUMNS.index("power_mw")
+    y = np.array([row[power_idx] for row in rows], dtype=np.float64)
+    return [rows[i] for i in lttb_indices(x, y, n_out)]
+
+
 @app.get("/api/forecast/{site_id}")
 async def read_forecast(
+    request: Request,
     site_id: int, 
     type: str = Query(..., description="Forecast type: 'wind' or 'solar'"),
     battery: bool = Query(False, description="Include battery simulation"),
+    bucket: Optional[str] = Query(None, regex="^(1h|3h|6h|1d)$", description="Aggregation bucket: '1h', '3h', '6h' or '1d'"),
+    agg: str = Query("mean", regex="^(sum|mean|min|max)$", description="Aggregation: 'sum', 'mean', 'min' or 'max' ('sum' totals power, revenue, CO₂ and battery power; other fields are averaged)"),
+    downsample: Optional[int] = Query(None, ge=3, description="Downsample the series to N points (LTTB on power_mw)"),
+    format: Optional[str] = Query(None, description="'json', 'arrow' or 'parquet' (default: Accept header)"),
     db: Session = Depends(get_db)
 ):
     """Belirli bir saha için tahmin verilerini döndürür."""
-    # Sahayı kontrol et
-    site = await get_site(db, site_id)
-    
     # Tahmin türünü kontrol et
     if type not in ["wind", "solar"]:
         raise HTTPException(status_code=400, detail=TEXTS["en"]["invalid_type"])
     
-    # Veritabanından tahminleri al
-    forecasts = await get_forecast(db, site_id)
+    fmt = negotiate_format(request, format)
+    variant = (fmt, bucket, agg if bucket else None, downsample)
     
-    # Tahmin yoksa veya güncel değilse yeniden hesapla
-    if not forecasts:
-        # Tahmin verilerini çek
-        forecast_df = await fetch_forecast(site.latitude, site.longitude)
-        
-        # Güç hesapla
-        forecast_df = calc_power(forecast_df, site.capacity_mw, site.site_type)
-        
-        # Gelir hesapla
-        forecast_df = calc_revenue(forecast_df, site.country)
-        
-        # CO₂ tasarrufu hesapla
-        forecast_df = calc_co2(forecast_df, site.country)
-        
-        # Batarya simülasyonu isteniyorsa
-        if battery:
-            battery_config = await get_battery_config(db, site_id)
-            
-            if battery_config:
-                forecast_df = battery_dispatch(
-                    forecast_df,
-                    battery_config.capacity_mwh,
-                    battery_config.power_mw,
-                    battery_config.initial_soc
-                )
-            else:
-                # Varsayılan batarya konfigürasyonu ile simülasyon yap
-                forecast_df = battery_dispatch(forecast_df)
-        
-        # DataFrame'i JSON'a dönüştür
-        forecast_data = forecast_df.to_dict(orient="records")
-        return {
-            "site_id": site_id,
-            "site_name": site.name,
-            "country": site.country,
-            "capacity_mw": site.capacity_mw,
-            "site_type": site.site_type,
-            "forecasts": forecast_data
-        }
+    # Önbellekte güncel gövde varsa DB'ye gitmeden döndür (304 veya 200)
+    cached = forecast_cache.get(site_id, battery, variant=variant)
+    if cached is not None:
+        return build_cached_response(request, cached)
     
-    # Veritabanından alınan tahminleri döndür
-    forecast_data = [
-        {
-            "timestamp": f.timestamp.isoformat(),
-            "wind_speed": f.wind_speed,
-            "ghi": f.ghi,
-            "power_mw": f.power_mw,
-            "revenue_eur": f.revenue_eur,
-            "co2_saved_kg": f.co2_saved_kg,
-            "battery_soc": f.battery_soc if battery else None,
-            "battery_power_mw": f.battery_power_mw if battery else None
-        }
-        for f in forecasts
-    ]
+    # Gövdeyi üretmeden önce veri versiyonunu oku
+    version = forecast_cache.data_version(site_id)
+    site, forecast_df = await _build_forecast_frame(
+        db, site_id, battery, bucket=bucket, agg=agg, downsample=downsample
+    )
+    if fmt == "json":
+        body = dumps({**_site_metadata(site), "forecasts": frame_to_records(forecast_df)})
+    else:
+        body = encode_frame(forecast_df, fmt, metadata=_site_metadata(site))
     
+    cached = forecast_cache.set(
+        site_id, battery, body,
+        media_type=MEDIA_TYPES[fmt], variant=variant, version=version
+    )
+    return build_cached_response(request, cached)
+
+
+def _site_metadata(site: Site) -> Dict[str, Any]:
+    """Yanıtlara eklenen saha bilgisi."""
     return {
-        "site_id": site_id,
+        "site_id": site.id,
         "site_name": site.name,
         "country": site.country,
         "capacity_mw": site.capacity_mw,
         "site_type": site.site_type,
-        "forecasts": forecast_data
     }
 
 
+async def _compute_forecast_frame(db: Session, site: Site) -> pd.DataFrame:
+    """Saklı tahmin yoksa hava tahmininden güç, gelir ve CO₂ zincirini hesaplar.
+
+    Saklanacak satırlar `update_forecasts` ile aynı üretilir: batarya
+    simülasyonu yalnızca sahanın batarya konfigürasyonu varsa yapılır.
+    """
+    # Tahmin verilerini çek
+    forecast_df = await fetch_forecast(site.latitude, site.longitude)
+    
+    # Güç hesapla
+    forecast_df = calc_power(forecast_df, site.capacity_mw, site.site_type)
+    
+    # Gelir hesapla
+    forecast_df = calc_revenue(forecast_df, site.country)
+    
+    # CO₂ tasarrufu hesapla
+    forecast_df = calc_co2(forecast_df, site.country)
+    
+    # Batarya varsa simülasyon yap
+    battery_config = await get_battery_config(db, site.id)
+    if battery_config:
+        forecast_df = battery_dispatch(
+            forecast_df,
+            battery_config.capacity_mwh,
+            battery_config.power_mw,
+            battery_config.initial_soc
+        )
+    
+    return forecast_df
+
+
+async def _compute_and_store_forecast(site: Site) -> pd.DataFrame:
+    """Eksik tahminleri hesaplar ve ForecastRecord'a yazar (single-flight).
+
+    Aynı saha için eşzamanlı gelen istekler (batarya bayrağından bağımsız)
+    tek bir Open-Meteo çağrısı ve hesaplama zincirini paylaşır. Sonuç
+    tabloya yazıldığı için sonraki istekler doğrudan veritabanından sunulur.
+    Dönen DataFrame istekler arasında paylaşılır, değiştirilmemelidir.
+    """
+    site_id = site.id
+    
+    async def compute() -> pd.DataFrame:
+        # İstek oturumundan bağımsız çalışsın diye kendi oturumunu açar
+        with Session(get_engine()) as db:
+            site_row = await get_site(db, site_id)
+            forecast_df = await _compute_forecast_frame(db, site_row)
+            await replace_site_forecasts(db, site_id, forecast_df)
+        return forecast_df
+    
+    return await forecast_flights.do(site_id, compute)
+
+
+async def _apply_battery_view(db: Session, site_id: int, forecast_df: pd.DataFrame, battery: bool) -> pd.DataFrame:
+    """Yeni hesaplanan (paylaşılan) tahmine isteğin batarya görünümünü kopya üzerinde uygular."""
+    if not battery:
+        forecast_df = forecast_df.copy()
+        forecast_df[["battery_soc", "battery_power_mw"]] = np.nan
+        return forecast_df
+    if await get_battery_config(db, site_id):
+        return forecast_df
+    # Konfigürasyonsuz sahada varsayılan batarya ile simülasyon yalnızca yanıta eklenir, saklanmaz
+    return battery_dispatch(forecast_df)
+
+
+async def _build_forecast_frame(
+    db: Session,
+    site_id: int,
+    battery: bool,
+    bucket: Optional[str] = None,
+    agg: str = "mean",
+    downsample: Optional[int] = None,
+):
+    """Saha ve tahminleri sütun bazlı DataFrame olarak döndürür (tüm formatlar için).
+
+    `bucket` verilirse saklı tahminler SQL tarafında toplanır; `downsample`
+    verilirse seri LTTB ile en fazla N noktaya indirilir.
+    """
+    site = await get_site(db, site_id)
+    
+    if bucket:
+        forecast_df = await get_forecast_aggregated(db, site_id, bucket, agg)
+    else:
+        forecast_df = await get_forecast_frame(db, site_id)
+    
+    if forecast_df.empty:
+        forecast_df = await _compute_and_store_forecast(site)
+        forecast_df = await _apply_battery_view(db, site_id, forecast_df, battery)
+        if bucket:
+            forecast_df = aggregate_forecast(forecast_df, AGGREGATION_BUCKETS[bucket], agg)
+    elif not battery:
+        forecast_df[["battery_soc", "battery_power_mw"]] = np.nan
+    
+    if downsample:
+        forecast_df = lttb_downsample(forecast_df, downsample)
+    
+    return site, forecast_df
+
+
+@app.get("/api/stream")
+async def stream_updates(
+    site_ids: Optional[List[int]] = Query(None, description="Only notify about these sites (repeatable)"),
+):
+    """Tahmin ve fiyat güncellemelerini Server-Sent Events olarak yayınlar."""
+    subscriber = event_hub.subscribe(site_ids)
+    return StreamingResponse(
+        event_hub.stream(subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.post("/api/sites/{site_id}/battery")
 async def configure_battery(
     site_id: int,
@@ -224,6 +492,9 @@ async def configure_battery(
     # Batarya konfigürasyonunu oluştur veya güncelle
     battery_config = await create_or_update_battery_config(db, site_id, config.dict())
     
+    # Batarya simülasyonu yanıtı değiştirdiği için önbelleği geçersiz kıl
+    forecast_cache.invalidate(site_id)
+    
     return {
         "site_id": site_id,
         "capacity_mwh": battery_config.capacity_mwh,
@@ -318,30 +589,319 @@ async def get_price_update_status():
         raise HTTPException(status_code=500, detail=f"Durum sorgulama hatası: {str(e)}")
 
 
+# ---------------- Profiling (Admin) ----------------
+
+def require_profile_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """Profil endpoint'leri için admin anahtarını doğrular."""
+    if not PROFILE_ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Profil yönetimi kapalı (PROFILE_ADMIN_TOKEN tanımlı değil)")
+    if not admin_token_valid(x_admin_token):
+        raise HTTPException(status_code=403, detail="Geçersiz admin anahtarı")
+
+
+@app.get("/api/admin/profiles", dependencies=[Depends(require_profile_admin)])
+async def list_profiles():
+    """Son kaydedilen profilleri listeler."""
+    return {"profiles": profile_store.list(), "skipped": profile_store.skipped}
+
+
+@app.post("/api/admin/profiles/refresh", dependencies=[Depends(require_profile_admin)])
+async def profile_refresh_cycle(db: Session = Depends(get_db)):
+    """Tek bir update_forecasts döngüsünü profilleyerek çalıştırır."""
+    async with capture("update_forecasts", trigger="refresh") as name:
+        if name is None:
+            raise HTTPException(status_code=429, detail="Profil sınırı aşıldı veya başka bir profil sürüyor")
+        result = await update_forecasts(db)
+    return {"profile": name, "result": result}
+
+
+@app.get("/api/admin/profiles/{name}", dependencies=[Depends(require_profile_admin)])
+async def download_profile(name: str):
+    """Profil dosyasını speedscope JSON olarak döndürür."""
+    path = profile_store.path_for(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profil bulunamadı")
+    return FileResponse(path, media_type="application/json", filename=name)
+
+
 # ---------------- ML Endpoints ----------------
 
-@app.post("/api/ml/{site_id}/train")
-async def train_site_model(site_id: int, db: Session = Depends(get_db)):
-    """Belirtilen saha için ML modelini eğitir."""
+@app.get("/api/ml/cache")
+async def ml_model_cache_stats():
+    """Yüklü model önbelleğinin hit/miss istatistiklerini döndürür."""
+    from .ml_service import model_cache
+
+    return model_cache.stats()
+
+
+@app.get("/api/ml/jobs")
+async def list_training_jobs(site_id: Optional[int] = Query(None, description="Filter by site id")):
+    """Eğitim işlerini yeniden eskiye listeler."""
+    return {"jobs": [job.to_dict() for job in training_jobs.list(site_id)]}
+
+
+@app.get("/api/ml/jobs/{job_id}")
+async def read_training_job(job_id: str):
+    """Eğitim işinin durumunu, ilerlemesini ve metriklerini döndürür."""
+    job = training_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Eğitim işi bulunamadı")
+    return job.to_dict()
+
+
+def _model_versions(model_key: Any) -> Dict[str, Any]:
+    from .ml_service import get_model_version
+    from .model_registry import model_registry
+
+    try:
+        current = get_model_version(model_key)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Model bulunamadı. Önce /train çağırın.")
+    return {"current": current, "versions": model_registry.list_versions(model_key)}
+
+
+def _activate_model_version(model_key: Any, version: Optional[str]) -> Dict[str, Any]:
+    """Güncel sürümü değiştirir (version None ise bir öncekine döner) ve yeni sürümü arka planda yükler."""
+    from .ml_service import FLEET_MODEL_KEY, model_cache
+    from .model_registry import model_registry
+
+    try:
+        active = model_registry.activate(model_key, version) if version else model_registry.rollback(model_key)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    model_cache.refresh(model_key)
+    drift_monitor.rebaseline(None if model_key == FLEET_MODEL_KEY else model_key)
+    return {"current": active, "status_url": f"/api/ml/{model_key}/versions"}
+
+
+@app.post("/api/ml/predictions/run", status_code=202)
+async def run_batch_prediction_job(response: Response):
+    """Tüm sahalar için toplu tahmin işini kuyruğa alır (normalde her gece çalışır)."""
+    job, created = training_jobs.submit(None, kind="predict")
+    response.headers["Location"] = f"/api/ml/jobs/{job.id}"
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "deduplicated": not created,
+        "status_url": f"/api/ml/jobs/{job.id}"
+    }
+
+
+@app.get("/api/ml/drift")
+async def list_drift_status():
+    """Tüm sahaların drift durumunu ve yeniden eğitim önerisini döndürür."""
+    return {"sites": drift_monitor.summary()}
+
+
+# Filo route'ları /api/ml/{site_id}/... route'larından önce tanımlanmalı
+@app.post("/api/ml/fleet/train", status_code=202)
+async def train_fleet(response: Response):
+    """Tüm sahalar için tek bir ortak (filo) model eğitim işini kuyruğa alır."""
+    job, created = training_jobs.submit(None, kind="fleet")
+    response.headers["Location"] = f"/api/ml/jobs/{job.id}"
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "deduplicated": not created,
+        "status_url": f"/api/ml/jobs/{job.id}"
+    }
+
+
+@app.get("/api/ml/fleet/versions")
+async def list_fleet_model_versions():
+    """Filo modelinin kayıtlı sürümlerini (metrikler, veri aralığı, konfigürasyon) listeler."""
+    from .ml_service import FLEET_MODEL_KEY
+
+    return _model_versions(FLEET_MODEL_KEY)
+
+
+@app.post("/api/ml/fleet/versions/{version}/activate")
+async def activate_fleet_model_version(version: str):
+    """Filo modelinin güncel sürümünü kayıtlı bir sürüme çevirir."""
+    from .ml_service import FLEET_MODEL_KEY
+
+    return _activate_model_version(FLEET_MODEL_KEY, version)
+
+
+@app.post("/api/ml/fleet/rollback")
+async def rollback_fleet_model():
+    """Filo modelini bir önceki sürüme geri alır."""
+    from .ml_service import FLEET_MODEL_KEY
+
+    return _activate_model_version(FLEET_MODEL_KEY, None)
+
+
+@app.get("/api/ml/fleet/predict")
+async def predict_fleet_next_week(
+    request: Request,
+    site_ids: Optional[List[int]] = Query(None, description="Site ids to include (default: all)"),
+    format: Optional[str] = Query(None, description="'json', 'arrow' or 'parquet' (default: Accept header)"),
+    db: Session = Depends(get_db)
+):
+    """Filo modeliyle tüm sahaları tek bir batch tahminde 7 gün ileri tahmin eder."""
+    from .ml_service import predict_fleet
+
+    fmt = negotiate_format(request, format)
     try:
-        result = train_model(db, site_id)
-        return {
-            "status": "success",
-            "metrics": result["metrics"],
-            "model_path": result["model_path"]
-        }
+        forecast_df = predict_fleet(db, site_ids)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Filo modeli bulunamadı. Önce /api/ml/fleet/train çağırın.")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"ML eğitim hatası: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"ML tahmin hatası: {str(e)}")
+
+    if fmt != "json":
+        body = encode_frame(forecast_df, fmt, metadata={"model": "fleet"})
+        return Response(content=body, media_type=MEDIA_TYPES[fmt])
+
+    # Saha başına gruplanmış JSON
+    forecast_df["timestamp"] = iso_timestamps(forecast_df["timestamp"], suffix="Z")
+    return FastJSONResponse({
+        "sites": [
+            {"site_id": site_id, "forecasts": frame_to_records(group.drop(columns="site_id"))}
+            for site_id, group in forecast_df.groupby("site_id", sort=True)
+        ]
+    })
+
+
+@app.post("/api/ml/{site_id}/train", status_code=202)
+async def train_site_model(site_id: int, response: Response, db: Session = Depends(get_db)):
+    """Belirtilen saha için ML eğitim işini kuyruğa alır ve iş kimliğini döndürür."""
+    await get_site(db, site_id)
+
+    # Aynı saha için süren bir iş varsa yenisi açılmaz
+    job, created = training_jobs.submit(site_id)
+    response.headers["Location"] = f"/api/ml/jobs/{job.id}"
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "deduplicated": not created,
+        "status_url": f"/api/ml/jobs/{job.id}"
+    }
+
+
+@app.post("/api/ml/{site_id}/tune", status_code=202)
+async def tune_site_model(site_id: int, response: Response, db: Session = Depends(get_db)):
+    """Saha için hiperparametre araması işini kuyruğa alır; seçilen konfigürasyon sonraki eğitimlerde kullanılır."""
+    await get_site(db, site_id)
+
+    job, created = training_jobs.submit(site_id, kind="tune")
+    response.headers["Location"] = f"/api/ml/jobs/{job.id}"
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "deduplicated": not created,
+        "status_url": f"/api/ml/jobs/{job.id}"
+    }
+
+
+@app.post("/api/ml/{site_id}/backtest", status_code=202)
+async def backtest_site_model(
+    site_id: int,
+    response: Response,
+    model_types: Optional[List[str]] = Query(None, description="Model types to compare (default: ML_MODEL_TYPE)"),
+    folds: Optional[int] = Query(None, ge=1, le=52, description="Number of rolling cut-offs"),
+    step_hours: Optional[int] = Query(None, ge=1, description="Hours between cut-offs"),
+    db: Session = Depends(get_db)
+):
+    """Saha için rolling-origin geriye dönük test işini kuyruğa alır; sonuç iş kaydındadır."""
+    from .ml_models import ModelFactory
+
+    await get_site(db, site_id)
+    unknown = set(model_types or []) - set(ModelFactory.model_types())
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Desteklenmeyen model tipi: {', '.join(sorted(unknown))}")
+
+    params = {"model_types": model_types, "folds": folds, "step_hours": step_hours}
+    job, created = training_jobs.submit(site_id, kind="backtest",
+                                        params={key: value for key, value in params.items() if value is not None})
+    response.headers["Location"] = f"/api/ml/jobs/{job.id}"
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "deduplicated": not created,
+        "status_url": f"/api/ml/jobs/{job.id}"
+    }
+
+
+@app.get("/api/ml/{site_id}/versions")
+async def list_site_model_versions(site_id: int, db: Session = Depends(get_db)):
+    """Saha modelinin kayıtlı sürümlerini (metrikler, veri aralığı, konfigürasyon) listeler."""
+    await get_site(db, site_id)
+    return _model_versions(site_id)
+
+
+@app.post("/api/ml/{site_id}/versions/{version}/activate")
+async def activate_site_model_version(site_id: int, version: str, db: Session = Depends(get_db)):
+    """Saha modelinin güncel sürümünü kayıtlı bir sürüme çevirir (yükseltme veya geri alma)."""
+    await get_site(db, site_id)
+    return _activate_model_version(site_id, version)
+
+
+@app.post("/api/ml/{site_id}/rollback")
+async def rollback_site_model(site_id: int, db: Session = Depends(get_db)):
+    """Saha modelini bir önceki sürüme geri alır."""
+    await get_site(db, site_id)
+    return _activate_model_version(site_id, None)
+
+
+@app.get("/api/ml/{site_id}/drift")
+async def read_site_drift(site_id: int, db: Session = Depends(get_db)):
+    """Sahanın girdi ve tahmin hatası drift raporunu (özetler, PSI, eşik durumu) döndürür."""
+    await get_site(db, site_id)
+
+    report = drift_monitor.report(site_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Saha için henüz drift verisi yok")
+    return report
+
+
+@app.post("/api/ml/{site_id}/drift/retrain", status_code=202)
+async def retrain_on_drift(
+    site_id: int,
+    response: Response,
+    force: bool = Query(False, description="Queue training even if no drift was flagged"),
+    db: Session = Depends(get_db)
+):
+    """Drift nedeniyle yeniden eğitim önerilen saha için eğitim işini kuyruğa alır."""
+    await get_site(db, site_id)
+
+    report = drift_monitor.report(site_id)
+    if not force and not (report and report["retrain_recommended"]):
+        raise HTTPException(status_code=409, detail="Saha için yeniden eğitim önerilmiyor (drift yok)")
+
+    job, created = training_jobs.submit(site_id)
+    response.headers["Location"] = f"/api/ml/jobs/{job.id}"
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "deduplicated": not created,
+        "status_url": f"/api/ml/jobs/{job.id}"
+    }
 
 
 @app.get("/api/ml/{site_id}/predict")
-async def predict_site_next_week(site_id: int, db: Session = Depends(get_db)):
-    """Eğitilmiş modeli kullanarak gelecek 7 günü tahmin eder."""
+async def predict_site_next_week(
+    request: Request,
+    site_id: int,
+    format: Optional[str] = Query(None, description="'json', 'arrow' or 'parquet' (default: Accept header)"),
+    db: Session = Depends(get_db)
+):
+    """Eğitilmiş modelin 7 günlük tahminini döndürür (güncelse gece toplu tahmininden)."""
+    from .ml_service import serve_predictions
+
+    fmt = negotiate_format(request, format)
     try:
-        forecast_df = predict_next_week(db, site_id)
-        # Zaman damgasını ISO string'e çevir
-        forecast_df["timestamp"] = forecast_df["timestamp"].dt.strftime("%Y-%m-%dT%H:%M:%SZ")
-        return forecast_df.to_dict(orient="records")
+        forecast_df, version, stored = serve_predictions(db, site_id)
+        headers = {"X-Model-Version": version, "X-Prediction-Source": "stored" if stored else "computed"}
+        if fmt != "json":
+            body = encode_frame(forecast_df, fmt, metadata={"site_id": site_id})
+            return Response(content=body, media_type=MEDIA_TYPES[fmt], headers=headers)
+        # Zaman damgasını toplu olarak ISO string'e çevir
+        forecast_df["timestamp"] = iso_timestamps(forecast_df["timestamp"], suffix="Z")
+        return FastJSONResponse(frame_to_records(forecast_df), headers=headers)
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Model bulunamadı. Önce /train çağırın.")
     except Exception as e:
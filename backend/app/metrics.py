@@ -0,0 +1,341 @@
+"""
+Metrikler – pipeline aşamaları, DB sorguları, dış HTTP çağrıları ve ML işleri için
+süre histogramları ve sayaçlar; /metrics üzerinden Prometheus metin formatında sunulur
+"""
+from __future__ import annotations
+
+import asyncio
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Varsayılan histogram sınırları (saniye)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """Yalnızca artan sayaç."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+        self.forward: Optional[Callable[[str, float, Dict[str, str]], None]] = None
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+        if self.forward is not None:
+            self.forward(self.name, amount, labels)
+
+    def value(self, **labels: str) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        return self._values.get(key, 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Histogram:
+    """Sabit sınırlı süre histogramı (toplam ve sayı ile birlikte)."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # anahtar -> [kova sayıları..., +Inf sayısı, toplam]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+        self.forward: Optional[Callable[[str, float, Dict[str, str]], None]] = None
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            row[index] += 1
+            row[-1] += value
+        if self.forward is not None:
+            self.forward(self.name, value, labels)
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Bloğun süresini ölçer (hata olsa da kaydeder)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        row = self._values.get(key)
+        return sum(row[:-1]) if row else 0.0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(row)) for key, row in self._values.items()]
+
+        lines = []
+        for key, row in items:
+            cumulative = 0.0
+            for bound, bucket_count in zip(self.buckets, row):
+                cumulative += bucket_count
+                le = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            cumulative += row[len(self.buckets)]
+            le = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {row[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class CallbackGauge:
+    """Değeri yalnızca kazıma anında bir fonksiyondan okunan gösterge."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, fn: Callable[[], Dict[Tuple[str, ...], float]], labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._fn = fn
+
+    def render(self) -> List[str]:
+        try:
+            values = self._fn()
+        except Exception:
+            return []
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values.items()]
+
+
+class MetricsRegistry:
+    """Metrik kayıt defteri; Prometheus metin formatını yalnızca kazıma anında üretir."""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge_callback(self, name: str, documentation: str, fn, labelnames: Sequence[str] = ()) -> CallbackGauge:
+        return self._register(CallbackGauge(name, documentation, fn, labelnames))
+
+    def record(self, name: str, value: float, labels: Dict[str, str]) -> None:
+        """Başka bir süreçten iletilen sayaç artışını veya histogram gözlemini işler."""
+        metric = self._metrics.get(name)
+        if isinstance(metric, Histogram):
+            metric.observe(value, **labels)
+        elif isinstance(metric, Counter):
+            metric.inc(value, **labels)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines: List[str] = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Global kayıt defteri ve ortak metrikler
+registry = MetricsRegistry()
+
+HTTP_REQUEST_DURATION = registry.histogram(
+    "greenfleet_http_request_duration_seconds",
+    "API istek süresi (yanıt gövdesi tamamen gönderilene kadar)",
+    ("method", "handler", "status"),
+)
+STAGE_DURATION = registry.histogram(
+    "greenfleet_stage_duration_seconds",
+    "Tahmin pipeline aşamalarının süresi",
+    ("stage",),
+)
+STAGE_ERRORS = registry.counter(
+    "greenfleet_stage_errors_total",
+    "Hata ile biten pipeline aşamaları",
+    ("stage",),
+)
+DB_QUERY_DURATION = registry.histogram(
+    "greenfleet_db_query_duration_seconds",
+    "Veritabanı sorgu süresi (SQL komut tipine göre)",
+    ("operation",),
+)
+OUTBOUND_HTTP_DURATION = registry.histogram(
+    "greenfleet_outbound_http_duration_seconds",
+    "Dış HTTP çağrılarının süresi",
+    ("target", "outcome"),
+)
+SCRAPER_RUNS = registry.counter(
+    "greenfleet_price_scraper_runs_total",
+    "Fiyat scraper çalıştırmaları",
+    ("result",),
+)
+ML_DURATION = registry.histogram(
+    "greenfleet_ml_duration_seconds",
+    "ML eğitim, yükleme ve tahmin süreleri",
+    ("operation",),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 1800.0, 3600.0),
+)
+MODEL_CACHE_EVENTS = registry.counter(
+    "greenfleet_ml_model_cache_events_total",
+    "Yüklü model önbelleği olayları (hit, stale, miss, reload, evict, invalidate)",
+    ("event",),
+)
+RECORDS_WRITTEN = registry.counter(
+    "greenfleet_forecast_records_written_total",
+    "ForecastRecord tablosuna yazılan satırlar",
+)
+
+
+def observe_stage(stage: str, histogram: Histogram = STAGE_DURATION, label: str = "stage") -> Callable:
+    """Senkron veya async fonksiyonun süresini ve hatalarını ölçen dekoratör."""
+
+    def decorator(fn: Callable) -> Callable:
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception:
+                    STAGE_ERRORS.inc(stage=stage)
+                    raise
+                finally:
+                    histogram.observe(time.perf_counter() - start, **{label: stage})
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                STAGE_ERRORS.inc(stage=stage)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, **{label: stage})
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def observe_outbound(target: str) -> Iterator[None]:
+    """Dış HTTP çağrısının süresini ve sonucunu (ok/error) ölçer."""
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        OUTBOUND_HTTP_DURATION.observe(time.perf_counter() - start, target=target, outcome=outcome)
+
+
+def install_sqlalchemy_metrics() -> None:
+    """Tüm SQLAlchemy motorlarında sorgu sürelerini ölçen event dinleyicilerini kurar."""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    if getattr(install_sqlalchemy_metrics, "_installed", False):
+        return
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("_query_start")
+        if not starts:
+            return
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement else "UNKNOWN"
+        DB_QUERY_DURATION.observe(time.perf_counter() - starts.pop(), operation=operation)
+
+    install_sqlalchemy_metrics._installed = True
+
+
+class MetricsMiddleware:
+    """İstek sürelerini handler ve durum koduna göre ölçen saf ASGI middleware."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Router eşleşen endpoint'i scope'a yazar; bilinmeyen yollar tek etikette toplanır
+            endpoint = scope.get("endpoint")
+            handler = getattr(endpoint, "__name__", "unmatched")
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - start,
+                method=scope.get("method", ""),
+                handler=handler,
+                status=str(status["code"]),
+            )
@@ -0,0 +1,165 @@
+"""
+CPU çıkarımı – eğitilmiş NeuralForecast ağını Lightning olmadan çalışan (opsiyonel int8) TorchScript modülüne aktarır
+"""
+from __future__ import annotations
+
+import copy
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+# Dışa aktarım ayarları
+INFERENCE_FILE = "inference.pt"
+INFERENCE_META_FILE = "inference.json"
+EXPORT_ENABLED = os.getenv("ML_EXPORT_INFERENCE", "1").lower() in ("1", "true", "yes")
+LEAN_INFERENCE_ENABLED = os.getenv("ML_LEAN_INFERENCE", "1").lower() in ("1", "true", "yes")
+EXPORT_QUANTIZE = os.getenv("ML_EXPORT_QUANTIZE", "1").lower() in ("1", "true", "yes")
+# Parite eşiği: nf.predict ile en büyük mutlak fark (hedef ölçeklenmiş olduğundan ~standart sapma birimi)
+PARITY_TOLERANCE = float(os.getenv("ML_EXPORT_PARITY_TOLERANCE", "0.05"))
+
+
+def _import_torch():
+    try:
+        import torch
+    except ImportError:
+        logger.warning("PyTorch yüklenmedi, optimize CPU çıkarımı kullanılamaz.")
+        raise
+    return torch
+
+
+def series_windows(df_nf: pd.DataFrame, input_size: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Her serinin son `input_size` y değerini (B, L) pencerelerine dizer.
+
+    Kısa seriler soldan sıfırla doldurulur ve maskede 0 olur. Seriler
+    nf.predict çıktısıyla aynı sırada (unique_id'ye göre) döner.
+    """
+    df_nf = df_nf.sort_values(['unique_id', 'ds'], kind='stable')
+    ids = []
+    last_ds = []
+    windows = np.zeros((df_nf['unique_id'].nunique(), input_size), dtype=np.float32)
+    mask = np.zeros_like(windows)
+    for row, (unique_id, group) in enumerate(df_nf.groupby('unique_id', sort=True)):
+        values = group['y'].to_numpy(dtype=np.float32)[-input_size:]
+        windows[row, input_size - len(values):] = values
+        mask[row, input_size - len(values):] = 1.0
+        ids.append(unique_id)
+        last_ds.append(group['ds'].iloc[-1])
+    return np.asarray(ids), windows, mask, pd.to_datetime(np.asarray(last_ds)).to_numpy()
+
+
+def _wrap(torch, network):
+    """NeuralForecast ağını (insample_y, insample_mask) -> (B, h) imzalı modüle sarar."""
+
+    class WindowsModule(torch.nn.Module):
+        def __init__(self, network):
+            super().__init__()
+            self.network = network
+
+        def forward(self, insample_y, insample_mask):
+            batch = {
+                'insample_y': insample_y,
+                'insample_mask': insample_mask,
+                'futr_exog': None,
+                'hist_exog': None,
+                'stat_exog': None,
+            }
+            output = self.network(batch)
+            return output.reshape(insample_y.shape[0], -1)
+
+    return WindowsModule(network)
+
+
+def _run(torch, module, windows: np.ndarray, mask: np.ndarray, horizon: int) -> np.ndarray:
+    with torch.inference_mode():
+        output = module(torch.from_numpy(windows), torch.from_numpy(mask))
+    return output.numpy()[:, :horizon]
+
+
+def forecast_frame(module, df_nf: pd.DataFrame, input_size: int, horizon: int, alias: str) -> pd.DataFrame:
+    """Aktarılmış modülle nf.predict ile aynı biçimde (index unique_id; ds, alias) tahmin üretir."""
+    torch = _import_torch()
+    ids, windows, mask, last_ds = series_windows(df_nf, input_size)
+    values = _run(torch, module, windows, mask, horizon)
+
+    steps = np.arange(1, horizon + 1) * np.timedelta64(1, 'h')
+    return pd.DataFrame({
+        'unique_id': np.repeat(ids, horizon),
+        'ds': (last_ds[:, None] + steps[None, :]).ravel(),
+        alias: values.ravel(),
+    }).set_index('unique_id')
+
+
+def export_inference(nf, df_nf: pd.DataFrame, input_size: int, horizon: int, path: Path,
+                     quantize: bool = EXPORT_QUANTIZE) -> Optional[Dict[str, Any]]:
+    """Tahminde kullanılan (son) ağı TorchScript'e aktarır ve nf.predict ile paritesini doğrular.
+
+    Normalizasyonu veya olasılıksal çıkışı forward dışında yapan ağlar
+    pariteyi geçemez; bu durumda dosya yazılmaz ve tahmin NeuralForecast
+    üzerinden yapılmaya devam eder. Sonuç meta bilgisi (veya None) döner.
+    """
+    torch = _import_torch()
+    for name in (INFERENCE_FILE, INFERENCE_META_FILE):
+        (path / name).unlink(missing_ok=True)
+
+    network = nf.models[-1]
+    alias = getattr(network, 'alias', None) or type(network).__name__
+    ids, windows, mask, _ = series_windows(df_nf, input_size)
+
+    # Referans: mevcut Lightning yolu, seri başına son sütun
+    reference = nf.predict(df_nf).reset_index()
+    reference = reference.sort_values(['unique_id', 'ds'], kind='stable')
+    expected = reference.iloc[:, -1].to_numpy(dtype=np.float32).reshape(len(ids), -1)[:, :horizon]
+
+    try:
+        module = _wrap(torch, copy.deepcopy(network).cpu().eval())
+        if quantize:
+            module = torch.ao.quantization.quantize_dynamic(
+                module, {torch.nn.Linear, torch.nn.LSTM, torch.nn.GRU}, dtype=torch.qint8
+            )
+        example = (torch.from_numpy(windows), torch.from_numpy(mask))
+        with torch.inference_mode():
+            scripted = torch.jit.trace(module, example, check_trace=False)
+        scripted = torch.jit.freeze(scripted.eval())
+        actual = _run(torch, scripted, windows, mask, horizon)
+    except Exception as exc:
+        logger.warning(f"{alias} ağı TorchScript'e aktarılamadı, NeuralForecast yolu kullanılacak: {exc}")
+        return None
+
+    error = float(np.nanmax(np.abs(actual - expected))) if actual.shape == expected.shape else float('inf')
+    if not error <= PARITY_TOLERANCE:
+        logger.warning(f"{alias} dışa aktarımı pariteyi geçemedi (max hata {error:.4f} > {PARITY_TOLERANCE})")
+        return None
+
+    torch.jit.save(scripted, str(path / INFERENCE_FILE))
+    meta = {
+        'alias': alias,
+        'input_size': input_size,
+        'horizon': horizon,
+        'quantized': quantize,
+        'parity_max_abs_error': error,
+        'torch_version': torch.__version__,
+        'exported_at': time.time(),
+    }
+    (path / INFERENCE_META_FILE).write_text(json.dumps(meta), encoding='utf-8')
+    logger.info(f"Optimize CPU çıkarımı aktarıldı: {alias} (int8={quantize}, max hata {error:.4f})")
+    return meta
+
+
+def load_inference(path: Path) -> Optional[Tuple[Any, Dict[str, Any]]]:
+    """Aktarılmış modülü ve meta bilgisini yükler; yoksa veya kapalıysa None."""
+    if not LEAN_INFERENCE_ENABLED or not (path / INFERENCE_FILE).exists():
+        return None
+    try:
+        torch = _import_torch()
+        meta = json.loads((path / INFERENCE_META_FILE).read_text(encoding='utf-8'))
+        module = torch.jit.load(str(path / INFERENCE_FILE), map_location='cpu')
+    except (ImportError, OSError, ValueError, RuntimeError) as exc:
+        logger.warning(f"Optimize CPU çıkarımı yüklenemedi: {exc}")
+        return None
+    return module.eval(), meta
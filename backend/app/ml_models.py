@@ -1,37 +1,63 @@
 
 
+import hashlib
+import os
+from abc import ABC, abstractmethod
+import tempfile
+import time
 import numpy as np
 import pandas as pd
-import torch
-import torch.nn as nn
+from pathlib import Path
+from types import SimpleNamespace
 from typing import Dict, List, Optional, Tuple, Any
 from datetime import datetime, timedelta
 from dataclasses import dataclass
-from sklearn.preprocessing import StandardScaler, LabelEncoder
-from sklearn.metrics import mean_absolute_error, mean_squared_error
 import joblib
 from loguru import logger
 import warnings
 warnings.filterwarnings('ignore')
 
-# NeuralForecast kütüphanelerini import et
-try:
-    from neuralforecast import NeuralForecast
-    from neuralforecast.models import TFT, NBEATS, DeepAR, LSTM, GRU
-    from neuralforecast.losses.pytorch import MAE, MSE, RMSE
-    from neuralforecast.utils import AirPassengersDF
-except ImportError:
-    logger.warning("NeuralForecast kütüphanesi yüklenmedi. Pip install gerekebilir.")
-
-# MLflow ve monitoring
-try:
-    import mlflow
-    import mlflow.pytorch
-    from evidently import ColumnMapping
-    from evidently.report import Report
-    from evidently.metric_preset import DataDriftPreset, TargetDriftPreset
-except ImportError:
-    logger.warning("MLflow veya Evidently kütüphanesi yüklenmedi.")
+# NeuralForecast (ve torch) ağır bağımlılıklardır; ilk eğitim/yükleme anında import edilir
+_neuralforecast: Optional[SimpleNamespace] = None
+
+
+def load_neuralforecast() -> SimpleNamespace:
+    """NeuralForecast sınıflarını ilk kullanımda import eder ve önbelleğe alır."""
+    global _neuralforecast
+    if _neuralforecast is None:
+        try:
+            from neuralforecast import NeuralForecast
+            from neuralforecast.models import TFT, NBEATS, DeepAR, LSTM, GRU
+            from neuralforecast.losses.pytorch import MAE, MSE, RMSE
+            from pytorch_lightning.callbacks import Callback, ModelCheckpoint
+        except ImportError:
+            logger.warning("NeuralForecast kütüphanesi yüklenmedi. Pip install gerekebilir.")
+            raise
+
+        class DeadlineCallback(Callback):
+            """İş süresi bütçesi dolunca eğitimi durdurur (modeller art arda eğitilir)."""
+
+            def __init__(self, deadline: float):
+                self.deadline = deadline
+
+            def on_train_batch_end(self, trainer, *args) -> None:
+                if time.monotonic() >= self.deadline:
+                    trainer.should_stop = True
+
+        _neuralforecast = SimpleNamespace(
+            NeuralForecast=NeuralForecast,
+            TFT=TFT, NBEATS=NBEATS, DeepAR=DeepAR, LSTM=LSTM, GRU=GRU,
+            MAE=MAE, MSE=MSE, RMSE=RMSE,
+            Callback=Callback, ModelCheckpoint=ModelCheckpoint, DeadlineCallback=DeadlineCallback,
+        )
+    return _neuralforecast
+
+
+# Eğitim bütçesi ve doğrulama ayarları (varsayılan konfigürasyona girer; 0 = sınırsız / doğrulama yok)
+TRAIN_VAL_SIZE = int(os.getenv("ML_VAL_SIZE", "168"))
+TRAIN_VAL_CHECK_STEPS = int(os.getenv("ML_VAL_CHECK_STEPS", "50"))
+TRAIN_MODEL_BUDGET_SECONDS = float(os.getenv("ML_TRAIN_MODEL_BUDGET_SECONDS", "900"))
+TRAIN_JOB_BUDGET_SECONDS = float(os.getenv("ML_TRAIN_JOB_BUDGET_SECONDS", "3600"))
 
 @dataclass
 class ModelConfig:
@@ -45,194 +71,499 @@ class ModelConfig:
     learning_rate: float = 0.001
     batch_size: int = 32
     max_epochs: int = 100
-    patience: int = 10
+    patience: int = 10  # doğrulama kontrolü sayısı (val_check_steps adımda bir)
+    val_size: int = 168  # her serinin son saatleri doğrulamaya ayrılır
+    val_check_steps: int = 50
+    model_time_budget: float = 900.0  # model başına saniye
+    job_time_budget: float = 3600.0  # fit() çağrısı başına saniye (yedek model dahil)
     
+# Özellik tanımları (sıralama eski pandas pipeline'ı ile aynıdır)
+TIME_FEATURES = [
+    'hour', 'day_of_week', 'day_of_month', 'month', 'quarter', 'year',
+    'hour_sin', 'hour_cos', 'day_sin', 'day_cos', 'month_sin', 'month_cos',
+    'is_weekend', 'is_business_hour', 'is_peak_hour',
+]
+FEATURE_LAGS = [1, 3, 6, 12, 24, 48, 168]  # 1h, 3h, 6h, 12h, 1d, 2d, 1w
+FEATURE_WINDOWS = [3, 6, 12, 24, 48, 168]
+ROLLING_STATS = ('mean', 'std', 'min', 'max')
+
+# Kategorik hava durumu özellikleri: (kaynak sütun, kova sınırları, etiketler)
+CATEGORY_BINS = {
+    'wind_category': ('wind_speed', [0, 3, 7, 12, 18, 25, 100],
+                      ['calm', 'light', 'moderate', 'strong', 'very_strong', 'extreme']),
+    'solar_category': ('ghi', [0, 100, 300, 600, 800, 1200],
+                       ['very_low', 'low', 'moderate', 'high', 'very_high']),
+}
+
+# Ölçeklenmeyen sütunlar
+UNSCALED_COLUMNS = ('site_id', 'id')
+
+# Özellik hesaplaması (tanımlar dışında) değiştiğinde artırılır; özellik deposu bu sürümle anahtarlanır
+FEATURE_PIPELINE_REVISION = 1
+
+
+def feature_pipeline_version() -> str:
+    """Özellik tanımlarından türetilen kısa sürüm anahtarı (tanım değişince depo geçersizleşir)."""
+    spec = repr((FEATURE_PIPELINE_REVISION, TIME_FEATURES, FEATURE_LAGS, FEATURE_WINDOWS,
+                 ROLLING_STATS, CATEGORY_BINS, UNSCALED_COLUMNS))
+    return hashlib.sha1(spec.encode('utf-8')).hexdigest()[:12]
+
+
+# MAPE yalnızca gerçek değeri serinin tepe değerinin bu oranından büyük saatlerde hesaplanır
+MAPE_FLOOR_RATIO = 0.05
+
+
+def error_metrics(actual: np.ndarray, predicted: np.ndarray) -> Dict[str, Any]:
+    """Vektörel hata metrikleri; üretimin sıfır olduğu saatlerde (gece, rüzgarsız) tanımsız kalmaz.
+    
+    `predicted` (n,) veya (n, k) olabilir; ikinci durumda her metrik k
+    modelin değerlerini tutan bir dizidir. NaN içeren satırlar sayılmaz.
+    WAPE ve nRMSE ortalama mutlak üretime göre normalize edilir.
+    """
+    actual = np.asarray(actual, dtype=np.float64)
+    predicted = np.asarray(predicted, dtype=np.float64)
+    if predicted.ndim == 2:
+        actual = actual[:, None]
+    valid = np.isfinite(actual) & np.isfinite(predicted)
+    error = np.where(valid, predicted - actual, 0.0)
+    abs_error = np.abs(error)
+    abs_actual = np.where(valid, np.abs(actual), 0.0)
+    abs_sum = abs_actual + np.where(valid, np.abs(predicted), 0.0)
+    mape_mask = valid & (abs_actual > MAPE_FLOOR_RATIO * abs_actual.max(axis=0, initial=0.0))
+    count = valid.sum(axis=0)
+    
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mse = (error ** 2).sum(axis=0) / count
+        mean_actual = abs_actual.sum(axis=0) / count
+        metrics = {
+            'MAE': abs_error.sum(axis=0) / count,
+            'MSE': mse,
+            'RMSE': np.sqrt(mse),
+            'MAPE': np.where(mape_mask, abs_error / np.where(mape_mask, abs_actual, 1.0), 0.0).sum(axis=0)
+                    / mape_mask.sum(axis=0) * 100,
+            'sMAPE': np.where(abs_sum > 0, 2 * abs_error / np.where(abs_sum > 0, abs_sum, 1.0), 0.0).sum(axis=0)
+                     / count * 100,
+            'WAPE': abs_error.sum(axis=0) / abs_actual.sum(axis=0) * 100,
+            'nRMSE': np.sqrt(mse) / mean_actual * 100,
+            'bias': error.sum(axis=0) / count,
+            'count': count,
+        }
+    if predicted.ndim == 1:
+        return {name: int(value) if name == 'count' else float(value) for name, value in metrics.items()}
+    return metrics
+
+
+@dataclass
+class RawFeatures:
+    """Ölçeklenmemiş özellik matrisi; kategorik sütunlar kova kodu (-1 = aralık dışı) olarak tutulur."""
+    frame: pd.DataFrame  # ölçeklenmeyen sütunlar (timestamp, site_id, ...)
+    order: List[str]  # çıktı sütun sırası
+    columns: List[str]  # matrix sütunları
+    matrix: np.ndarray  # float32, (satır, sütun); memmap olabilir
+    
+    def take(self, rows: np.ndarray) -> "RawFeatures":
+        """Seçilen satırların (bool maske veya indeks) alt kümesi."""
+        return RawFeatures(self.frame.iloc[rows], self.order, self.columns, np.asarray(self.matrix[rows]))
+
+
 class AdvancedFeatureEngineer:
-    """Gelişmiş özellik mühendisliği sınıfı"""
+    """Gelişmiş özellik mühendisliği sınıfı
+    
+    Tüm özellikler tek geçişte önceden ayrılmış bir float32 matrisine yazılır
+    ve tek bir vektörel standart ölçekleyici ile ölçeklenir. Birden fazla saha
+    içeren panellerde lag/rolling özellikleri saha sınırlarını aşmaz.
+    """
     
     def __init__(self):
-        self.scalers = {}
-        self.encoders = {}
+        self.scale_columns: List[str] = []
+        self.mean_ = np.zeros(0)
+        self.scale_ = np.ones(0)
+        self.category_classes: Dict[str, np.ndarray] = {}
         self.fitted = False
+    
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        """Sütun bazlı StandardScaler/LabelEncoder içeren eski pickle'ları dönüştürür."""
+        if 'scalers' in state and 'scale_columns' not in state:
+            scalers = state.pop('scalers')
+            encoders = state.pop('encoders', {})
+            state['scale_columns'] = list(scalers)
+            state['mean_'] = np.array([float(s.mean_[0]) for s in scalers.values()])
+            state['scale_'] = np.array([float(s.scale_[0]) for s in scalers.values()])
+            state['category_classes'] = {col: np.asarray(enc.classes_) for col, enc in encoders.items()}
+        self.__dict__.update(state)
+    
+    @staticmethod
+    def _sort_series(df: pd.DataFrame) -> Tuple[pd.DataFrame, Optional[np.ndarray]]:
+        """Zamana göre sıralar; panelde önce sahaya göre sıralayıp grup başlangıçlarını döndürür."""
+        if 'site_id' in df.columns and df['site_id'].nunique() > 1:
+            df = df.sort_values(['site_id', 'timestamp'], kind='stable')
+            site = df['site_id'].to_numpy()
+            boundary = np.r_[True, site[1:] != site[:-1]]
+            group_start = np.maximum.accumulate(np.where(boundary, np.arange(len(site)), 0))
+            return df, group_start
+        return df.sort_values('timestamp', kind='stable'), None
+    
+    @staticmethod
+    def _feature_columns(df: pd.DataFrame, target_cols: List[str]) -> Tuple[List[str], List[str]]:
+        """Çıktı sütun sırasını ve ölçeklenecek (sayısal) sütunları belirler."""
+        columns = list(df.columns)
+        numeric = [
+            col for col in columns
+            if col not in UNSCALED_COLUMNS
+            and pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col])
+        ]
         
-    def create_time_features(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Zaman tabanlı özellikler oluşturur"""
-        df = df.copy()
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        
-        # Temel zaman özellikleri
-        df['hour'] = df['timestamp'].dt.hour
-        df['day_of_week'] = df['timestamp'].dt.dayofweek
-        df['day_of_month'] = df['timestamp'].dt.day
-        df['month'] = df['timestamp'].dt.month
-        df['quarter'] = df['timestamp'].dt.quarter
-        df['year'] = df['timestamp'].dt.year
+        derived = [col for col in TIME_FEATURES if col not in columns]
+        if 'wind_speed' in columns:
+            derived += ['wind_power_theoretical', 'wind_category']
+        if 'ghi' in columns:
+            derived += ['solar_power_theoretical', 'solar_category']
+        for target_col in target_cols:
+            if target_col in columns:
+                derived += [f'{target_col}_lag_{lag}' for lag in FEATURE_LAGS]
+        for target_col in target_cols:
+            if target_col in columns:
+                derived += [
+                    f'{target_col}_rolling_{stat}_{window}'
+                    for window in FEATURE_WINDOWS for stat in ROLLING_STATS
+                ]
+        return columns + derived, numeric + derived
+    
+    @staticmethod
+    def _fill_time_features(out: Dict[str, np.ndarray], timestamps: pd.Series) -> None:
+        """Zaman tabanlı özellikler"""
+        index = pd.DatetimeIndex(timestamps)
+        hour = index.hour.to_numpy()
+        day_of_week = index.dayofweek.to_numpy()
+        month = index.month.to_numpy()
+        
+        out['hour'][:] = hour
+        out['day_of_week'][:] = day_of_week
+        out['day_of_month'][:] = index.day.to_numpy()
+        out['month'][:] = month
+        out['quarter'][:] = (month - 1) // 3 + 1
+        out['year'][:] = index.year.to_numpy()
         
         # Döngüsel özellikler (sinüs/kosinüs)
-        df['hour_sin'] = np.sin(2 * np.pi * df['hour'] / 24)
-        df['hour_cos'] = np.cos(2 * np.pi * df['hour'] / 24)
-        df['day_sin'] = np.sin(2 * np.pi * df['day_of_week'] / 7)
-        df['day_cos'] = np.cos(2 * np.pi * df['day_of_week'] / 7)
-        df['month_sin'] = np.sin(2 * np.pi * df['month'] / 12)
-        df['month_cos'] = np.cos(2 * np.pi * df['month'] / 12)
+        out['hour_sin'][:] = np.sin(2 * np.pi * hour / 24)
+        out['hour_cos'][:] = np.cos(2 * np.pi * hour / 24)
+        out['day_sin'][:] = np.sin(2 * np.pi * day_of_week / 7)
+        out['day_cos'][:] = np.cos(2 * np.pi * day_of_week / 7)
+        out['month_sin'][:] = np.sin(2 * np.pi * month / 12)
+        out['month_cos'][:] = np.cos(2 * np.pi * month / 12)
         
         # Tatil ve özel günler
-        df['is_weekend'] = (df['day_of_week'] >= 5).astype(int)
-        df['is_business_hour'] = ((df['hour'] >= 8) & (df['hour'] <= 18)).astype(int)
-        df['is_peak_hour'] = ((df['hour'] >= 17) & (df['hour'] <= 21)).astype(int)
-        
-        return df
+        out['is_weekend'][:] = day_of_week >= 5
+        out['is_business_hour'][:] = (hour >= 8) & (hour <= 18)
+        out['is_peak_hour'][:] = (hour >= 17) & (hour <= 21)
     
-    def create_lag_features(self, df: pd.DataFrame, target_col: str, lags: List[int]) -> pd.DataFrame:
-        """Gecikmeli özellikler oluşturur"""
-        df = df.copy()
-        df = df.sort_values('timestamp')
-        
-        for lag in lags:
-            df[f'{target_col}_lag_{lag}'] = df[target_col].shift(lag)
-            
-        return df
-    
-    def create_rolling_features(self, df: pd.DataFrame, target_col: str, windows: List[int]) -> pd.DataFrame:
-        """Hareketli ortalama özellikleri oluşturur"""
-        df = df.copy()
-        df = df.sort_values('timestamp')
-        
-        for window in windows:
-            df[f'{target_col}_rolling_mean_{window}'] = df[target_col].rolling(window=window).mean()
-            df[f'{target_col}_rolling_std_{window}'] = df[target_col].rolling(window=window).std()
-            df[f'{target_col}_rolling_min_{window}'] = df[target_col].rolling(window=window).min()
-            df[f'{target_col}_rolling_max_{window}'] = df[target_col].rolling(window=window).max()
-            
-        return df
+    @staticmethod
+    def _category_buckets(name: str, values: np.ndarray) -> np.ndarray:
+        """Değerleri pd.cut ile aynı şekilde kovalara ayırır (sağdan kapalı, aralık dışı/NaN -> -1)."""
+        _, bins, _ = CATEGORY_BINS[name]
+        bucket = np.searchsorted(bins, values, side='left') - 1
+        bucket[(values <= bins[0]) | (values > bins[-1]) | np.isnan(values)] = -1
+        return bucket
+    
+    def _category_codes(self, name: str, bucket: np.ndarray, fit: bool) -> np.ndarray:
+        """Kova kodlarını LabelEncoder ile aynı (alfabetik) sınıf kodlarına çevirir."""
+        _, _, labels = CATEGORY_BINS[name]
+        names = np.array(labels + ['nan'], dtype=object)
+        present = np.unique(bucket)
+        
+        if fit:
+            self.category_classes[name] = np.array(sorted(names[present]), dtype=object)
+        classes = self.category_classes.get(name)
+        if classes is None:
+            return bucket.astype(np.float32)
+        
+        # Kova -> sınıf indeksi tablosu (eğitimde görülmemiş kategoriler NaN)
+        lookup = np.full(len(names), np.nan, dtype=np.float32)
+        for code, label in enumerate(names):
+            match = np.flatnonzero(classes == label)
+            if match.size:
+                lookup[code] = match[0]
+        return lookup[bucket]
+    
+    @staticmethod
+    def _shift(values: np.ndarray, lag: int, group_start: Optional[np.ndarray]) -> np.ndarray:
+        result = np.full(len(values), np.nan, dtype=np.float64)
+        if lag < len(values):
+            result[lag:] = values[:-lag]
+        if group_start is not None:
+            result[np.arange(len(values)) - lag < group_start] = np.nan
+        return result
     
-    def create_weather_features(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Hava durumu tabanlı özellikler oluşturur"""
-        df = df.copy()
+    @staticmethod
+    def _fill_rolling(out: Dict[str, np.ndarray], prefix: str, values: np.ndarray,
+                      window: int, group_start: Optional[np.ndarray]) -> None:
+        """Bir pencere için mean/std/min/max'ı ortak kümülatif toplamlarla tek seferde hesaplar."""
+        n = len(values)
+        names = [f'{prefix}_rolling_{stat}_{window}' for stat in ROLLING_STATS]
+        if n < window:
+            for name in names:
+                out[name][:] = np.nan
+            return
+        
+        nan_mask = np.isnan(values)
+        # Büyük ofsetlerde sayısal kaybı azaltmak için merkezlenmiş değerler
+        center = np.nanmean(values) if not nan_mask.all() else 0.0
+        centered = np.where(nan_mask, 0.0, values - center)
+        
+        csum = np.concatenate(([0.0], np.cumsum(centered)))
+        csq = np.concatenate(([0.0], np.cumsum(centered * centered)))
+        cnan = np.concatenate(([0], np.cumsum(nan_mask)))
+        
+        win_sum = csum[window:] - csum[:-window]
+        win_sq = csq[window:] - csq[:-window]
+        complete = (cnan[window:] - cnan[:-window]) == 0
+        
+        mean = win_sum / window
+        var = (win_sq - win_sum * win_sum / window) / (window - 1) if window > 1 else np.full_like(mean, np.nan)
+        np.maximum(var, 0.0, out=var)
+        
+        windows = np.lib.stride_tricks.sliding_window_view(values, window)
+        stats = (mean + center, np.sqrt(var), windows.min(axis=1), windows.max(axis=1))
+        
+        # Pencere tamamlanmamış, NaN içeren veya saha sınırını aşan satırlar NaN
+        valid = complete
+        if group_start is not None:
+            valid = valid & (np.arange(window - 1, n) - window + 1 >= group_start[window - 1:])
+        for name, stat in zip(names, stats):
+            column = out[name]
+            column[:window - 1] = np.nan
+            column[window - 1:] = np.where(valid, stat, np.nan)
+    
+    def raw_features(self, df: pd.DataFrame, target_cols: List[str]) -> RawFeatures:
+        """Özellik matrisini tek geçişte, ölçeklemeden ve kategorileri kova kodu olarak oluşturur."""
+        df = df.copy(deep=False)
+        df['timestamp'] = pd.to_datetime(df['timestamp'])
+        df, group_start = self._sort_series(df)
+        
+        order, scaled = self._feature_columns(df, target_cols)
+        n = len(df)
+        matrix = np.empty((n, len(scaled)), dtype=np.float32)
+        out = {name: matrix[:, j] for j, name in enumerate(scaled)}
+        
+        # Sayısal giriş sütunları
+        for col in scaled:
+            if col in df.columns:
+                out[col][:] = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+        
+        self._fill_time_features(out, df['timestamp'])
         
+        # Hava durumu özellikleri
         if 'wind_speed' in df.columns:
+            wind = df['wind_speed'].to_numpy(dtype=np.float64, na_value=np.nan)
             # Rüzgar güç eğrisi özellikleri
-            df['wind_power_theoretical'] = np.where(
-                (df['wind_speed'] >= 3) & (df['wind_speed'] <= 25),
-                np.minimum(((df['wind_speed'] - 3) / 9) ** 3, 1.0),
-                0.0
-            )
-            
-            # Rüzgar kategorileri
-            df['wind_category'] = pd.cut(
-                df['wind_speed'], 
-                bins=[0, 3, 7, 12, 18, 25, 100], 
-                labels=['calm', 'light', 'moderate', 'strong', 'very_strong', 'extreme']
+            out['wind_power_theoretical'][:] = np.where(
+                (wind >= 3) & (wind <= 25), np.minimum(((wind - 3) / 9) ** 3, 1.0), 0.0
             )
-            
+            out['wind_category'][:] = self._category_buckets('wind_category', wind)
         if 'ghi' in df.columns:
+            ghi = df['ghi'].to_numpy(dtype=np.float64, na_value=np.nan)
             # Güneş radyasyonu özellikleri
-            df['solar_power_theoretical'] = np.maximum(df['ghi'] / 1000, 0) * 0.2 * 0.85
-            
-            # Güneş kategorileri
-            df['solar_category'] = pd.cut(
-                df['ghi'], 
-                bins=[0, 100, 300, 600, 800, 1200], 
-                labels=['very_low', 'low', 'moderate', 'high', 'very_high']
-            )
-            
-        return df
+            out['solar_power_theoretical'][:] = np.maximum(ghi / 1000, 0) * 0.2 * 0.85
+            out['solar_category'][:] = self._category_buckets('solar_category', ghi)
+        
+        # Lag ve rolling özellikleri (hedef değerler float64 üzerinden)
+        for target_col in target_cols:
+            if target_col not in df.columns:
+                continue
+            values = df[target_col].to_numpy(dtype=np.float64, na_value=np.nan)
+            for lag in FEATURE_LAGS:
+                out[f'{target_col}_lag_{lag}'][:] = self._shift(values, lag, group_start)
+            for window in FEATURE_WINDOWS:
+                self._fill_rolling(out, target_col, values, window, group_start)
+        
+        passthrough = [col for col in order if col not in out]
+        return RawFeatures(frame=df[passthrough], order=order, columns=scaled, matrix=matrix)
+    
+    def _finalize(self, raw: RawFeatures, fit: bool) -> pd.DataFrame:
+        """Kategori kovalarını kodlar, ölçekler ve ölçeklenmeyen sütunları yerlerine ekler."""
+        # Memmap/salt okunur matrisler kopyalanır; kendi matrisimiz yerinde ölçeklenir
+        matrix = np.require(raw.matrix, dtype=np.float32, requirements=['C', 'W', 'O'])
+        scaled = raw.columns
+        for j, name in enumerate(scaled):
+            if name in CATEGORY_BINS:
+                matrix[:, j] = self._category_codes(name, matrix[:, j].astype(np.intp), fit)
+        
+        # Tek vektörel standart ölçekleyici (sklearn StandardScaler ile aynı: ddof=0, NaN yok sayılır)
+        if fit:
+            with np.errstate(invalid='ignore'):
+                mean = np.nanmean(matrix, axis=0, dtype=np.float64)
+                std = np.nanstd(matrix, axis=0, dtype=np.float64)
+            std[~np.isfinite(std) | (std == 0)] = 1.0
+            self.scale_columns = list(scaled)
+            self.mean_ = np.nan_to_num(mean)
+            self.scale_ = std
+            self.fitted = True
+        
+        positions = {name: j for j, name in enumerate(self.scale_columns)}
+        mean = np.zeros(len(scaled), dtype=np.float32)
+        scale = np.ones(len(scaled), dtype=np.float32)
+        for j, name in enumerate(scaled):
+            k = positions.get(name)
+            if k is not None:
+                mean[j] = self.mean_[k]
+                scale[j] = self.scale_[k]
+        matrix -= mean
+        matrix /= scale
+        
+        # Ölçeklenmeyen sütunlar (timestamp, site_id, sayısal olmayanlar) yerlerine eklenir
+        result = pd.DataFrame(matrix, columns=scaled, index=raw.frame.index, copy=False)
+        for position, col in enumerate(raw.order):
+            if col in raw.frame.columns:
+                result.insert(position, col, raw.frame[col].to_numpy())
+        return result
+    
+    @property
+    def lookback(self) -> int:
+        """Bir satırın özellikleri için gereken en uzun geçmiş (lag/rolling) satır sayısı."""
+        return max(max(FEATURE_LAGS), max(FEATURE_WINDOWS) - 1)
+    
+    def required_history(self, input_size: int) -> int:
+        """Son `input_size` satırın özelliklerini tam hesaplamak için gereken satır sayısı."""
+        return input_size + self.lookback
+    
+    def transform_tail(self, df: pd.DataFrame, target_cols: List[str], input_size: int) -> pd.DataFrame:
+        """Yalnızca son `input_size` satırın özelliklerini (seri başına) hesaplar.
+        
+        Girdi yalnızca gereken kuyruk penceresine kırpılır; sonuç, tüm geçmiş
+        üzerinde `transform` çağrısının son satırlarıyla aynıdır.
+        """
+        df, group_start = self._sort_series(df)
+        keys = 'site_id' if group_start is not None else None
+        required = self.required_history(input_size)
+        
+        tail = df.groupby(keys, sort=False).tail(required) if keys else df.tail(required)
+        result = self.transform(tail, target_cols)
+        return result.groupby(keys, sort=False).tail(input_size) if keys else result.tail(input_size)
     
     def fit_transform(self, df: pd.DataFrame, target_cols: List[str]) -> pd.DataFrame:
         """Tüm özellikleri oluşturur ve ölçeklendirir"""
-        df_processed = df.copy()
-        
-        # Zaman özellikleri
-        df_processed = self.create_time_features(df_processed)
-        
-        # Hava durumu özellikleri
-        df_processed = self.create_weather_features(df_processed)
-        
-        # Lag özellikleri
-        lags = [1, 3, 6, 12, 24, 48, 168]  # 1h, 3h, 6h, 12h, 1d, 2d, 1w
-        for target_col in target_cols:
-            if target_col in df_processed.columns:
-                df_processed = self.create_lag_features(df_processed, target_col, lags)
-        
-        # Rolling özellikleri
-        windows = [3, 6, 12, 24, 48, 168]
-        for target_col in target_cols:
-            if target_col in df_processed.columns:
-                df_processed = self.create_rolling_features(df_processed, target_col, windows)
-        
-        # Kategorik değişkenleri encode et
-        categorical_cols = ['wind_category', 'solar_category']
-        for col in categorical_cols:
-            if col in df_processed.columns:
-                if col not in self.encoders:
-                    self.encoders[col] = LabelEncoder()
-                    df_processed[col] = self.encoders[col].fit_transform(df_processed[col].astype(str))
-                else:
-                    df_processed[col] = self.encoders[col].transform(df_processed[col].astype(str))
-        
-        # Sayısal değişkenleri ölçeklendir
-        numeric_cols = df_processed.select_dtypes(include=[np.number]).columns
-        numeric_cols = [col for col in numeric_cols if col not in ['site_id', 'id']]
-        
-        for col in numeric_cols:
-            if col not in self.scalers:
-                self.scalers[col] = StandardScaler()
-                df_processed[col] = self.scalers[col].fit_transform(df_processed[[col]])
-            else:
-                df_processed[col] = self.scalers[col].transform(df_processed[[col]])
-        
-        self.fitted = True
-        return df_processed
+        return self._finalize(self.raw_features(df, target_cols), fit=True)
     
     def transform(self, df: pd.DataFrame, target_cols: List[str]) -> pd.DataFrame:
-        """Önceden fit edilmiş transformerları kullanarak dönüştürür"""
+        """Önceden fit edilmiş ölçekleyiciyi kullanarak dönüştürür"""
         if not self.fitted:
             raise ValueError("FeatureEngineer önce fit edilmelidir!")
+        return self._finalize(self.raw_features(df, target_cols), fit=False)
+    
+    def inverse_target(self, values: np.ndarray, target_col: str) -> np.ndarray:
+        """Ölçeklenmiş hedef değerlerini özgün birime (MW) çevirir."""
+        values = np.asarray(values, dtype=np.float64)
+        if target_col not in self.scale_columns:
+            return values
+        k = self.scale_columns.index(target_col)
+        return values * self.scale_[k] + self.mean_[k]
+    
+    def fit_transform_raw(self, raw: RawFeatures) -> pd.DataFrame:
+        """Önceden hesaplanmış (ör. özellik deposundan okunan) ham özellikleri fit edip ölçekler."""
+        return self._finalize(raw, fit=True)
+
+# Kaydedilen model dizinindeki model tipi işareti (yoksa eski ensemble modeli)
+MODEL_TYPE_FILE = "MODEL_TYPE"
+
+
+class BaseForecaster(ABC):
+    """Tahmin modellerinin ortak arayüzü; servis katmanı modelleri yalnızca bununla kullanır"""
+    
+    model_type = "base"
+    cost_rank = 0  # otomatik seçimde ucuzdan pahalıya sıralama
+    
+    def __init__(self, config: ModelConfig):
+        self.config = config
+        self.is_fitted = False
+        # Dışa aktarılmış TorchScript ağı ve meta bilgisi (varsa tahmin Lightning'siz yapılır)
+        self.inference: Optional[Tuple[Any, Dict[str, Any]]] = None
+    
+    def required_history(self) -> int:
+        """Tahmin için okunması gereken son satır sayısı (seri başına)."""
+        return self.config.input_size
+    
+    @abstractmethod
+    def fit(self, df: pd.DataFrame, target_col: str = 'power_mw', raw_features: Optional[RawFeatures] = None,
+            callbacks: Optional[List[Any]] = None) -> None:
+        """Modeli eğitir (`raw_features` verilirse özellikler yeniden hesaplanmaz)."""
+    
+    @abstractmethod
+    def predict(self, df: pd.DataFrame, target_col: str = 'power_mw', incremental: bool = True,
+                lean: bool = True) -> pd.DataFrame:
+        """Son zaman damgasından sonraki ufuk için tahmin (timestamp, predicted_power_mw)."""
+    
+    def predict_panel(self, df: pd.DataFrame, target_col: str = 'power_mw', incremental: bool = True,
+                      lean: bool = True) -> pd.DataFrame:
+        """Paneldeki her saha için tahmin (site_id, timestamp, predicted_power_mw)."""
+        if not self.is_fitted:
+            raise ValueError("Model önce eğitilmelidir!")
         
-        df_processed = df.copy()
-        
-        # Zaman özellikleri
-        df_processed = self.create_time_features(df_processed)
-        
-        # Hava durumu özellikleri
-        df_processed = self.create_weather_features(df_processed)
-        
-        # Lag özellikleri
-        lags = [1, 3, 6, 12, 24, 48, 168]
-        for target_col in target_cols:
-            if target_col in df_processed.columns:
-                df_processed = self.create_lag_features(df_processed, target_col, lags)
-        
-        # Rolling özellikleri
-        windows = [3, 6, 12, 24, 48, 168]
-        for target_col in target_cols:
-            if target_col in df_processed.columns:
-                df_processed = self.create_rolling_features(df_processed, target_col, windows)
-        
-        # Kategorik değişkenleri encode et
-        categorical_cols = ['wind_category', 'solar_category']
-        for col in categorical_cols:
-            if col in df_processed.columns and col in self.encoders:
-                df_processed[col] = self.encoders[col].transform(df_processed[col].astype(str))
+        frames = []
+        for site_id, group in df.groupby('site_id', sort=True):
+            forecast = self.predict(group, target_col, incremental, lean)
+            forecast.insert(0, 'site_id', site_id)
+            frames.append(forecast)
+        return pd.concat(frames, ignore_index=True)
+    
+    def _future_timestamps(self, df: pd.DataFrame) -> pd.DatetimeIndex:
+        return pd.date_range(start=pd.Timestamp(df['timestamp'].max()) + timedelta(hours=1),
+                             periods=self.config.horizon, freq='H')
+    
+    def export_inference(self, path: str, df: pd.DataFrame, target_col: str = 'power_mw') -> Optional[Dict[str, Any]]:
+        """Optimize CPU çıkarımı yalnızca sinir ağı modellerinde vardır."""
+        return None
+    
+    def predict_components(self, df: pd.DataFrame, target_col: str = 'power_mw') -> pd.DataFrame:
+        """site_id, timestamp ve model bileşeni başına bir tahmin sütunu (geriye dönük testte kullanılır)."""
+        forecast = self.predict_panel(df, target_col, lean=False)
+        return forecast.rename(columns={'predicted_power_mw': self.model_type})
+    
+    def evaluate(self, df_test: pd.DataFrame, target_col: str = 'power_mw') -> Dict[str, float]:
+        """Her serinin son ufkunu ayırır, öncesinden tahmin edip gerçek değerlerle karşılaştırır"""
+        if not self.is_fitted:
+            raise ValueError("Model önce eğitilmelidir!")
         
-        # Sayısal değişkenleri ölçeklendir
-        numeric_cols = df_processed.select_dtypes(include=[np.number]).columns
-        numeric_cols = [col for col in numeric_cols if col not in ['site_id', 'id']]
+        if 'site_id' not in df_test.columns:
+            df_test = df_test.assign(site_id=1)
+        df_test = df_test.assign(timestamp=pd.to_datetime(df_test['timestamp']))
+        df_test = df_test.sort_values(['site_id', 'timestamp'], kind='stable')
+        position = df_test.groupby('site_id', sort=False).cumcount(ascending=False)
+        history, actual = df_test[position >= self.config.horizon], df_test[position < self.config.horizon]
         
-        for col in numeric_cols:
-            if col in self.scalers:
-                df_processed[col] = self.scalers[col].transform(df_processed[[col]])
+        # Tahminler gerçek değerlerle saha ve zamana göre hizalanır
+        predictions = self.predict_panel(history, target_col)
+        merged = predictions.merge(actual[['site_id', 'timestamp', target_col]], on=['site_id', 'timestamp'], how='inner')
+        metrics = error_metrics(merged[target_col].to_numpy(), merged['predicted_power_mw'].to_numpy())
         
-        return df_processed
+        logger.info(f"Model Performansı: {metrics}")
+        return metrics
+    
+    @classmethod
+    def _write_model_type(cls, path: str) -> None:
+        Path(path, MODEL_TYPE_FILE).write_text(cls.model_type, encoding='utf-8')
+    
+    def save_model(self, path: str) -> None:
+        """Modeli (tek pickle olarak) kaydeder"""
+        joblib.dump(self, f"{path}/model.pkl")
+        self._write_model_type(path)
+        logger.info(f"Model kaydedildi: {path}")
+    
+    @classmethod
+    def load(cls, path: str) -> "BaseForecaster":
+        """Kaydedilmiş modeli yükler"""
+        return joblib.load(f"{path}/model.pkl")
+
 
-class EnsembleForecaster:
+class EnsembleForecaster(BaseForecaster):
     """Ensemble tahmin modeli - TFT, N-BEATS, DeepAR kombinasyonu"""
     
+    model_type = "ensemble"
+    cost_rank = 10
+    
     def __init__(self, config: ModelConfig):
-        self.config = config
+        super().__init__(config)
         self.models = {}
         self.feature_engineer = AdvancedFeatureEngineer()
-        self.is_fitted = False
         
         # Model ağırlıkları (ensemble için)
         self.model_weights = {
@@ -241,6 +572,10 @@ class EnsembleForecaster:
             'deepar': 0.3
         }
         
+    def required_history(self) -> int:
+        """Girdi penceresi + en uzun lag/rolling geçmişi."""
+        return self.feature_engineer.required_history(self.config.input_size)
+    
     def _prepare_data_for_neuralforecast(self, df: pd.DataFrame, target_col: str) -> pd.DataFrame:
         """NeuralForecast için veri formatını hazırlar"""
         df_nf = df.copy()
@@ -260,104 +595,211 @@ class EnsembleForecaster:
         
         return df_nf[available_cols]
     
-    def fit(self, df: pd.DataFrame, target_col: str = 'power_mw') -> None:
-        """Ensemble modeli eğitir"""
+    def fit(self, df: pd.DataFrame, target_col: str = 'power_mw', raw_features: Optional[RawFeatures] = None,
+            callbacks: Optional[List[Any]] = None) -> None:
+        """Ensemble modeli eğitir (`raw_features` verilirse özellikler yeniden hesaplanmaz).
+        
+        Her serinin son `config.val_size` saati doğrulamaya ayrılır; erken
+        durdurma ve en iyi epoch'un geri yüklenmesi buna dayanır. Eğitim
+        model başına ve toplamda süre bütçesiyle sınırlıdır. `callbacks` her
+        modelin Lightning trainer'ına eklenir (ör. hiperparametre aramasında budama).
+        """
         logger.info(f"Ensemble model eğitimi başlıyor - Target: {target_col}")
         
         # Feature engineering
-        df_processed = self.feature_engineer.fit_transform(df, [target_col])
+        if raw_features is not None:
+            df_processed = self.feature_engineer.fit_transform_raw(raw_features)
+        else:
+            df_processed = self.feature_engineer.fit_transform(df, [target_col])
         
         # NeuralForecast formatına dönüştür
         df_nf = self._prepare_data_for_neuralforecast(df_processed, target_col)
+        nf = load_neuralforecast()
+        val_size = self._validation_size(df_nf)
+        patience = self.config.patience if val_size else -1
+        budget = self.config.job_time_budget
+        deadline = time.monotonic() + budget if budget > 0 else None
+        
+        with tempfile.TemporaryDirectory(prefix='renecore-ckpt-') as checkpoint_dir:
+            try:
+                self._fit_ensemble(df_nf, nf, val_size, patience, deadline, checkpoint_dir, callbacks)
+            except Exception as e:
+                logger.error(f"Model eğitimi hatası: {str(e)}")
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise TimeoutError(f"Eğitim süresi bütçesi ({budget:.0f}s) doldu, yedek model eğitilmedi") from e
+                # Fallback: Basit LSTM modeli
+                self._fit_fallback_model(df_nf, nf, val_size, deadline, checkpoint_dir)
+    
+    def _fit_ensemble(self, df_nf: pd.DataFrame, nf: SimpleNamespace, val_size: int, patience: int,
+                      deadline: Optional[float], checkpoint_dir: str, callbacks: Optional[List[Any]]) -> None:
+        """TFT, N-BEATS ve DeepAR'ı eğitir."""
+        # Model tanımları
+        models = [
+            nf.TFT(
+                h=self.config.horizon,
+                input_size=self.config.input_size,
+                hidden_size=self.config.hidden_size,
+                n_head=8,
+                dropout=self.config.dropout,
+                max_epochs=self.config.max_epochs,
+                batch_size=self.config.batch_size,
+                learning_rate=self.config.learning_rate,
+                early_stop_patience_steps=patience,
+                val_check_steps=self.config.val_check_steps,
+                loss=nf.MAE(),
+                alias='TFT'
+            ),
+            nf.NBEATS(
+                h=self.config.horizon,
+                input_size=self.config.input_size,
+                max_epochs=self.config.max_epochs,
+                batch_size=self.config.batch_size,
+                learning_rate=self.config.learning_rate,
+                early_stop_patience_steps=patience,
+                val_check_steps=self.config.val_check_steps,
+                loss=nf.MAE(),
+                alias='NBEATS'
+            ),
+            nf.DeepAR(
+                h=self.config.horizon,
+                input_size=self.config.input_size,
+                hidden_size=self.config.hidden_size,
+                max_epochs=self.config.max_epochs,
+                batch_size=self.config.batch_size,
+                learning_rate=self.config.learning_rate,
+                early_stop_patience_steps=patience,
+                val_check_steps=self.config.val_check_steps,
+                loss=nf.MAE(),
+                alias='DeepAR'
+            )
+        ]
         
-        try:
-            # Model tanımları
-            models = [
-                TFT(
-                    h=self.config.horizon,
-                    input_size=self.config.input_size,
-                    hidden_size=self.config.hidden_size,
-                    n_head=8,
-                    dropout=self.config.dropout,
-                    max_epochs=self.config.max_epochs,
-                    batch_size=self.config.batch_size,
-                    learning_rate=self.config.learning_rate,
-                    early_stop_patience_steps=self.config.patience,
-                    loss=MAE(),
-                    alias='TFT'
-                ),
-                NBEATS(
-                    h=self.config.horizon,
-                    input_size=self.config.input_size,
-                    max_epochs=self.config.max_epochs,
-                    batch_size=self.config.batch_size,
-                    learning_rate=self.config.learning_rate,
-                    early_stop_patience_steps=self.config.patience,
-                    loss=MAE(),
-                    alias='NBEATS'
-                ),
-                DeepAR(
-                    h=self.config.horizon,
-                    input_size=self.config.input_size,
-                    hidden_size=self.config.hidden_size,
-                    max_epochs=self.config.max_epochs,
-                    batch_size=self.config.batch_size,
-                    learning_rate=self.config.learning_rate,
-                    early_stop_patience_steps=self.config.patience,
-                    loss=MAE(),
-                    alias='DeepAR'
-                )
-            ]
-            
-            # NeuralForecast objesi oluştur
-            self.nf = NeuralForecast(models=models, freq='H')
-            
-            # Modeli eğit
-            self.nf.fit(df_nf)
-            
-            self.is_fitted = True
-            logger.info("Ensemble model eğitimi tamamlandı!")
-            
-        except Exception as e:
-            logger.error(f"Model eğitimi hatası: {str(e)}")
-            # Fallback: Basit LSTM modeli
-            self._fit_fallback_model(df_processed, target_col)
+        checkpoints = [
+            self._configure_trainer(model, nf, val_size, deadline, checkpoint_dir, callbacks)
+            for model in models
+        ]
+        
+        # NeuralForecast objesi oluştur
+        self.nf = nf.NeuralForecast(models=models, freq='H')
+        
+        # Modeli eğit
+        self.nf.fit(df_nf, val_size=val_size)
+        self._restore_best(self.nf.models, checkpoints)
+        
+        self.is_fitted = True
+        logger.info("Ensemble model eğitimi tamamlandı!")
     
-    def _fit_fallback_model(self, df: pd.DataFrame, target_col: str) -> None:
+    def _fit_fallback_model(self, df_nf: pd.DataFrame, nf: SimpleNamespace, val_size: int,
+                            deadline: Optional[float], checkpoint_dir: str) -> None:
         """Basit LSTM fallback modeli"""
         logger.info("Fallback LSTM modeli eğitiliyor...")
         
-        df_nf = self._prepare_data_for_neuralforecast(df, target_col)
-        
         models = [
-            LSTM(
+            nf.LSTM(
                 h=self.config.horizon,
                 input_size=self.config.input_size,
                 hidden_size=128,
                 max_epochs=50,
                 batch_size=self.config.batch_size,
                 learning_rate=self.config.learning_rate,
+                early_stop_patience_steps=self.config.patience if val_size else -1,
+                val_check_steps=self.config.val_check_steps,
                 alias='LSTM_Fallback'
             )
         ]
+        checkpoints = [self._configure_trainer(models[0], nf, val_size, deadline, checkpoint_dir)]
         
-        self.nf = NeuralForecast(models=models, freq='H')
-        self.nf.fit(df_nf)
+        self.nf = nf.NeuralForecast(models=models, freq='H')
+        self.nf.fit(df_nf, val_size=val_size)
+        self._restore_best(self.nf.models, checkpoints)
         self.is_fitted = True
+    
+    def _validation_size(self, df_nf: pd.DataFrame) -> int:
+        """Doğrulama penceresi; en kısa seri eğitim + doğrulama pencerelerine yetmiyorsa 0."""
+        val_size = max(int(self.config.val_size), 0)
+        shortest = int(df_nf.groupby('unique_id').size().min())
+        if val_size and shortest < self.config.input_size + self.config.horizon + val_size:
+            logger.warning(f"Seri doğrulama için çok kısa ({shortest} saat), erken durdurma kapalı")
+            return 0
+        return val_size
+    
+    def _configure_trainer(self, model: Any, nf: SimpleNamespace, val_size: int, deadline: Optional[float],
+                           checkpoint_dir: str, callbacks: Optional[List[Any]] = None) -> Optional[Any]:
+        """Modelin trainer ayarlarına süre bütçesini, en iyi epoch kaydını ve ek callback'leri ekler.
+        
+        Ayarlar yapıcıdan sonra eklenir; böylece modelin kayıtlı hiperparametrelerine
+        (checkpoint) girmezler. En iyi epoch kaydedicisini (yoksa None) döndürür.
+        """
+        trainer_kwargs = model.trainer_kwargs
+        extra = list(callbacks or [])
+        if self.config.model_time_budget > 0:
+            trainer_kwargs['max_time'] = timedelta(seconds=self.config.model_time_budget)
+        if deadline is not None:
+            extra.append(nf.DeadlineCallback(deadline))
+        
+        checkpoint = None
+        if val_size:
+            checkpoint = nf.ModelCheckpoint(
+                dirpath=os.path.join(checkpoint_dir, model.alias or type(model).__name__),
+                monitor='ptl/val_loss', mode='min', save_top_k=1, save_weights_only=True,
+            )
+            extra.append(checkpoint)
+            # NeuralForecast checkpoint'i varsayılan olarak kapatır
+            trainer_kwargs['enable_checkpointing'] = True
+        trainer_kwargs['callbacks'] = [*trainer_kwargs.get('callbacks', []), *extra]
+        return checkpoint
+    
+    @staticmethod
+    def _restore_best(models: List[Any], checkpoints: List[Optional[Any]]) -> None:
+        """Her modele doğrulama kaybı en düşük epoch'un ağırlıklarını geri yükler."""
+        import torch
+        
+        for model, checkpoint in zip(models, checkpoints):
+            if checkpoint is None or not checkpoint.best_model_path:
+                continue
+            state = torch.load(checkpoint.best_model_path, map_location='cpu')
+            model.load_state_dict(state['state_dict'])
+            logger.info(f"{model.alias}: en iyi doğrulama kaybı {float(checkpoint.best_model_score):.4f} geri yüklendi")
+        
+    def _inference_features(self, df: pd.DataFrame, target_col: str, incremental: bool) -> pd.DataFrame:
+        """Tahmin girdisinin özellikleri; artımlı modda yalnızca son input_size satır hesaplanır."""
+        if incremental:
+            return self.feature_engineer.transform_tail(df, [target_col], self.config.input_size)
+        return self.feature_engineer.transform(df, [target_col])
+    
+    def _forecast(self, df_nf: pd.DataFrame, lean: bool) -> pd.DataFrame:
+        """nf.predict biçiminde tahmin; aktarılmış ağ varsa Lightning'siz yoldan."""
+        if lean and self.inference is not None:
+            from .ml_inference import forecast_frame
+            
+            module, meta = self.inference
+            return forecast_frame(module, df_nf, meta['input_size'], meta['horizon'], meta['alias'])
+        return self.nf.predict(df_nf)
+    
+    def export_inference(self, path: str, df: pd.DataFrame, target_col: str = 'power_mw') -> Optional[Dict[str, Any]]:
+        """Tahmin ağını optimize CPU çıkarımı için aktarır; `df`'in son penceresiyle parite kontrol edilir."""
+        from .ml_inference import export_inference, load_inference
         
-    def predict(self, df: pd.DataFrame, target_col: str = 'power_mw') -> pd.DataFrame:
+        df_processed = self._inference_features(df, target_col, incremental=True)
+        df_nf = self._prepare_data_for_neuralforecast(df_processed, target_col)
+        meta = export_inference(self.nf, df_nf, self.config.input_size, self.config.horizon, Path(path))
+        self.inference = load_inference(Path(path)) if meta else None
+        return meta
+    
+    def predict(self, df: pd.DataFrame, target_col: str = 'power_mw', incremental: bool = True,
+                lean: bool = True) -> pd.DataFrame:
         """7 günlük tahmin yapar"""
         if not self.is_fitted:
             raise ValueError("Model önce eğitilmelidir!")
         
         # Feature engineering (transform only)
-        df_processed = self.feature_engineer.transform(df, [target_col])
+        df_processed = self._inference_features(df, target_col, incremental)
         
         # NeuralForecast formatına dönüştür
         df_nf = self._prepare_data_for_neuralforecast(df_processed, target_col)
         
         # Tahmin yap
-        forecasts = self.nf.predict(df_nf)
+        forecasts = self._forecast(df_nf, lean)
         
         # Sonuçları düzenle
         forecast_df = forecasts.reset_index()
@@ -370,41 +812,61 @@ class EnsembleForecaster:
             freq='H'
         )
         
-        # Sonuç DataFrame'i oluştur
+        # Sonuç DataFrame'i oluştur (hedef ölçeklenmiş olarak eğitildiğinden MW'a geri çevrilir)
         result_df = pd.DataFrame({
             'timestamp': future_timestamps,
-            'predicted_power_mw': forecast_df.iloc[:, -1].values  # Son sütun tahmin
+            'predicted_power_mw': self.feature_engineer.inverse_target(forecast_df.iloc[:, -1].values, target_col)  # Son sütun tahmin
         })
         
         return result_df
     
-    def evaluate(self, df_test: pd.DataFrame, target_col: str = 'power_mw') -> Dict[str, float]:
-        """Model performansını değerlendirir"""
+    def predict_panel(self, df: pd.DataFrame, target_col: str = 'power_mw', incremental: bool = True,
+                      lean: bool = True) -> pd.DataFrame:
+        """Filo panelindeki tüm sahalar için tek bir batch tahmin yapar.
+        
+        Dönen DataFrame uzun formattadır: site_id, timestamp, predicted_power_mw.
+        """
         if not self.is_fitted:
             raise ValueError("Model önce eğitilmelidir!")
         
-        # Test verisi üzerinde tahmin yap
-        predictions = self.predict(df_test, target_col)
+        df_processed = self._inference_features(df, target_col, incremental)
+        df_nf = self._prepare_data_for_neuralforecast(df_processed, target_col)
         
-        # Gerçek değerlerle karşılaştır
-        actual = df_test[target_col].values[-len(predictions):]
-        predicted = predictions['predicted_power_mw'].values
+        # Tek çağrıda tüm unique_id'ler tahmin edilir
+        forecasts = self._forecast(df_nf, lean).reset_index()
+        model_cols = [col for col in forecasts.columns if col not in ('unique_id', 'ds', 'index')]
         
-        # Metrikleri hesapla
-        mae = mean_absolute_error(actual, predicted)
-        mse = mean_squared_error(actual, predicted)
-        rmse = np.sqrt(mse)
-        mape = np.mean(np.abs((actual - predicted) / actual)) * 100
+        return pd.DataFrame({
+            'site_id': forecasts['unique_id'].values,
+            'timestamp': pd.to_datetime(forecasts['ds']).values,
+            'predicted_power_mw': self.feature_engineer.inverse_target(forecasts[model_cols[-1]].values, target_col)  # Son sütun tahmin
+        })
+    
+    def predict_components(self, df: pd.DataFrame, target_col: str = 'power_mw') -> pd.DataFrame:
+        """Her ağın (ensemble:TFT, ...) ve `model_weights` ile ağırlıklı ensemble'ın (ensemble:weighted) tahmini."""
+        if not self.is_fitted:
+            raise ValueError("Model önce eğitilmelidir!")
         
-        metrics = {
-            'MAE': mae,
-            'MSE': mse,
-            'RMSE': rmse,
-            'MAPE': mape
-        }
+        df_processed = self._inference_features(df, target_col, incremental=True)
+        df_nf = self._prepare_data_for_neuralforecast(df_processed, target_col)
+        forecasts = self.nf.predict(df_nf).reset_index()
+        model_cols = [col for col in forecasts.columns if col not in ('unique_id', 'ds', 'index')]
         
-        logger.info(f"Model Performansı: {metrics}")
-        return metrics
+        result = pd.DataFrame({
+            'site_id': forecasts['unique_id'].values,
+            'timestamp': pd.to_datetime(forecasts['ds']).values,
+        })
+        weighted = np.zeros(len(forecasts))
+        total_weight = 0.0
+        for col in model_cols:
+            values = self.feature_engineer.inverse_target(forecasts[col].values, target_col)
+            result[f'ensemble:{col}'] = values
+            weight = self.model_weights.get(col.lower(), 0.0)
+            weighted += weight * values
+            total_weight += weight
+        if total_weight > 0:
+            result['ensemble:weighted'] = weighted / total_weight
+        return result
     
     def save_model(self, path: str) -> None:
         """Modeli kaydeder"""
@@ -420,6 +882,7 @@ class EnsembleForecaster:
         # NeuralForecast modelini kaydet
         if hasattr(self, 'nf'):
             self.nf.save(path=f"{path}/neural_forecast_models")
+        self._write_model_type(path)
         
         logger.info(f"Model kaydedildi: {path}")
     
@@ -434,10 +897,14 @@ class EnsembleForecaster:
         
         # NeuralForecast modelini yükle
         try:
-            self.nf = NeuralForecast.load(path=f"{path}/neural_forecast_models")
+            self.nf = load_neuralforecast().NeuralForecast.load(path=f"{path}/neural_forecast_models")
         except:
             logger.warning("NeuralForecast modeli yüklenemedi")
         
+        # Optimize CPU çıkarımı (dışa aktarılmışsa)
+        from .ml_inference import load_inference
+        self.inference = load_inference(Path(path))
+        
         logger.info(f"Model yüklendi: {path}")
 
 # Model fabrikası
@@ -445,12 +912,33 @@ class ModelFactory:
     """Model oluşturma fabrikası"""
     
     @staticmethod
-    def create_model(model_type: str, config: ModelConfig) -> EnsembleForecaster:
+    def model_types() -> Dict[str, type]:
+        """Kayıtlı model tipleri (hafif modeller ilk kullanımda import edilir)"""
+        from .fast_models import GradientBoostingForecaster, PhysicsForecaster, SeasonalNaiveForecaster
+        
+        return {
+            cls.model_type: cls
+            for cls in (EnsembleForecaster, SeasonalNaiveForecaster, PhysicsForecaster, GradientBoostingForecaster)
+        }
+    
+    @staticmethod
+    def create_model(model_type: str, config: ModelConfig) -> BaseForecaster:
         """Belirtilen tipte model oluşturur"""
-        if model_type == "ensemble":
-            return EnsembleForecaster(config)
-        else:
+        model_cls = ModelFactory.model_types().get(model_type)
+        if model_cls is None:
             raise ValueError(f"Desteklenmeyen model tipi: {model_type}")
+        return model_cls(config)
+    
+    @staticmethod
+    def load_model(path: str) -> BaseForecaster:
+        """Dizindeki modeli tipine göre yükler (tip işareti yoksa ensemble)"""
+        type_path = Path(path, MODEL_TYPE_FILE)
+        model_type = type_path.read_text(encoding='utf-8').strip() if type_path.exists() else "ensemble"
+        if model_type != "ensemble":
+            return ModelFactory.model_types()[model_type].load(path)
+        model = EnsembleForecaster(ModelFactory.get_default_config())
+        model.load_model(path)
+        return model
     
     @staticmethod
     def get_default_config() -> ModelConfig:
@@ -465,7 +953,11 @@ class ModelFactory:
             learning_rate=0.001,
             batch_size=32,
             max_epochs=100,
-            patience=10
+            patience=10,
+            val_size=TRAIN_VAL_SIZE,
+            val_check_steps=TRAIN_VAL_CHECK_STEPS,
+            model_time_budget=TRAIN_MODEL_BUDGET_SECONDS,
+            job_time_budget=TRAIN_JOB_BUDGET_SECONDS
         )
 
 # Kullanım örneği
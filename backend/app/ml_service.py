@@ -4,101 +4,755 @@ ML servis katmanı – model eğitme, yükleme ve tahmin işlevleri
 from __future__ import annotations
 
 import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict
+from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any
+from typing import TYPE_CHECKING, Callable, Dict, Any, List, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
+from sqlalchemy import delete, func, insert
 from sqlmodel import Session, select
 from loguru import logger
 
-from .models import ForecastRecord, Site
-from .ml_models import ModelFactory, EnsembleForecaster, ModelConfig
+from .models import ForecastRecord, PredictionRecord, Site, SiteDataVersion
+from .metrics import observe_stage, registry, ML_DURATION, MODEL_CACHE_EVENTS
+from .model_registry import model_registry
+
+# ml_models (sklearn, NeuralForecast/torch) ilk eğitim veya tahminde import edilir
+if TYPE_CHECKING:
+    from .ml_models import BaseForecaster, ModelConfig, RawFeatures
 
 # Model kayıt dizini
 MODEL_DIR = Path(os.getenv("ML_MODEL_DIR", "./models"))
 MODEL_DIR.mkdir(parents=True, exist_ok=True)
 
+# Eğitilecek model tipi: "ensemble", hafif modellerden biri veya "auto" (ayrılmış ufukta en ucuz yeterli model)
+MODEL_TYPE = os.getenv("ML_MODEL_TYPE", "ensemble")
+
+# Tüm sahalar için ortak (filo) modelin anahtarı ve dizin adı
+FLEET_MODEL_KEY = "fleet"
+
+# Yüklü model önbelleği sınırları
+MODEL_CACHE_MAX_MODELS = int(os.getenv("ML_MODEL_CACHE_MAX_MODELS", "8"))
+MODEL_CACHE_MAX_MB = float(os.getenv("ML_MODEL_CACHE_MAX_MB", "1024"))
+# Yüklü modellerin güncel sürüm işaretçisini arka planda kontrol etme aralığı (saniye; 0 = kapalı)
+MODEL_RELOAD_SECONDS = float(os.getenv("ML_MODEL_RELOAD_SECONDS", "30"))
+
+# Eğitim/tahmin için okunan ForecastRecord sütunları ve akış parça boyutu (satır)
+ML_DATA_COLUMNS = ("timestamp", "site_id", "wind_speed", "ghi", "power_mw", "battery_soc", "battery_power_mw")
+ML_FETCH_CHUNK_ROWS = int(os.getenv("ML_FETCH_CHUNK_ROWS", "10000"))
+
+# Kayıtlı toplu tahminlerin en uzun geçerlilik süresi (saat); yenileme döngüsü son saatleri yeniden yazar
+PREDICTION_MAX_AGE_HOURS = float(os.getenv("ML_PREDICTION_MAX_AGE_HOURS", "24"))
+
+# Tahmin penceresi durumu: saha verisi değişmedikçe son pencere bellekte tutulur
+FEATURE_STATE_ENABLED = os.getenv("ML_FEATURE_STATE", "1").lower() in ("1", "true", "yes")
+FEATURE_STATE_MAX_SITES = int(os.getenv("ML_FEATURE_STATE_MAX_SITES", "256"))
+
+
+def _column_chunk(name: str, values: tuple, downcast: bool) -> np.ndarray:
+    """Tek bir parçanın sütun değerlerini tipli NumPy dizisine çevirir (None -> NaN)."""
+    if name == "timestamp":
+        return np.array(values, dtype="datetime64[ns]")
+    if name == "site_id":
+        return np.array(values, dtype=np.int32 if downcast else np.int64)
+    dtype = np.float32 if downcast else np.float64
+    return np.fromiter((np.nan if v is None else v for v in values), dtype=dtype, count=len(values))
+
+
+def _get_panel_data(
+    db: Session,
+    site_ids: Optional[List[int]] = None,
+    tail: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    downcast: bool = False,
+) -> pd.DataFrame:
+    """Sahaların geçmiş ForecastRecord verilerini saha ve zamana göre sıralı tek panelde getirir.
+
+    Yalnızca ML_DATA_COLUMNS seçilir ve satırlar ML_FETCH_CHUNK_ROWS'luk
+    parçalar halinde (sunucu tarafı cursor) okunup doğrudan sütun dizilerine
+    yazılır; ORM nesnesi oluşturulmaz. `start`/`end` zaman aralığını
+    ([start, end)), `tail` saha başına son N kaydı sınırlar; `downcast`
+    sayısal sütunları float32/int32 olarak döndürür.
+    """
+    columns = [getattr(ForecastRecord, name) for name in ML_DATA_COLUMNS]
+    stmt = select(*columns)
+
+    conditions = []
+    if site_ids is not None:
+        conditions.append(ForecastRecord.site_id.in_(site_ids))
+    if start is not None:
+        conditions.append(ForecastRecord.timestamp >= start)
+    if end is not None:
+        conditions.append(ForecastRecord.timestamp < end)
+
+    if tail is not None and site_ids is not None and len(site_ids) == 1:
+        # Tek saha: (site_id, timestamp) sırasıyla sondan LIMIT
+        latest = (
+            select(ForecastRecord.id)
+            .where(*conditions)
+            .order_by(ForecastRecord.timestamp.desc())
+            .limit(tail)
+            .subquery()
+        )
+        stmt = stmt.join(latest, latest.c.id == ForecastRecord.id)
+    elif tail is not None:
+        # Birden fazla saha: saha başına son N satır (window function)
+        rank = func.row_number().over(
+            partition_by=ForecastRecord.site_id,
+            order_by=ForecastRecord.timestamp.desc(),
+        ).label("rank")
+        ranked = select(ForecastRecord.id, rank).where(*conditions).subquery()
+        stmt = stmt.join(ranked, ranked.c.id == ForecastRecord.id).where(ranked.c.rank <= tail)
+    elif conditions:
+        stmt = stmt.where(*conditions)
+
+    stmt = stmt.order_by(ForecastRecord.site_id, ForecastRecord.timestamp)
+    result = db.exec(stmt.execution_options(yield_per=ML_FETCH_CHUNK_ROWS))
 
-def _get_site_data(db: Session, site_id: int) -> pd.DataFrame:
-    """Belirli bir saha için tüm geçmiş ForecastRecord verilerini getirir."""
-    stmt = (
-        select(ForecastRecord)
-        .where(ForecastRecord.site_id == site_id)
-        .order_by(ForecastRecord.timestamp)
-    )
-    records = db.exec(stmt).all()
-    if not records:
+    chunks: Dict[str, List[np.ndarray]] = {name: [] for name in ML_DATA_COLUMNS}
+    for rows in result.partitions():
+        for name, values in zip(ML_DATA_COLUMNS, zip(*rows)):
+            chunks[name].append(_column_chunk(name, values, downcast))
+
+    if not chunks["timestamp"]:
         raise ValueError("Seçilen saha için yeterli veri bulunamadı")
 
-    df = pd.DataFrame([
-        {
-            "timestamp": r.timestamp,
-            "site_id": r.site_id,
-            "wind_speed": r.wind_speed,
-            "ghi": r.ghi,
-            "power_mw": r.power_mw,
-            "price_eur_mwh": None,  # price alanı ForecastRecord'da yok, placeholder
-            "battery_soc": r.battery_soc,
-            "battery_power_mw": r.battery_power_mw,
-        }
-        for r in records
-    ])
-    return df
+    data = {name: np.concatenate(parts) if len(parts) > 1 else parts[0] for name, parts in chunks.items()}
+    n = len(data["timestamp"])
+    return pd.DataFrame({
+        "timestamp": data["timestamp"],
+        "site_id": data["site_id"],
+        "wind_speed": data["wind_speed"],
+        "ghi": data["ghi"],
+        "power_mw": data["power_mw"],
+        "price_eur_mwh": np.full(n, np.nan, dtype=np.float32 if downcast else np.float64),  # price alanı ForecastRecord'da yok, placeholder
+        "battery_soc": data["battery_soc"],
+        "battery_power_mw": data["battery_power_mw"],
+    }, copy=False)
 
 
-def _get_model_path(site_id: int) -> Path:
-    return MODEL_DIR / f"site_{site_id}"
+def _get_site_data(
+    db: Session,
+    site_id: int,
+    tail: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    downcast: bool = False,
+) -> pd.DataFrame:
+    """Belirli bir saha için geçmiş ForecastRecord verilerini (veya son `tail` kaydı) getirir."""
+    return _get_panel_data(db, [site_id], tail=tail, start=start, end=end, downcast=downcast)
 
 
-def train_model(db: Session, site_id: int) -> Dict[str, Any]:
-    """Belirtilen saha için modeli eğitir ve kaydeder."""
-    logger.info(f"ML eğitim başlıyor | site_id={site_id}")
-    df = _get_site_data(db, site_id)
+class InferenceWindowCache:
+    """Saha başına son tahmin penceresini (ham kuyruk satırları) tutan LRU önbellek.
+
+    Geçerlilik, ForecastRecord yazımlarının aynı transaction'da artırdığı
+    SiteDataVersion satırıyla (tek birincil anahtar okuması) doğrulanır.
+    Sürüm DB'de tutulduğundan başka bir süreç (diğer API worker'ı, yenileme
+    döngüsü) veri yazsa bile eski pencere kullanılmaz.
+    """
+
+    def __init__(self, max_sites: int = FEATURE_STATE_MAX_SITES):
+        self.max_sites = max_sites
+        self._entries: "OrderedDict[int, Tuple[int, int, pd.DataFrame]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _data_version(db: Session, site_id: int) -> int:
+        version = db.exec(select(SiteDataVersion.version).where(SiteDataVersion.site_id == site_id)).first()
+        return version or 0
+
+    def get(self, db: Session, site_id: int, rows: int) -> pd.DataFrame:
+        """Sahanın son `rows` satırını döndürür."""
+        # Sürüm pencereden önce okunur; arada yazım olursa pencere bir sonraki çağrıda yenilenir
+        version = self._data_version(db, site_id)
+        with self._lock:
+            entry = self._entries.get(site_id)
+            if entry is not None and entry[0] == version and entry[1] >= rows:
+                self._entries.move_to_end(site_id)
+                self.hits += 1
+                return entry[2].tail(rows)
+            self.misses += 1
+
+        df = _get_site_data(db, site_id, tail=rows)
+        with self._lock:
+            self._entries[site_id] = (version, rows, df)
+            self._entries.move_to_end(site_id)
+            while len(self._entries) > self.max_sites:
+                self._entries.popitem(last=False)
+        return df
+
+    def clear(self) -> None:
+        """Tüm pencereleri temizler."""
+        with self._lock:
+            self._entries.clear()
+
+
+def _get_model_path(site_id: Union[int, str]) -> Path:
+    """Model anahtarının kayıt dizini (sürümler ve ayarlanmış konfigürasyon altında)."""
+    return model_registry.key_path(site_id)
+
+
+def get_model_version(site_id: Union[int, str]) -> str:
+    """Kayıtlı modelin güncel versiyonunu döndürür (kayıt defterinin CURRENT işaretçisi)."""
+    return model_registry.current_version(site_id)
+
+
+def _directory_size(path: Path) -> int:
+    """Model dizinindeki dosyaların toplam boyutu (bellek kullanımı tahmini)."""
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+class ModelCache:
+    """(site_id veya filo anahtarı, model versiyonu) anahtarlı, sayı ve bellek sınırlı LRU model önbelleği.
+
+    Versiyon her istekte kayıt defterinin işaretçisinden okunur; başka bir
+    süreç yeni sürüm yayınlasa bile eski girdi sessizce kullanılmaz. Önbellekte
+    eski bir sürüm varsa istekler onunla yanıtlanmaya devam eder, yeni sürüm
+    arka planda yüklenip hazır olunca atomik olarak devreye girer. Bir izleyici
+    thread, istek gelmeden de yüklü anahtarların işaretçisini MODEL_RELOAD_SECONDS
+    aralıkla kontrol eder. Bellek, sürüm dizininin disk boyutuyla tahmin edilir.
+    """
+
+    def __init__(self, max_models: int = MODEL_CACHE_MAX_MODELS, max_bytes: float = MODEL_CACHE_MAX_MB * 1024 * 1024,
+                 reload_seconds: float = MODEL_RELOAD_SECONDS):
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.reload_seconds = reload_seconds
+        self._entries: "OrderedDict[int, Tuple[str, Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks: Dict[int, threading.Lock] = {}
+        self._reloading: Dict[Any, str] = {}
+        self._failed: Dict[Any, str] = {}
+        self._watcher: Optional[threading.Thread] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reloads = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(size for _, _, size in self._entries.values())
+
+    def _lookup(self, site_id: int, version: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(site_id)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(site_id)
+            return entry[1]
+
+    def get(self, site_id: int) -> "BaseForecaster":
+        """Sahanın güncel modelini döndürür; önbellekte yoksa diskten yükler."""
+        return self.get_versioned(site_id)[0]
+
+    def get_versioned(self, site_id: int) -> Tuple["BaseForecaster", str]:
+        """Model ve yanıtı üreten sürümü döndürür (yeni sürüm yüklenirken bir önceki olabilir)."""
+        version = get_model_version(site_id)
+        model = self._lookup(site_id, version)
+        if model is not None:
+            self.hits += 1
+            MODEL_CACHE_EVENTS.inc(event="hit")
+            return model, version
+
+        # Eski sürüm yüklüyse istek bekletilmez; yeni sürüm arka planda yüklenir.
+        # Yüklemesi başarısız olan sürüm yeniden denenmez, eski sürüm sunulmaya devam eder.
+        with self._lock:
+            stale = self._entries.get(site_id)
+            failed = self._failed.get(site_id) == version
+        if stale is not None:
+            if not failed:
+                self._reload_async(site_id, version)
+            self.hits += 1
+            MODEL_CACHE_EVENTS.inc(event="stale")
+            return stale[1], stale[0]
+
+        # Aynı saha için eşzamanlı yüklemeler tek bir yüklemede birleşir
+        with self._lock:
+            load_lock = self._load_locks.setdefault(site_id, threading.Lock())
+        with load_lock:
+            model = self._lookup(site_id, version)
+            if model is not None:
+                self.hits += 1
+                MODEL_CACHE_EVENTS.inc(event="hit")
+                return model, version
+
+            self.misses += 1
+            MODEL_CACHE_EVENTS.inc(event="miss")
+            model = load_model(site_id, version)
+            self._put(site_id, version, model, _directory_size(model_registry.version_path(site_id, version)))
+            return model, version
+
+    def _reload_async(self, site_id: Any, version: str) -> None:
+        with self._lock:
+            if self._reloading.get(site_id) == version:
+                return
+            self._reloading[site_id] = version
+        threading.Thread(target=self._reload, args=(site_id, version), name=f"model-reload-{site_id}",
+                         daemon=True).start()
+
+    def _reload(self, site_id: Any, version: str) -> None:
+        """Yeni sürümü yükleyip önbellekteki eski sürümün yerine koyar (arka plan thread'i)."""
+        try:
+            with self._lock:
+                load_lock = self._load_locks.setdefault(site_id, threading.Lock())
+            with load_lock:
+                if self._lookup(site_id, version) is not None:
+                    return
+                model = load_model(site_id, version)
+                self._put(site_id, version, model, _directory_size(model_registry.version_path(site_id, version)))
+            self.reloads += 1
+            MODEL_CACHE_EVENTS.inc(event="reload")
+            logger.info(f"Model sürümü arka planda yüklendi | key={site_id} version={version}")
+        except Exception as exc:
+            # Bozuk sürüm tekrar tekrar denenmez; eski sürüm yanıt vermeye devam eder
+            self._failed[site_id] = version
+            logger.error(f"Yeni model sürümü yüklenemedi, önceki sürüm kullanılıyor | key={site_id} version={version}: {exc}")
+        finally:
+            with self._lock:
+                if self._reloading.get(site_id) == version:
+                    del self._reloading[site_id]
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(self.reload_seconds)
+            with self._lock:
+                loaded = [(site_id, entry[0]) for site_id, entry in self._entries.items()]
+            for site_id, loaded_version in loaded:
+                try:
+                    version = get_model_version(site_id)
+                except FileNotFoundError:
+                    continue
+                if version != loaded_version and self._failed.get(site_id) != version:
+                    self._reload_async(site_id, version)
+
+    def _put(self, site_id: int, version: str, model: Any, size: int) -> None:
+        with self._lock:
+            self._entries[site_id] = (version, model, size)
+            self._entries.move_to_end(site_id)
+            while len(self._entries) > 1 and (
+                len(self._entries) > self.max_models or self.total_bytes > self.max_bytes
+            ):
+                self._entries.popitem(last=False)
+                self.evictions += 1
+                MODEL_CACHE_EVENTS.inc(event="evict")
+            if self._watcher is None and self.reload_seconds > 0:
+                self._watcher = threading.Thread(target=self._watch, name="model-reload-watcher", daemon=True)
+                self._watcher.start()
+
+    def refresh(self, site_id: Any) -> None:
+        """Anahtar yüklüyse güncel sürümünü arka planda yükler (yeni eğitim veya geri alma sonrası)."""
+        with self._lock:
+            loaded = site_id in self._entries
+        if loaded:
+            self._failed.pop(site_id, None)
+            self._reload_async(site_id, get_model_version(site_id))
+
+    def invalidate(self, site_id: int) -> None:
+        """Sahanın önbellekteki modelini düşürür."""
+        with self._lock:
+            if self._entries.pop(site_id, None) is not None:
+                MODEL_CACHE_EVENTS.inc(event="invalidate")
+
+    def clear(self) -> None:
+        """Tüm önbelleği temizler."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Önbellek istatistiklerini döndürür."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "reloads": self.reloads,
+                "reloading": len(self._reloading),
+                "versions": {str(site_id): entry[0] for site_id, entry in self._entries.items()},
+                "max_models": self.max_models,
+                "max_bytes": int(self.max_bytes),
+            }
+
+
+def preload() -> None:
+    """ML yığınını önceden import eder (ML_PRELOAD ile başlangıçta çağrılır)."""
+    from . import ml_models
+
+    ml_models.load_neuralforecast()
+
+
+def _training_data(db: Session, site_ids: Optional[List[int]]) -> Tuple[pd.DataFrame, Optional[RawFeatures]]:
+    """Eğitim verisi; özellik deposu açıksa ham özellikler depodan (memmap) okunur."""
+    from .feature_store import FEATURE_STORE_ENABLED, feature_store
+
+    if FEATURE_STORE_ENABLED:
+        try:
+            return feature_store.read(db, site_ids)
+        except OSError as exc:
+            logger.warning(f"Özellik deposu okunamadı, özellikler yeniden hesaplanacak: {exc}")
+    return _get_panel_data(db, site_ids), None
 
-    # Model oluştur
-    config: ModelConfig = ModelFactory.get_default_config()
-    model: EnsembleForecaster = ModelFactory.create_model("ensemble", config)
+
+def _export_inference(model: BaseForecaster, save_path: Path, df: pd.DataFrame) -> Optional[Dict[str, Any]]:
+    """Tahmin ağını TorchScript'e aktarır (ML_EXPORT_INFERENCE); başarısızlık eğitimi bozmaz."""
+    from .ml_inference import EXPORT_ENABLED
+
+    if not EXPORT_ENABLED:
+        return None
+    try:
+        return model.export_inference(str(save_path), df, target_col="power_mw")
+    except Exception as exc:
+        logger.warning(f"Optimize CPU çıkarımı aktarılamadı: {exc}")
+        return None
+
+
+def _fit_and_save(
+    df: pd.DataFrame,
+    model_key: Union[int, str],
+    report: Callable[[str, float], None],
+    raw_features: Optional[RawFeatures] = None,
+) -> Dict[str, Any]:
+    """Modeli eğitir, değerlendirir ve `model_key` dizinine yeni versiyon olarak kaydeder."""
+    from .ml_models import ModelFactory
+    from .tuning import load_tuned_config
+
+    # Model oluştur (hiperparametre araması yapıldıysa seçilen konfigürasyonla)
+    config: ModelConfig = load_tuned_config(model_key) or ModelFactory.get_default_config()
+    model_type, selection = MODEL_TYPE, None
+    if model_type == "auto":
+        from .fast_models import select_model_type
+
+        report("selecting_model", 0.08)
+        selection = select_model_type(df, config)
+        model_type = selection["model_type"]
+    model: BaseForecaster = ModelFactory.create_model(model_type, config)
 
     # Eğitim
+    report("training", 0.1)
     try:
-        model.fit(df, target_col="power_mw")
+        model.fit(df, target_col="power_mw", raw_features=raw_features)
     except Exception as exc:
         logger.error(f"Eğitim hatası: {exc}")
         raise
 
-    # Performans değerlendirme (son 7 gün)
-    test_df = df.tail(config.horizon)
+    # Performans değerlendirme (her sahanın son 7 günü, öncesindeki girdi penceresinden)
+    report("evaluating", 0.85)
+    test_df = df.groupby("site_id", sort=False).tail(model.required_history() + config.horizon)
     metrics = model.evaluate(test_df, target_col="power_mw")
 
-    # Modeli kaydet
-    save_path = _get_model_path(site_id)
-    save_path.mkdir(parents=True, exist_ok=True)
-    model.save_model(str(save_path))
+    # Modeli geçici dizine kaydet ve yeni sürüm olarak yayınla (güncel işaretçi atomik olarak değişir)
+    report("saving", 0.95)
+    timestamps = pd.to_datetime(df["timestamp"])
+    metadata = {
+        "model_type": model_type,
+        "metrics": metrics,
+        "config": asdict(config),
+        "data": {
+            "start": timestamps.min().isoformat(),
+            "end": timestamps.max().isoformat(),
+            "rows": len(df),
+            "site_ids": sorted(int(site_id) for site_id in df["site_id"].unique()),
+        },
+    }
+    if selection is not None:
+        metadata["selection"] = selection
+    with model_registry.stage(model_key) as staging:
+        model.save_model(str(staging))
+        inference = _export_inference(model, staging, df)
+        version = model_registry.publish(model_key, staging, {**metadata, "inference": inference})
+    save_path = model_registry.version_path(model_key, version)
 
-    logger.info(f"Model eğitildi ve kaydedildi | path={save_path}")
-    return {"metrics": metrics, "model_path": str(save_path)}
+    logger.info(f"Model eğitildi ve kaydedildi | path={save_path} type={model_type} version={version}")
+    result = {"metrics": metrics, "model_type": model_type, "model_path": str(save_path), "version": version,
+              "inference": inference}
+    if selection is not None:
+        result["selection"] = selection
+    return result
 
 
-def load_model(site_id: int) -> EnsembleForecaster:
-    """Kaydedilmiş modeli yükler. Yoksa hata fırlatır."""
-    load_path = _get_model_path(site_id)
-    if not load_path.exists():
-        raise FileNotFoundError("Model henüz eğitilmemiş.")
+@observe_stage("ml_train", ML_DURATION, "operation")
+def train_model(
+    db: Session,
+    site_id: int,
+    progress: Optional[Callable[[str, float], None]] = None,
+) -> Dict[str, Any]:
+    """Belirtilen saha için modeli eğitir ve kaydeder (`progress` aşama bildirimleri alır)."""
+    report = progress or (lambda stage, fraction: None)
+
+    logger.info(f"ML eğitim başlıyor | site_id={site_id}")
+    report("loading_data", 0.05)
+    df, raw_features = _training_data(db, [site_id])
+    return _fit_and_save(df, site_id, report, raw_features)
+
+
+@observe_stage("ml_train_fleet", ML_DURATION, "operation")
+def train_fleet_model(
+    db: Session,
+    site_ids: Optional[List[int]] = None,
+    progress: Optional[Callable[[str, float], None]] = None,
+) -> Dict[str, Any]:
+    """Tüm sahaların uzun panelinden tek bir ortak (filo) model eğitir.
+
+    site_id NeuralForecast'te unique_id olur; eğitim ve tahmin maliyeti
+    saha sayısıyla değil model boyutuyla büyür.
+    """
+    report = progress or (lambda stage, fraction: None)
 
-    config = ModelFactory.get_default_config()
-    model: EnsembleForecaster = ModelFactory.create_model("ensemble", config)
-    model.load_model(str(load_path))
-    return model
+    logger.info("Filo modeli eğitimi başlıyor")
+    report("loading_data", 0.05)
+    df, raw_features = _training_data(db, site_ids)
+    result = _fit_and_save(df, FLEET_MODEL_KEY, report, raw_features)
+    result["site_count"] = int(df["site_id"].nunique())
+    return result
 
 
+@observe_stage("ml_load_model", ML_DURATION, "operation")
+def load_model(site_id: Union[int, str], version: Optional[str] = None) -> BaseForecaster:
+    """Kaydedilmiş modelin verilen (varsayılan güncel) sürümünü yükler. Yoksa hata fırlatır."""
+    from .ml_models import ModelFactory
+
+    load_path = model_registry.version_path(site_id, version)
+    return ModelFactory.load_model(str(load_path))
+
+
+@observe_stage("ml_predict", ML_DURATION, "operation")
 def predict_next_week(db: Session, site_id: int) -> pd.DataFrame:
     """Son 7 gün için tahmin verisi döndürür."""
-    # Veri çek
-    df = _get_site_data(db, site_id)
+    # Model yükle (önbellekten)
+    return _predict_site(db, site_id, model_cache.get(site_id))
+
 
-    # Model yükle
-    model = load_model(site_id)
+def _predict_site(db: Session, site_id: int, model: BaseForecaster, cache_window: bool = True) -> pd.DataFrame:
+    # Yalnızca modelin girdi penceresi + en uzun lag/rolling geçmişi okunur
+    rows = model.required_history()
+    if FEATURE_STATE_ENABLED and cache_window:
+        df = inference_windows.get(db, site_id, rows)
+    else:
+        df = _get_site_data(db, site_id, tail=rows)
 
     # Tahmin
     forecast_df = model.predict(df, target_col="power_mw")
     return forecast_df
+
+
+@observe_stage("ml_predict_fleet", ML_DURATION, "operation")
+def predict_fleet(db: Session, site_ids: Optional[List[int]] = None) -> pd.DataFrame:
+    """Filo modeliyle tüm (veya seçilen) sahaları tek bir batch çağrıda tahmin eder."""
+    return _predict_panel(db, site_ids, model_cache.get(FLEET_MODEL_KEY))
+
+
+def _predict_panel(db: Session, site_ids: Optional[List[int]], model: BaseForecaster) -> pd.DataFrame:
+    rows = model.required_history()
+    df = _get_panel_data(db, site_ids, tail=rows)
+    return model.predict_panel(df, target_col="power_mw")
+
+
+def _data_watermarks(db: Session, site_ids: Optional[List[int]] = None) -> Dict[int, datetime]:
+    """Saha başına son ForecastRecord zamanı (tahmin girdisinin watermark'ı)."""
+    stmt = select(ForecastRecord.site_id, func.max(ForecastRecord.timestamp)).group_by(ForecastRecord.site_id)
+    if site_ids is not None:
+        stmt = stmt.where(ForecastRecord.site_id.in_(site_ids))
+    return {site_id: watermark for site_id, watermark in db.exec(stmt).all()}
+
+
+def _prediction_model(site_id: int) -> Optional[Tuple[Union[int, str], str]]:
+    """Sahayı tahmin edecek model ve versiyonu: önce saha modeli, yoksa filo modeli."""
+    for key in (site_id, FLEET_MODEL_KEY):
+        try:
+            return key, get_model_version(key)
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def _compute_predictions(db: Session, site_id: int, model_key: Union[int, str]) -> Tuple[pd.DataFrame, str]:
+    """Sahanın tahminini verilen modelle anında hesaplar (timestamp, predicted_power_mw) ve kullanılan sürümü döndürür."""
+    model, version = model_cache.get_versioned(model_key)
+    if model_key == FLEET_MODEL_KEY:
+        return _predict_panel(db, [site_id], model).drop(columns="site_id").reset_index(drop=True), version
+    return _predict_site(db, site_id, model), version
+
+
+def _store_predictions(
+    db: Session,
+    site_id: int,
+    forecast_df: pd.DataFrame,
+    model_key: Union[int, str],
+    version: str,
+    watermark: datetime,
+) -> int:
+    """Sahanın kayıtlı tahminlerini yenileriyle değiştirir."""
+    created_at = datetime.utcnow()
+    records = [
+        {
+            "site_id": site_id,
+            "timestamp": timestamp,
+            "predicted_power_mw": value,
+            "model_key": str(model_key),
+            "model_version": version,
+            "data_watermark": watermark,
+            "created_at": created_at,
+        }
+        for timestamp, value in zip(
+            pd.DatetimeIndex(forecast_df["timestamp"]).to_pydatetime(),
+            forecast_df["predicted_power_mw"].astype(float).tolist(),
+        )
+    ]
+    db.execute(delete(PredictionRecord).where(PredictionRecord.site_id == site_id))
+    if records:
+        db.execute(insert(PredictionRecord), records)
+    db.commit()
+    return len(records)
+
+
+@observe_stage("ml_batch_predict", ML_DURATION, "operation")
+def run_batch_predictions(
+    db: Session,
+    site_ids: Optional[List[int]] = None,
+    progress: Optional[Callable[[str, float], None]] = None,
+) -> Dict[str, Any]:
+    """Tüm sahaların 7 günlük tahminlerini üretip PredictionRecord tablosuna yazar.
+
+    Kendi modeli olan sahalar tek tek, olmayanlar filo modeliyle tek bir
+    batch çağrıda tahmin edilir. Kayıtlar tahmini üreten model sürümü ve
+    veri watermark'ı ile etiketlenir; arada yeni bir sürüm yayınlanırsa
+    kayıt eski sayılır.
+    """
+    report = progress or (lambda stage, fraction: None)
+    watermarks = _data_watermarks(db, site_ids)
+
+    site_models: List[int] = []
+    fleet_sites: List[int] = []
+    skipped: List[int] = []
+    for site_id in sorted(watermarks):
+        resolved = _prediction_model(site_id)
+        if resolved is None:
+            skipped.append(site_id)
+        elif resolved[0] == FLEET_MODEL_KEY:
+            fleet_sites.append(site_id)
+        else:
+            site_models.append(site_id)
+
+    steps = max(len(site_models) + (1 if fleet_sites else 0), 1)
+    done = 0
+    written = 0
+    failed: Dict[int, str] = {}
+
+    for site_id in site_models:
+        try:
+            model, version = model_cache.get_versioned(site_id)
+            # Toplu iş uzun ömürlü eğitim worker'ında çalışır; pencere her gece DB'den taze okunur
+            forecast_df = _predict_site(db, site_id, model, cache_window=False)
+            written += _store_predictions(db, site_id, forecast_df, site_id, version, watermarks[site_id])
+        except Exception as exc:
+            db.rollback()
+            failed[site_id] = str(exc)
+            logger.error(f"Toplu tahmin hatası | site_id={site_id}: {exc}")
+        done += 1
+        report("predicting", done / steps)
+
+    if fleet_sites:
+        try:
+            model, fleet_version = model_cache.get_versioned(FLEET_MODEL_KEY)
+            forecast_df = _predict_panel(db, fleet_sites, model)
+            for site_id, group in forecast_df.groupby("site_id", sort=True):
+                written += _store_predictions(
+                    db, int(site_id), group, FLEET_MODEL_KEY, fleet_version, watermarks[int(site_id)]
+                )
+        except Exception as exc:
+            db.rollback()
+            failed.update({site_id: str(exc) for site_id in fleet_sites})
+            logger.error(f"Toplu filo tahmini hatası: {exc}")
+        report("predicting", 1.0)
+
+    logger.info(f"Toplu tahmin tamamlandı | sites={len(watermarks)} rows={written} failed={len(failed)}")
+    return {
+        "sites": len(site_models) + len(fleet_sites) - len(failed),
+        "rows": written,
+        "failed": failed,
+        "skipped": skipped,
+    }
+
+
+def get_stored_predictions(db: Session, site_id: int) -> Optional[Tuple[pd.DataFrame, str]]:
+    """Güncel kayıtlı tahminleri ve model versiyonunu döndürür; eski veya yoksa None.
+
+    Model versiyonu, veri watermark'ı değiştiyse ya da kayıt
+    PREDICTION_MAX_AGE_HOURS'tan eskiyse tahmin eski sayılır.
+    """
+    resolved = _prediction_model(site_id)
+    if resolved is None:
+        return None
+    model_key, version = resolved
+
+    rows = db.exec(
+        select(
+            PredictionRecord.timestamp,
+            PredictionRecord.predicted_power_mw,
+            PredictionRecord.model_key,
+            PredictionRecord.model_version,
+            PredictionRecord.data_watermark,
+            PredictionRecord.created_at,
+        ).where(PredictionRecord.site_id == site_id).order_by(PredictionRecord.timestamp)
+    ).all()
+    if not rows:
+        return None
+
+    first = rows[0]
+    age_hours = (datetime.utcnow() - first.created_at).total_seconds() / 3600
+    if (
+        first.model_key != str(model_key)
+        or first.model_version != version
+        or first.data_watermark != _data_watermarks(db, [site_id]).get(site_id)
+        or age_hours > PREDICTION_MAX_AGE_HOURS
+    ):
+        return None
+
+    forecast_df = pd.DataFrame({
+        "timestamp": pd.to_datetime([row.timestamp for row in rows]),
+        "predicted_power_mw": np.array([row.predicted_power_mw for row in rows], dtype=np.float64),
+    })
+    return forecast_df, version
+
+
+def serve_predictions(db: Session, site_id: int) -> Tuple[pd.DataFrame, str, bool]:
+    """Sahanın tahminlerini döndürür: kayıtlı tahmin güncelse o, değilse anında hesaplanıp kaydedilir.
+
+    Dönen üçlü: (tahminler, model versiyonu, kayıttan mı okundu).
+    """
+    stored = get_stored_predictions(db, site_id)
+    if stored is not None:
+        return stored[0], stored[1], True
+
+    resolved = _prediction_model(site_id)
+    if resolved is None:
+        raise FileNotFoundError("Model henüz eğitilmemiş.")
+    model_key = resolved[0]
+
+    watermark = _data_watermarks(db, [site_id]).get(site_id)
+    forecast_df, version = _compute_predictions(db, site_id, model_key)
+    if watermark is not None:
+        _store_predictions(db, site_id, forecast_df, model_key, version, watermark)
+    return forecast_df, version, False
+
+
+# Global model önbelleği ve tahmin penceresi durumu
+model_cache = ModelCache()
+inference_windows = InferenceWindowCache()
+
+registry.gauge_callback(
+    "greenfleet_ml_model_cache",
+    "Yüklü model önbelleği durumu",
+    lambda: {("entries",): model_cache.stats()["entries"], ("bytes",): model_cache.stats()["bytes"]},
+    ("field",),
+)
@@ -0,0 +1,194 @@
+"""
+Model kayıt defteri – her eğitimi değişmez bir sürüm dizinine yazar, güncel sürümü atomik bir işaretçiyle seçer
+"""
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from loguru import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: süreçler arası kilit yok
+    fcntl = None
+
+# Kayıt ayarları (dizin ml_service.MODEL_DIR ile aynıdır)
+MODEL_REGISTRY_DIR = Path(os.getenv("ML_MODEL_DIR", "./models"))
+# Anahtar başına saklanan sürüm sayısı (güncel sürüm her zaman korunur; 0 = hepsi)
+MODEL_REGISTRY_KEEP = int(os.getenv("ML_MODEL_REGISTRY_KEEP", "5"))
+
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+INDEX_FILE = "index.json"
+METADATA_FILE = "metadata.json"
+# Kayıt defteri öncesi düz dizin düzeni (dosyalar doğrudan anahtar dizininde)
+LEGACY_VERSION_FILE = "VERSION"
+LEGACY_MODEL_FILE = "ensemble_model.pkl"
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    tmp_path.write_text(text, encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+class ModelRegistry:
+    """Model anahtarı (saha id'si veya "fleet") başına sürümlü model dizinleri.
+
+    Düzen: `<anahtar>/versions/<sürüm>/` değişmez model dosyaları ve
+    metadata.json, `<anahtar>/index.json` sürüm listesi, `<anahtar>/CURRENT`
+    güncel sürüm. Eğitim geçici bir dizine yazar ve tek bir rename ile
+    yayınlar; okuyucular yarım yazılmış dosya görmez. İşaretçi os.replace
+    ile değiştirildiğinden yükseltme ve geri alma atomiktir.
+    """
+
+    def __init__(self, root: Path = MODEL_REGISTRY_DIR, keep: int = MODEL_REGISTRY_KEEP):
+        self.root = root
+        self.keep = keep
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def key_path(self, model_key: Union[int, str]) -> Path:
+        """Anahtarın kök dizini (ayarlanmış konfigürasyon gibi sürümsüz dosyalar da burada)."""
+        if isinstance(model_key, str):
+            return self.root / model_key
+        return self.root / f"site_{model_key}"
+
+    @contextmanager
+    def _key_lock(self, model_key: Union[int, str]) -> Iterator[None]:
+        """İndeks ve işaretçi yazımları için thread'ler ve süreçler arasında tek yazar."""
+        path = self.key_path(model_key)
+        with self._locks_guard:
+            lock = self._locks.setdefault(path.name, threading.Lock())
+        with lock:
+            path.mkdir(parents=True, exist_ok=True)
+            with open(path / ".lock", "w") as handle:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def current_version(self, model_key: Union[int, str]) -> str:
+        """Güncel sürüm; eski düz düzende VERSION dosyası veya pickle mtime'ı."""
+        path = self.key_path(model_key)
+        try:
+            return (path / CURRENT_FILE).read_text(encoding="utf-8").strip()
+        except FileNotFoundError:
+            pass
+        try:
+            return (path / LEGACY_VERSION_FILE).read_text(encoding="utf-8").strip()
+        except FileNotFoundError:
+            pass
+        try:
+            return f"mtime-{(path / LEGACY_MODEL_FILE).stat().st_mtime_ns}"
+        except FileNotFoundError:
+            raise FileNotFoundError("Model henüz eğitilmemiş.")
+
+    def version_path(self, model_key: Union[int, str], version: Optional[str] = None) -> Path:
+        """Sürümün dizini (varsayılan güncel sürüm); eski düzende anahtar dizininin kendisi."""
+        version = version or self.current_version(model_key)
+        path = self.key_path(model_key) / VERSIONS_DIR / version
+        if path.is_dir():
+            return path
+        legacy = self.key_path(model_key)
+        if not (legacy / CURRENT_FILE).exists() and version == self.current_version(model_key):
+            return legacy
+        raise FileNotFoundError(f"Model sürümü bulunamadı: {version}")
+
+    @contextmanager
+    def stage(self, model_key: Union[int, str]) -> Iterator[Path]:
+        """Yeni sürüm için geçici dizin; yayınlanmadan çıkılırsa silinir."""
+        versions = self.key_path(model_key) / VERSIONS_DIR
+        versions.mkdir(parents=True, exist_ok=True)
+        staging = versions / f".staging-{uuid.uuid4().hex}"
+        staging.mkdir()
+        try:
+            yield staging
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def publish(self, model_key: Union[int, str], staging: Path, metadata: Dict[str, Any]) -> str:
+        """Geçici dizini yeni sürüm olarak yayınlar, indekse ekler ve güncel yapar."""
+        version = str(time.time_ns())
+        entry = {"version": version, "created_at": time.time(), **metadata}
+        (staging / METADATA_FILE).write_text(json.dumps(entry, default=str), encoding="utf-8")
+
+        with self._key_lock(model_key):
+            os.rename(staging, self.key_path(model_key) / VERSIONS_DIR / version)
+            index = self._read_index(model_key)
+            index.append(entry)
+            self._write_index(model_key, index)
+            _write_atomic(self.key_path(model_key) / CURRENT_FILE, version)
+            self._prune(model_key, index)
+
+        logger.info(f"Model sürümü yayınlandı | key={model_key} version={version}")
+        return version
+
+    def activate(self, model_key: Union[int, str], version: str) -> str:
+        """Güncel işaretçiyi kayıtlı bir sürüme çevirir (yükseltme veya geri alma)."""
+        with self._key_lock(model_key):
+            if not (self.key_path(model_key) / VERSIONS_DIR / version / METADATA_FILE).exists():
+                raise FileNotFoundError(f"Model sürümü bulunamadı: {version}")
+            _write_atomic(self.key_path(model_key) / CURRENT_FILE, version)
+        logger.info(f"Güncel model sürümü değişti | key={model_key} version={version}")
+        return version
+
+    def rollback(self, model_key: Union[int, str]) -> str:
+        """Güncel sürümden önce yayınlanmış en yeni sürüme döner."""
+        current = self.current_version(model_key)
+        previous = [entry["version"] for entry in self.list_versions(model_key) if int(entry["version"]) < int(current)] \
+            if current.isdigit() else []
+        if not previous:
+            raise ValueError("Geri alınabilecek önceki bir model sürümü yok")
+        return self.activate(model_key, previous[0])
+
+    def list_versions(self, model_key: Union[int, str]) -> List[Dict[str, Any]]:
+        """Kayıtlı sürümler (yeniden eskiye), `current` işaretiyle."""
+        try:
+            current = self.current_version(model_key)
+        except FileNotFoundError:
+            current = None
+        entries = sorted(self._read_index(model_key), key=lambda entry: int(entry["version"]), reverse=True)
+        return [{**entry, "current": entry["version"] == current} for entry in entries]
+
+    def _read_index(self, model_key: Union[int, str]) -> List[Dict[str, Any]]:
+        path = self.key_path(model_key) / INDEX_FILE
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return []
+        except ValueError as exc:
+            # İndeks sürüm dizinlerindeki metadata dosyalarından yeniden kurulur
+            logger.warning(f"Model indeksi okunamadı, yeniden oluşturuluyor ({path}): {exc}")
+            versions = self.key_path(model_key) / VERSIONS_DIR
+            return [json.loads(meta.read_text(encoding="utf-8")) for meta in sorted(versions.glob(f"*/{METADATA_FILE}"))]
+
+    def _write_index(self, model_key: Union[int, str], index: List[Dict[str, Any]]) -> None:
+        _write_atomic(self.key_path(model_key) / INDEX_FILE, json.dumps(index, default=str))
+
+    def _prune(self, model_key: Union[int, str], index: List[Dict[str, Any]]) -> None:
+        """En yeni `keep` sürüm ve güncel sürüm dışındakileri siler (kilit altında çağrılır)."""
+        if self.keep <= 0 or len(index) <= self.keep:
+            return
+        current = (self.key_path(model_key) / CURRENT_FILE).read_text(encoding="utf-8").strip()
+        ordered = sorted(index, key=lambda entry: int(entry["version"]), reverse=True)
+        kept = [entry for i, entry in enumerate(ordered) if i < self.keep or entry["version"] == current]
+        for entry in ordered:
+            if entry not in kept:
+                shutil.rmtree(self.key_path(model_key) / VERSIONS_DIR / entry["version"], ignore_errors=True)
+        self._write_index(model_key, sorted(kept, key=lambda entry: int(entry["version"])))
+
+
+# Global model kayıt defteri
+model_registry = ModelRegistry()
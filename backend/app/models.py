@@ -71,6 +71,24 @@ class ForecastRecord(SQLModel, table=True):
     site: Site = Relationship(back_populates="forecasts")
 
 
+class PredictionRecord(SQLModel, table=True):
+    """Toplu ML tahmin kayıtlarını temsil eden model."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    site_id: int = Field(foreign_key="site.id", index=True)
+    timestamp: datetime
+    predicted_power_mw: float
+    model_key: str  # Tahmini üreten model: saha id'si veya "fleet"
+    model_version: str  # Model dizinindeki VERSION değeri
+    data_watermark: datetime  # Tahmin girdisindeki son ForecastRecord zamanı
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class SiteDataVersion(SQLModel, table=True):
+    """Sahanın tahmin verisi sürümü; ForecastRecord yazımları aynı transaction'da artırır."""
+    site_id: int = Field(foreign_key="site.id", primary_key=True)
+    version: int = 0
+
+
 class BatteryConfig(SQLModel, table=True):
     """Batarya konfigürasyonunu temsil eden model."""
     id: Optional[int] = Field(default=None, primary_key=True)
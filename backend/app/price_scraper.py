@@ -13,6 +13,9 @@ import re
 import time
 import os
 
+from .events import event_hub
+from .metrics import observe_outbound, SCRAPER_RUNS, STAGE_DURATION
+
 # Logging ayarları
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -81,6 +84,17 @@ class ElectricityPriceScraper:
             with open(self.prices_file, 'w', encoding='utf-8') as f:
                 json.dump(prices, f, indent=2, ensure_ascii=False)
             logger.info("Fiyatlar başarıyla kaydedildi")
+            
+            # Abonelere yeni fiyatları bildir
+            event_hub.publish("prices", {
+                "last_updated": prices.get("last_updated"),
+                "is_fallback_data": prices.get("updated_with_fallback", False),
+                "base_prices": {
+                    country: values["base_price"]
+                    for country, values in prices.items()
+                    if isinstance(values, dict) and "base_price" in values
+                },
+            })
             return True
         except Exception as e:
             logger.error(f"Fiyat kaydetme hatası: {e}")
@@ -92,8 +106,9 @@ class ElectricityPriceScraper:
             # Encazip.com elektrik fiyatları sayfası
             url = "https://www.encazip.com/elektrik-fiyatlari"
             
-            response = self.session.get(url, timeout=30)
-            response.raise_for_status()
+            with observe_outbound("encazip"):
+                response = self.session.get(url, timeout=30)
+                response.raise_for_status()
             
             soup = BeautifulSoup(response.content, 'html.parser')
             
@@ -163,8 +178,9 @@ class ElectricityPriceScraper:
             # OPCOM - Romanya Elektrik Piyasası
             url = "https://www.opcom.ro/pp/rapoarte/rapoarte_piata_pentru_ziua_urmatoare.php"
             
-            response = self.session.get(url, timeout=30)
-            response.raise_for_status()
+            with observe_outbound("opcom"):
+                response = self.session.get(url, timeout=30)
+                response.raise_for_status()
             
             soup = BeautifulSoup(response.content, 'html.parser')
             
@@ -261,10 +277,12 @@ scraper = ElectricityPriceScraper()
 
 def update_electricity_prices():
     """Elektrik fiyatlarını güncelleme fonksiyonu"""
-    success = scraper.update_prices()
-    if not success:
-        logger.info("Web scraping başarısız, yedek fiyatlar deneniyor...")
-        scraper.update_with_fallback()
+    with STAGE_DURATION.time(stage="price_scrape"):
+        success = scraper.update_prices()
+        if not success:
+            logger.info("Web scraping başarısız, yedek fiyatlar deneniyor...")
+            scraper.update_with_fallback()
+    SCRAPER_RUNS.inc(result="success" if success else "fallback")
     return success
 
 if __name__ == "__main__":
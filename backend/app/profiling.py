@@ -0,0 +1,298 @@
+"""
+Örneklemeli profiler – yavaş istekler ve arka plan döngüleri için speedscope profilleri üretir
+"""
+from __future__ import annotations
+
+import asyncio
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+# Profil ayarları (hepsi opsiyonel; admin anahtarı yoksa istek üzerinden tetikleme kapalıdır)
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "./profiles"))
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "")
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.05"))
+PROFILE_INTERVAL_MS = max(float(os.getenv("PROFILE_INTERVAL_MS", "5")), 1.0)
+PROFILE_MAX_PER_HOUR = int(os.getenv("PROFILE_MAX_PER_HOUR", "12"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+
+PROFILE_HEADER = "x-profile"
+PROFILE_QUERY_PARAM = "profile"
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+# Uzun ömürlü veya yönetim amaçlı yollar profillenmez
+_EXCLUDED_PREFIXES = ("/api/stream", "/api/admin/profiles", "/metrics", "/docs", "/openapi.json")
+_NAME_PATTERN = re.compile(r"^[\w.-]+\.speedscope\.json$")
+
+FrameKey = Tuple[str, str, int]
+
+
+class StackSampler:
+    """Hedef thread'in çağrı yığınını sabit aralıklarla örnekleyen sampler.
+
+    Örnekler `sys._current_frames()` ile ayrı bir thread'den alınır; hedef
+    thread durdurulmaz. Async endpoint'ler event loop thread'inde çalıştığı
+    için aynı anda işlenen diğer isteklerin yığınları da profile girebilir.
+    """
+
+    def __init__(self, thread_id: Optional[int] = None, interval: float = PROFILE_INTERVAL_MS / 1000):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.frames: Dict[FrameKey, int] = {}
+        self.stacks: Dict[Tuple[int, ...], float] = {}
+        self.sample_count = 0
+        self.started_at = 0.0
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "StackSampler":
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> "StackSampler":
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started_at
+        return self
+
+    def _frame_index(self, frame) -> int:
+        code = frame.f_code
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        index = self.frames.get(key)
+        if index is None:
+            index = self.frames[key] = len(self.frames)
+        return index
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None or self.thread_id == me:
+                break
+
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_index(frame))
+                frame = frame.f_back
+            stack.reverse()
+
+            # Ağırlık gerçek geçen süredir; GIL gecikmeleri örnek kaybı olarak görünmez
+            key = tuple(stack)
+            self.stacks[key] = self.stacks.get(key, 0.0) + (now - last)
+            self.sample_count += 1
+            last = now
+
+    def to_speedscope(self, name: str) -> Dict[str, Any]:
+        """Örnekleri speedscope "sampled" profil formatına çevirir."""
+        frames = [{"name": fn, "file": file, "line": line} for fn, file, line in self.frames]
+        samples = [list(stack) for stack in self.stacks]
+        weights = [round(weight, 6) for weight in self.stacks.values()]
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": name,
+            "exporter": "greenfleet-profiler",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": round(sum(weights), 6),
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+
+class ProfileStore:
+    """Profil dosyalarını diske yazar, saatlik sınırı ve saklama sayısını uygular."""
+
+    def __init__(self, directory: Path = PROFILE_DIR, max_per_hour: int = PROFILE_MAX_PER_HOUR, keep: int = PROFILE_KEEP):
+        self.directory = directory
+        self.max_per_hour = max_per_hour
+        self.keep = keep
+        self._saved_at: Deque[float] = deque()
+        self._active = threading.Lock()
+        self._lock = threading.Lock()
+        self.skipped = 0
+
+    def try_acquire(self) -> bool:
+        """Aynı anda tek profil ve saatlik sınır; izin yoksa False döner."""
+        with self._lock:
+            now = time.monotonic()
+            while self._saved_at and now - self._saved_at[0] > 3600:
+                self._saved_at.popleft()
+            if len(self._saved_at) >= self.max_per_hour:
+                self.skipped += 1
+                return False
+        if not self._active.acquire(blocking=False):
+            self.skipped += 1
+            return False
+        return True
+
+    def release(self) -> None:
+        self._active.release()
+
+    @staticmethod
+    def new_name(label: str) -> str:
+        """Zaman damgalı, dosya sistemine uygun profil adı üretir."""
+        safe = re.sub(r"[^\w.-]+", "_", label).strip("_") or "profile"
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+        return f"{stamp}-{safe[:60]}.speedscope.json"
+
+    def save(self, name: str, sampler: StackSampler, meta: Dict[str, Any]) -> Path:
+        """Profili speedscope JSON olarak yazar ve eski dosyaları temizler."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        document = sampler.to_speedscope(meta.get("label", name))
+        document["greenfleet"] = {
+            **meta,
+            "duration_ms": round(sampler.duration * 1000, 2),
+            "samples": sampler.sample_count,
+            "interval_ms": sampler.interval * 1000,
+        }
+
+        path = self.directory / name
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(document), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._saved_at.append(time.monotonic())
+        self._prune()
+        return path
+
+    def _prune(self) -> None:
+        files = sorted(self.directory.glob("*.speedscope.json"))
+        for old in files[:-self.keep] if self.keep > 0 else []:
+            old.unlink(missing_ok=True)
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Kayıtlı profilleri yeniden eskiye listeler."""
+        if not self.directory.exists():
+            return []
+
+        result = []
+        for path in sorted(self.directory.glob("*.speedscope.json"), reverse=True):
+            try:
+                meta = json.loads(path.read_text(encoding="utf-8")).get("greenfleet", {})
+            except (OSError, ValueError):
+                continue
+            result.append({"name": path.name, "size_bytes": path.stat().st_size, **meta})
+        return result
+
+    def path_for(self, name: str) -> Optional[Path]:
+        """Profil adını güvenli şekilde dosya yoluna çevirir (yoksa None)."""
+        if not _NAME_PATTERN.match(name):
+            return None
+        path = self.directory / name
+        return path if path.is_file() else None
+
+
+# Global profil deposu
+profile_store = ProfileStore()
+
+
+def admin_token_valid(token: Optional[str]) -> bool:
+    """Verilen anahtarın profil admin anahtarıyla eşleşip eşleşmediğini döndürür."""
+    if not PROFILE_ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), PROFILE_ADMIN_TOKEN.encode("utf-8"))
+
+
+@asynccontextmanager
+async def capture(label: str, trigger: str = "manual", force: bool = True) -> AsyncIterator[Optional[str]]:
+    """Bloğu event loop thread'inde örnekleyip profil kaydeder.
+
+    Sınır aşıldıysa veya başka bir profil sürüyorsa blok profilsiz çalışır
+    ve None verilir.
+    """
+    if not profile_store.try_acquire():
+        yield None
+        return
+
+    name = profile_store.new_name(label)
+    sampler = StackSampler().start()
+    try:
+        yield name
+    finally:
+        sampler.stop()
+        try:
+            if force or sampler.duration * 1000 >= PROFILE_SLOW_MS:
+                meta = {"label": label, "trigger": trigger, "created_at": datetime.utcnow().isoformat()}
+                await asyncio.to_thread(profile_store.save, name, sampler, meta)
+                logger.info(f"Profil kaydedildi: {name} ({sampler.duration * 1000:.0f} ms)")
+        finally:
+            profile_store.release()
+
+
+class ProfilingMiddleware:
+    """Admin başlığı/sorgu parametresi veya gecikme eşiğiyle istekleri profilleyen ASGI middleware.
+
+    `X-Profile: <PROFILE_ADMIN_TOKEN>` başlığı ya da `?profile=<anahtar>` ile
+    istek her zaman profillenir. `PROFILE_SLOW_MS` tanımlıysa isteklerin
+    `PROFILE_SAMPLE_RATE` kadarı örneklenir ve yalnızca eşiği aşanlar saklanır.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def _requested(scope) -> bool:
+        if not PROFILE_ADMIN_TOKEN:
+            return False
+        for key, value in scope.get("headers", []):
+            if key == PROFILE_HEADER.encode("latin-1"):
+                return admin_token_valid(value.decode("latin-1"))
+
+        query = scope.get("query_string", b"").decode("latin-1")
+        for part in query.split("&"):
+            key, _, value = part.partition("=")
+            if key == PROFILE_QUERY_PARAM:
+                return admin_token_valid(value)
+        return False
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if scope["type"] != "http" or path.startswith(_EXCLUDED_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        forced = self._requested(scope)
+        sampled = PROFILE_SLOW_MS > 0 and random.random() < PROFILE_SAMPLE_RATE
+        if not forced and not sampled:
+            await self.app(scope, receive, send)
+            return
+
+        label = f"{scope.get('method', '')} {path}"
+        async with capture(label, trigger="request" if forced else "slow", force=forced) as name:
+            if name is None or not forced:
+                await self.app(scope, receive, send)
+                return
+
+            async def send_wrapper(message):
+                # Zorla tetiklenen profillerin adı yanıt başlığında döner
+                if message["type"] == "http.response.start":
+                    message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", name.encode("latin-1"))]}
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
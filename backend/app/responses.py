@@ -0,0 +1,187 @@
+"""
+Yanıt formatları – hızlı JSON (orjson), Apache Arrow IPC stream ve Parquet içerik anlaşması
+"""
+from __future__ import annotations
+
+import datetime as dt
+import json
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+from loguru import logger
+
+# orjson opsiyonel bağımlılık: yoksa standart json modülüne düşülür
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    logger.warning("orjson kütüphanesi yüklenmedi. Standart json serileştirici kullanılacak.")
+
+# PyArrow opsiyonel bağımlılık: yoksa yalnızca JSON sunulur
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+    logger.warning("PyArrow kütüphanesi yüklenmedi. Arrow/Parquet yanıtları devre dışı.")
+
+JSON_MEDIA_TYPE = "application/json"
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+MEDIA_TYPES = {
+    "json": JSON_MEDIA_TYPE,
+    "arrow": ARROW_STREAM_MEDIA_TYPE,
+    "parquet": PARQUET_MEDIA_TYPE,
+}
+
+# Accept başlığında tanınan alternatif isimler
+_ACCEPT_ALIASES = {
+    ARROW_STREAM_MEDIA_TYPE: "arrow",
+    "application/x-arrow": "arrow",
+    PARQUET_MEDIA_TYPE: "parquet",
+    "application/x-parquet": "parquet",
+    "application/parquet": "parquet",
+}
+
+# Arrow şema metadata anahtarı (saha bilgisi vb.)
+METADATA_KEY = b"greenfleet"
+
+
+def negotiate_format(request: Request, format: Optional[str] = None) -> str:
+    """`format` sorgu parametresi veya Accept başlığından yanıt formatını seçer."""
+    fmt = format
+    if fmt is None:
+        fmt = "json"
+        accept = request.headers.get("accept", "")
+        for part in accept.split(","):
+            media_type = part.split(";")[0].strip().lower()
+            if media_type in _ACCEPT_ALIASES:
+                fmt = _ACCEPT_ALIASES[media_type]
+                break
+
+    if fmt not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Desteklenmeyen format: {fmt}")
+    if fmt != "json" and pa is None:
+        raise HTTPException(status_code=406, detail="Arrow/Parquet desteği için pyarrow gerekli")
+    return fmt
+
+
+def _json_default(value: Any) -> Any:
+    """orjson/json'ın doğrudan tanımadığı tipler (pd.Timestamp, NumPy skalerleri vb.)."""
+    if isinstance(value, (dt.datetime, dt.date)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"JSON'a serileştirilemeyen tip: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """İçeriği JSON baytlarına serileştirir (NumPy dizileri toplu olarak yazılır)."""
+    if orjson is not None:
+        return orjson.dumps(
+            content,
+            default=_json_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+        )
+    return json.dumps(
+        content,
+        default=_json_default,
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """orjson tabanlı JSON yanıtı; içerik response_model ile yeniden doğrulanmaz."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def iso_timestamps(values: pd.Series, suffix: Optional[str] = None) -> List[str]:
+    """datetime64 sütununu toplu olarak ISO 8601 metinlerine çevirir.
+
+    Çıktı `datetime.isoformat()` ile aynıdır: mikro saniye yalnızca sıfır
+    değilse yazılır, tz bilgili sütunlar UTC'ye çevrilip "+00:00" alır.
+    `suffix` verilirse (ör. "Z") zaman dilimi eki olarak o kullanılır.
+    """
+    series = pd.to_datetime(values)
+    if series.dt.tz is not None:
+        series = series.dt.tz_convert("UTC").dt.tz_localize(None)
+        if suffix is None:
+            suffix = "+00:00"
+
+    arr = series.to_numpy(dtype="datetime64[us]")
+    text = np.datetime_as_string(arr, unit="s")
+    has_fraction = (arr - arr.astype("datetime64[s]")) != np.timedelta64(0, "us")
+    if has_fraction.any():
+        text = np.where(has_fraction, np.datetime_as_string(arr, unit="us"), text)
+
+    # NaT değerleri null olarak kalsın
+    result = text.astype(object)
+    result[np.isnat(arr)] = None
+    if suffix:
+        mask = result != None  # noqa: E711
+        result[mask] = result[mask] + suffix
+    return result.tolist()
+
+
+def _column_values(series: pd.Series) -> List[Any]:
+    """Tek bir sütunu NaN -> None dönüşümüyle Python listesine çevirir."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return iso_timestamps(series)
+    if pd.api.types.is_float_dtype(series):
+        arr = series.to_numpy(dtype=np.float64, na_value=np.nan)
+        values = arr.tolist()
+        missing = np.flatnonzero(np.isnan(arr))
+        for idx in missing:
+            values[idx] = None
+        return values
+    if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+        return series.tolist()
+    return series.astype(object).where(series.notna(), None).tolist()
+
+
+def frame_to_records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    """DataFrame'i JSON'a hazır kayıt listesine çevirir (ISO zaman damgası, NaN -> None).
+
+    Dönüşümler satır satır değil sütun bazında yapılır; kayıtlar en sonda
+    tek bir zip ile kurulur.
+    """
+    names = [str(col) for col in df.columns]
+    columns = [_column_values(df[col]) for col in df.columns]
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def frame_to_arrow(df: pd.DataFrame, metadata: Optional[Dict[str, Any]] = None) -> "pa.Table":
+    """DataFrame sütunlarından doğrudan Arrow tablosu oluşturur."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if metadata:
+        schema_metadata = dict(table.schema.metadata or {})
+        schema_metadata[METADATA_KEY] = json.dumps(metadata, default=str).encode("utf-8")
+        table = table.replace_schema_metadata(schema_metadata)
+    return table
+
+
+def encode_frame(df: pd.DataFrame, fmt: str, metadata: Optional[Dict[str, Any]] = None) -> bytes:
+    """DataFrame'i Arrow IPC stream veya Parquet baytlarına serileştirir."""
+    table = frame_to_arrow(df, metadata)
+    sink = pa.BufferOutputStream()
+
+    if fmt == "arrow":
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    elif fmt == "parquet":
+        pq.write_table(table, sink, compression="zstd")
+    else:
+        raise ValueError(f"Desteklenmeyen ikili format: {fmt}")
+
+    return sink.getvalue().to_pybytes()
@@ -1,8 +1,9 @@
 """
 Zamanlanmış görevler için scheduler
-Elektrik fiyatlarını düzenli olarak günceller
+Elektrik fiyatlarını düzenli olarak günceller, her gece toplu ML tahminlerini başlatır
 """
 
+import os
 import schedule
 import time
 import threading
@@ -73,5 +74,60 @@ class PriceUpdateScheduler:
         logger.info("Manuel fiyat güncellemesi tetiklendi")
         return self._update_prices_job()
 
+# Gece toplu tahmin saati (HH:MM, sunucu saati); boş bırakılırsa kapalı
+BATCH_PREDICT_AT = os.getenv("ML_BATCH_PREDICT_AT", "02:00")
+
+
+class BatchPredictionScheduler:
+    """Toplu ML tahmin işini her gece eğitim süreç havuzuna gönderir.
+
+    Fiyat scheduler'ı global `schedule` kuyruğunu temizlediği için ayrı bir
+    `schedule.Scheduler` kullanılır.
+    """
+
+    def __init__(self, at: str = BATCH_PREDICT_AT):
+        self.at = at
+        self.running = False
+        self.thread = None
+        self.scheduler = schedule.Scheduler()
+
+    def start(self):
+        """Scheduler'ı başlat"""
+        if self.running or not self.at:
+            return
+
+        self.running = True
+        self.scheduler.every().day.at(self.at).do(self._batch_predict_job)
+
+        self.thread = threading.Thread(target=self._run_scheduler, daemon=True)
+        self.thread.start()
+        logger.info(f"Toplu tahmin scheduler'ı başlatıldı (her gün {self.at})")
+
+    def stop(self):
+        """Scheduler'ı durdur"""
+        self.running = False
+        self.scheduler.clear()
+
+    def _batch_predict_job(self):
+        """Toplu tahmin işini kuyruğa alır (aynı anda tek iş)"""
+        from .training import training_jobs
+
+        try:
+            job, created = training_jobs.submit(None, kind="predict")
+            logger.info(f"Zamanlanmış toplu tahmin işi: {job.id} ({'yeni' if created else 'zaten sürüyor'})")
+        except Exception as e:
+            logger.error(f"Zamanlanmış toplu tahmin hatası: {e}")
+
+    def _run_scheduler(self):
+        """Scheduler'ı sürekli çalıştır"""
+        while self.running:
+            try:
+                self.scheduler.run_pending()
+            except Exception as e:
+                logger.error(f"Toplu tahmin scheduler hatası: {e}")
+            time.sleep(60)
+
+
 # Global scheduler instance
 price_scheduler = PriceUpdateScheduler()
+batch_prediction_scheduler = BatchPredictionScheduler()
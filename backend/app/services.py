@@ -8,6 +8,8 @@ import pandas as pd
 import numpy as np
 from fastapi import HTTPException
 
+from .metrics import observe_stage, observe_outbound
+
 # Sabit değerler
 PRICES_PATH = "./prices.json"
 GRID_FACTORS_PATH = "./grid_factors.json"
@@ -26,6 +28,7 @@ TEXTS = {
     }
 }
 
+@observe_stage("fetch_forecast")
 async def fetch_forecast(latitude: float, longitude: float) -> pd.DataFrame:
     """Open-Meteo API'sinden 7 günlük tahmin verilerini çeker."""
     url = "https://api.open-meteo.com/v1/forecast"
@@ -40,8 +43,9 @@ async def fetch_forecast(latitude: float, longitude: float) -> pd.DataFrame:
     
     try:
         async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=params)
-            response.raise_for_status()
+            with observe_outbound("open-meteo"):
+                response = await client.get(url, params=params)
+                response.raise_for_status()
             data = response.json()
             
             # Saatlik verileri DataFrame'e dönüştür
@@ -67,6 +71,7 @@ async def fetch_forecast(latitude: float, longitude: float) -> pd.DataFrame:
         )
 
 
+@observe_stage("calc_power")
 def calc_power(df: pd.DataFrame, capacity_mw: float, site_type: str) -> pd.DataFrame:
     """Rüzgar veya güneş için güç üretimini hesaplar."""
     df_result = df.copy()
@@ -114,6 +119,7 @@ def calc_power(df: pd.DataFrame, capacity_mw: float, site_type: str) -> pd.DataF
     return df_result
 
 
+@observe_stage("calc_revenue")
 def calc_revenue(df: pd.DataFrame, country: str) -> pd.DataFrame:
     """Güç üretimi ve dinamik fiyatlara göre geliri hesaplar."""
     df_result = df.copy()
@@ -164,6 +170,7 @@ def calc_revenue(df: pd.DataFrame, country: str) -> pd.DataFrame:
         )
 
 
+@observe_stage("calc_co2")
 def calc_co2(df: pd.DataFrame, country: str) -> pd.DataFrame:
     """Güç üretimine göre CO₂ tasarrufunu hesaplar."""
     df_result = df.copy()
@@ -191,6 +198,7 @@ def calc_co2(df: pd.DataFrame, country: str) -> pd.DataFrame:
         )
 
 
+@observe_stage("battery_dispatch")
 def battery_dispatch(
     df: pd.DataFrame, 
     capacity_mwh: float = 4.0, 
@@ -257,3 +265,80 @@ def battery_dispatch(
     df_result["co2_saved_kg"] = df_result["power_mw"] * 1000 * grid_factor
     
     return df_result
+
+
+# Saatlik değerleri toplanabilen sütunlar (enerji, gelir, CO₂); rüzgar hızı, GHI,
+# fiyat ve şarj durumu gibi yoğun büyüklükler toplanmaz
+ADDITIVE_COLUMNS = ("power_mw", "revenue_eur", "co2_saved_kg", "battery_power_mw")
+
+
+def column_aggregation(column: str, agg: str) -> str:
+    """Sütuna uygulanacak toplama: `sum` yalnızca toplanabilen sütunlara, diğerlerine ortalama."""
+    if agg == "sum" and column not in ADDITIVE_COLUMNS:
+        return "mean"
+    return agg
+
+
+def aggregate_forecast(df: pd.DataFrame, bucket_seconds: int, agg: str = "mean") -> pd.DataFrame:
+    """Hesaplanmış (DB'de olmayan) tahminleri zaman penceresine göre toplar.
+
+    Pencereler SQL tarafındaki gibi epoch'a hizalanır, böylece saklı ve
+    anlık hesaplanan tahminler aynı pencere sınırlarını kullanır.
+    """
+    numeric_cols = [
+        col for col in df.columns
+        if col != "timestamp" and pd.api.types.is_numeric_dtype(df[col])
+    ]
+    df_result = (
+        df.set_index("timestamp")[numeric_cols]
+        .resample(f"{bucket_seconds}s", origin="epoch")
+        .agg({col: column_aggregation(col, agg) for col in numeric_cols})
+        .dropna(how="all")
+        .reset_index()
+    )
+    return df_result
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets ile görsel olarak korunacak nokta indekslerini seçer."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    
+    # İlk ve son nokta her zaman korunur, aradaki noktalar n_out-2 kovaya bölünür
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        
+        # Sonraki kovanın ortalaması (son kova için son nokta)
+        next_start, next_end = end, (edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        
+        # Önceki seçili nokta, aday ve sonraki ortalamanın oluşturduğu üçgen alanı
+        areas = np.abs(
+            (x[prev] - avg_x) * (y[start:end] - y[prev])
+            - (x[prev] - x[start:end]) * (avg_y - y[prev])
+        )
+        prev = start + int(np.nanargmax(areas)) if np.isfinite(areas).any() else start
+        selected[i + 1] = prev
+    
+    return selected
+
+
+def lttb_downsample(df: pd.DataFrame, n_out: int, y_col: str = "power_mw") -> pd.DataFrame:
+    """Tahmin DataFrame'ini LTTB ile en fazla `n_out` satıra indirger."""
+    if len(df) <= n_out:
+        return df
+    
+    x = df["timestamp"].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    y = df[y_col].to_numpy(dtype=np.float64, na_value=np.nan)
+    return df.iloc[lttb_indices(x, y, n_out)].reset_index(drop=True)
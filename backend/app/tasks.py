@@ -9,10 +9,14 @@ from sqlmodel import Session, select
 from fastapi import BackgroundTasks
 # from weasyprint import HTML
 import httpx
+from loguru import logger
 
 from .models import Site, ForecastRecord, BatteryConfig
 from .services import fetch_forecast, calc_power, calc_revenue, calc_co2, battery_dispatch
-from .crud import create_forecast, delete_old_forecasts
+from .crud import delete_old_forecasts, replace_site_forecasts
+from .drift import drift_monitor
+from .metrics import observe_stage, observe_outbound, STAGE_DURATION
+from .profiling import capture, PROFILE_SLOW_MS
 
 # Uluslararasılaştırma için metin sözlüğü
 TEXTS = {
@@ -48,7 +52,11 @@ REPORT_PATH = "/tmp/daily_report.pdf"
 # Slack webhook URL'si (opsiyonel)
 SLACK_WEBHOOK = os.environ.get("SLACK_WEBHOOK")
 
+# Yenilenen sahaların kayıtlı ML tahminleri arka planda yeniden hesaplanır (gece işini beklemeden)
+PREDICT_AFTER_REFRESH = os.environ.get("ML_PREDICT_AFTER_REFRESH", "1").lower() in ("1", "true", "yes")
 
+
+@observe_stage("refresh_cycle")
 async def update_forecasts(db: Session) -> Dict[str, Any]:
     """Tüm sahalar için tahminleri günceller."""
     result = {
@@ -56,6 +64,7 @@ async def update_forecasts(db: Session) -> Dict[str, Any]:
         "total_records": 0,
         "errors": []
     }
+    refreshed: List[int] = []
     
     # Tüm sahaları al
     statement = select(Site)
@@ -63,64 +72,74 @@ async def update_forecasts(db: Session) -> Dict[str, Any]:
     
     for site in sites:
         try:
-            # Tahmin verilerini çek
-            forecast_df = await fetch_forecast(site.latitude, site.longitude)
-            
-            # Güç hesapla
-            forecast_df = calc_power(forecast_df, site.capacity_mw, site.site_type)
-            
-            # Gelir hesapla
-            forecast_df = calc_revenue(forecast_df, site.country)
-            
-            # CO₂ tasarrufu hesapla
-            forecast_df = calc_co2(forecast_df, site.country)
-            
-            # Batarya konfigürasyonunu kontrol et
-            battery_config = db.exec(
-                select(BatteryConfig).where(BatteryConfig.site_id == site.id)
-            ).first()
-            
-            # Batarya varsa simülasyon yap
-            if battery_config:
-                forecast_df = battery_dispatch(
-                    forecast_df,
-                    battery_config.capacity_mwh,
-                    battery_config.power_mw,
-                    battery_config.initial_soc
-                )
-            
-            # Eski tahminleri sil
-            now = datetime.now()
-            await delete_old_forecasts(db, now - timedelta(days=1))
-            
-            # Yeni tahminleri kaydet
-            for _, row in forecast_df.iterrows():
-                forecast_data = {
-                    "site_id": site.id,
-                    "timestamp": row["timestamp"],
-                    "wind_speed": row.get("wind_speed"),
-                    "ghi": row.get("ghi"),
-                    "power_mw": row["power_mw"],
-                    "revenue_eur": row["revenue_eur"],
-                    "co2_saved_kg": row["co2_saved_kg"],
-                }
+            with STAGE_DURATION.time(stage="refresh_site"):
+                # Tahmin verilerini çek
+                forecast_df = await fetch_forecast(site.latitude, site.longitude)
+                
+                # Güç hesapla
+                forecast_df = calc_power(forecast_df, site.capacity_mw, site.site_type)
                 
-                # Batarya verileri varsa ekle
-                if "battery_soc" in row and "battery_power_mw" in row:
-                    forecast_data["battery_soc"] = row["battery_soc"]
-                    forecast_data["battery_power_mw"] = row["battery_power_mw"]
+                # Gelir hesapla
+                forecast_df = calc_revenue(forecast_df, site.country)
                 
-                await create_forecast(db, forecast_data)
-                result["total_records"] += 1
+                # CO₂ tasarrufu hesapla
+                forecast_df = calc_co2(forecast_df, site.country)
+                
+                # Batarya konfigürasyonunu kontrol et
+                battery_config = db.exec(
+                    select(BatteryConfig).where(BatteryConfig.site_id == site.id)
+                ).first()
+                
+                # Batarya varsa simülasyon yap
+                if battery_config:
+                    forecast_df = battery_dispatch(
+                        forecast_df,
+                        battery_config.capacity_mwh,
+                        battery_config.power_mw,
+                        battery_config.initial_soc
+                    )
+                
+                # Eski tahminleri sil
+                now = datetime.now()
+                await delete_old_forecasts(db, now - timedelta(days=1))
+                
+                # Yeni tahminleri tek transaction'da kaydet (önbellek de geçersiz kılınır)
+                result["total_records"] += await replace_site_forecasts(db, site.id, forecast_df)
+            
+            # Yeni saatleri drift özetlerine işle (hata yenilemeyi durdurmaz)
+            try:
+                drift_monitor.observe(db, site, forecast_df)
+            except Exception as error:
+                logger.warning(f"Drift güncellemesi başarısız | site_id={site.id}: {error}")
             
             result["updated_sites"] += 1
+            refreshed.append(site.id)
             
         except Exception as error:
+            db.rollback()
             result["errors"].append(f"Error updating site {site.name}: {str(error)}")
     
+    # Yeni saatler kayıtlı tahminleri eskittiğinden bu sahalar için tahmin işi kuyruğa alınır
+    if PREDICT_AFTER_REFRESH and refreshed:
+        result["prediction_job"] = _schedule_predictions(refreshed)
+    
     return result
 
 
+def _schedule_predictions(site_ids: List[int]) -> Optional[str]:
+    """Sahaların kayıtlı tahminlerini eğitim havuzunda yeniden hesaplatır (iş id'si döner)."""
+    from .training import training_jobs
+    
+    try:
+        job, created = training_jobs.submit(None, kind="predict", params={"site_ids": site_ids})
+    except Exception as error:
+        logger.error(f"Yenileme sonrası tahmin işi kuyruğa alınamadı: {error}")
+        return None
+    logger.info(f"Yenileme sonrası tahmin işi: {job.id} ({'yeni' if created else 'zaten sürüyor'}) | sites={len(site_ids)}")
+    return job.id
+
+
+@observe_stage("generate_report")
 async def generate_pdf_report(db: Session) -> str:
     """Günlük PDF raporu oluşturur."""
     # Rapor için veri topla
@@ -253,16 +272,18 @@ async def send_slack_notification(report_path: str) -> bool:
         
         async with httpx.AsyncClient() as client:
             # Önce mesajı gönder
-            await client.post(SLACK_WEBHOOK, json=message)
+            with observe_outbound("slack"):
+                await client.post(SLACK_WEBHOOK, json=message)
             
             # Sonra dosyayı gönder
             with open(report_path, "rb") as file:
                 files = {"file": ("daily_report.pdf", file, "application/pdf")}
-                await client.post(
-                    SLACK_WEBHOOK, 
-                    files=files,
-                    data={"filename": "daily_report.pdf"}
-                )
+                with observe_outbound("slack"):
+                    await client.post(
+                        SLACK_WEBHOOK, 
+                        files=files,
+                        data={"filename": "daily_report.pdf"}
+                    )
         
         return True
     
@@ -278,8 +299,12 @@ async def scheduled_tasks(db: Session) -> Dict[str, Any]:
         "slack_sent": False
     }
     
-    # Tahminleri güncelle
-    result["forecast_update"] = await update_forecasts(db)
+    # Tahminleri güncelle (eşik tanımlıysa yavaş döngüler profillenir)
+    if PROFILE_SLOW_MS > 0:
+        async with capture("update_forecasts", trigger="slow", force=False):
+            result["forecast_update"] = await update_forecasts(db)
+    else:
+        result["forecast_update"] = await update_forecasts(db)
     print(TEXTS['en']['forecast_updated'])
     
     # Gece yarısı kontrolü (23:00 - 01:00 arası)
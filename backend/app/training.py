@@ -0,0 +1,306 @@
+"""
+Eğitim işleri – model eğitimlerini sınırlı bir süreç havuzunda, API event loop'unu bloklamadan çalıştırır
+"""
+from __future__ import annotations
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from .events import event_hub
+from .metrics import registry
+
+# Havuz ayarları: aynı anda en fazla TRAIN_WORKERS eğitim, her biri TRAIN_TORCH_THREADS thread ile
+TRAIN_WORKERS = max(int(os.getenv("TRAIN_WORKERS", "1")), 1)
+TRAIN_TORCH_THREADS = max(int(os.getenv("TRAIN_TORCH_THREADS", str((os.cpu_count() or 1) // TRAIN_WORKERS))), 1)
+TRAIN_JOB_HISTORY = int(os.getenv("TRAIN_JOB_HISTORY", "200"))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+# Worker süreçlerinin ilerleme kuyruğu (initializer ile aktarılır)
+_progress_queue = None
+_current_job_id: Optional[str] = None
+
+
+@dataclass
+class TrainingJob:
+    """Tek bir eğitim işinin durumu."""
+    id: str
+    site_id: Optional[int]
+    kind: str = "site"  # "site", "fleet" (tüm sahalar için ortak model), "predict" (toplu tahmin), "tune" veya "backtest"
+    status: str = "queued"
+    stage: str = "queued"
+    progress: float = 0.0
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    params: Dict[str, Any] = field(default_factory=dict)  # işe özgü seçenekler (ör. geriye dönük test modelleri)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        if self.started_at is not None:
+            end = self.finished_at or time.time()
+            data["duration_seconds"] = round(end - self.started_at, 3)
+        return data
+
+
+def _init_worker(torch_threads: int, progress_queue) -> None:
+    """Worker sürecinde thread sınırlarını ve ilerleme kuyruğunu ayarlar."""
+    global _progress_queue
+    _progress_queue = progress_queue
+
+    # Worker'ın kendi kayıt defteri /metrics'te görünmez; ML süreleri ve aşama
+    # hataları ilerleme kuyruğuyla ana sürece iletilir
+    if progress_queue is not None:
+        from .metrics import ML_DURATION, STAGE_ERRORS
+
+        def forward(name: str, value: float, labels: Dict[str, str]) -> None:
+            progress_queue.put(("metric", name, value, labels))
+
+        ML_DURATION.forward = forward
+        STAGE_ERRORS.forward = forward
+
+    # Ortam değişkenleri yalnızca bundan sonra yüklenen kütüphanelere (ör. torch'un
+    # OpenMP'si) etki eder; spawn edilen süreç initializer'ı unpickle ederken
+    # numpy'ı zaten import ettiğinden yüklü BLAS havuzları threadpoolctl ile sınırlanır
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(torch_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=torch_threads)
+    except ImportError:
+        logger.warning("threadpoolctl yüklenmedi, yüklü BLAS thread havuzları sınırlanamadı.")
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+    except ImportError:
+        pass
+
+
+def _report_progress(stage: str, progress: float) -> None:
+    """Worker içinden ana sürece ilerleme bildirir."""
+    if _progress_queue is not None and _current_job_id is not None:
+        _progress_queue.put(("progress", _current_job_id, stage, progress))
+
+
+def _run_training_job(job_id: str, site_id: Optional[int], kind: str = "site",
+                      params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Worker sürecinde eğitimi (toplu tahmini, hiperparametre aramasını veya geriye dönük testi) kendi DB oturumuyla çalıştırır."""
+    global _current_job_id
+    from sqlmodel import Session
+
+    from .ml_service import run_batch_predictions, train_model, train_fleet_model
+    from .models import get_engine
+
+    _current_job_id = job_id
+    _report_progress("started", 0.0)
+    try:
+        with Session(get_engine()) as db:
+            if kind == "predict":
+                return run_batch_predictions(db, (params or {}).get("site_ids"), progress=_report_progress)
+            if kind == "tune":
+                from .tuning import tune_model
+                return tune_model(db, site_id, progress=_report_progress)
+            if kind == "backtest":
+                from .backtesting import run_backtest
+                site_ids = [site_id] if site_id is not None else None
+                return run_backtest(db, site_ids, progress=_report_progress, **(params or {}))
+            if kind == "fleet":
+                return train_fleet_model(db, progress=_report_progress)
+            return train_model(db, site_id, progress=_report_progress)
+    finally:
+        _current_job_id = None
+
+
+class TrainingJobManager:
+    """Eğitim işlerini kuyruğa alan, saha başına tekilleştiren ve durumunu tutan yönetici.
+
+    Süreç havuzu ilk işte oluşturulur (spawn bağlamı; torch fork ile güvenli
+    değildir). Worker'lar ilerlemeyi ortak bir kuyruğa yazar, ana süreçteki
+    bir thread bunu iş kayıtlarına işler.
+    """
+
+    def __init__(self, max_workers: int = TRAIN_WORKERS, torch_threads: int = TRAIN_TORCH_THREADS, history: int = TRAIN_JOB_HISTORY):
+        self.max_workers = max_workers
+        self.torch_threads = torch_threads
+        self.history = history
+        self._jobs: "OrderedDict[str, TrainingJob]" = OrderedDict()
+        self._active_by_key: Dict[Any, str] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._progress_queue = None
+        self._listener: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def _ensure_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            context = multiprocessing.get_context("spawn")
+            if self._progress_queue is None:
+                self._progress_queue = context.Queue()
+                self._listener = threading.Thread(target=self._drain_progress, name="training-progress", daemon=True)
+                self._listener.start()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(self.torch_threads, self._progress_queue),
+            )
+        return self._executor
+
+    @staticmethod
+    def _job_key(site_id: Optional[int], kind: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        if kind in ("tune", "backtest"):
+            return kind, site_id
+        if kind == "predict" and (params or {}).get("site_ids") is not None:
+            # Belirli sahalar için tahmin (ör. yenileme sonrası) gece işiyle birleşmez
+            return kind, tuple(sorted(params["site_ids"]))
+        return kind if kind in ("fleet", "predict") else site_id
+
+    def submit(self, site_id: Optional[int], kind: str = "site",
+               params: Optional[Dict[str, Any]] = None) -> Tuple[TrainingJob, bool]:
+        """Eğitim işi oluşturur; aynı saha/filo için aktif iş varsa onu döndürür (ikinci değer False)."""
+        key = self._job_key(site_id, kind, params)
+        with self._lock:
+            active_id = self._active_by_key.get(key)
+            if active_id is not None:
+                return self._jobs[active_id], False
+
+            job = TrainingJob(id=uuid.uuid4().hex, site_id=site_id, kind=kind, params=dict(params or {}))
+            self._jobs[job.id] = job
+            self._active_by_key[key] = job.id
+            self._prune()
+
+        try:
+            future = self._ensure_executor().submit(_run_training_job, job.id, site_id, kind, job.params)
+        except BrokenProcessPool:
+            # Bir worker beklenmedik şekilde öldüyse (ör. OOM) havuz yeniden kurulur
+            logger.warning("Eğitim süreç havuzu bozuldu, yeniden oluşturuluyor")
+            self._reset_executor()
+            future = self._ensure_executor().submit(_run_training_job, job.id, site_id, kind, job.params)
+        future.add_done_callback(lambda f, job_id=job.id: self._on_done(job_id, f))
+        self._publish(job)
+        return job, True
+
+    def get(self, job_id: str) -> Optional[TrainingJob]:
+        """İş kaydını döndürür (yoksa None)."""
+        return self._jobs.get(job_id)
+
+    def list(self, site_id: Optional[int] = None) -> List[TrainingJob]:
+        """İşleri yeniden eskiye listeler."""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        if site_id is not None:
+            jobs = [job for job in jobs if job.site_id == site_id]
+        return jobs[::-1]
+
+    def _prune(self) -> None:
+        # Yalnızca bitmiş işler geçmişten düşürülür
+        while len(self._jobs) > self.history:
+            oldest = next((job_id for job_id, job in self._jobs.items() if job.status not in ACTIVE_STATUSES), None)
+            if oldest is None:
+                break
+            del self._jobs[oldest]
+
+    def _drain_progress(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                message = self._progress_queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+
+            if message[0] == "metric":
+                _, name, value, labels = message
+                registry.record(name, value, labels)
+                continue
+            _, job_id, stage, progress = message
+
+            # Durum kontrolü ve güncelleme _on_done ile aynı kilit altında: bitmiş iş geri yazılmaz
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job.status not in ACTIVE_STATUSES:
+                    continue
+                if job.status == "queued":
+                    job.status = "running"
+                    job.started_at = time.time()
+                job.stage = stage
+                job.progress = progress
+            self._publish(job)
+
+    def _on_done(self, job_id: str, future: Future) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+
+            job.finished_at = time.time()
+            if job.started_at is None:
+                job.started_at = job.submitted_at
+            if future.cancelled():
+                job.status, job.error = "cancelled", "İş iptal edildi"
+            elif future.exception() is not None:
+                job.status, job.error = "failed", str(future.exception())
+            else:
+                job.result = future.result()
+                job.status, job.stage, job.progress = "succeeded", "done", 1.0
+
+            key = self._job_key(job.site_id, job.kind, job.params)
+            if self._active_by_key.get(key) == job_id:
+                del self._active_by_key[key]
+
+        if job.status == "failed":
+            logger.error(f"Eğitim işi başarısız | job={job_id} site_id={job.site_id}: {job.error}")
+        elif job.status == "succeeded" and job.kind not in ("predict", "tune", "backtest"):
+            self._reload_model(job)
+            self._rebaseline_drift(job)
+        self._publish(job)
+
+    @staticmethod
+    def _reload_model(job: TrainingJob) -> None:
+        # Bu süreçte yüklü eski sürüm, yeni sürüm arka planda yüklenene kadar yanıt vermeye devam eder
+        from .ml_service import model_cache, FLEET_MODEL_KEY
+        model_cache.refresh(FLEET_MODEL_KEY if job.kind == "fleet" else job.site_id)
+
+    @staticmethod
+    def _rebaseline_drift(job: TrainingJob) -> None:
+        # Yeni model için drift referansı yeniden oluşturulur (filo modeli tüm sahaları etkiler)
+        from .drift import drift_monitor
+        drift_monitor.rebaseline(None if job.kind == "fleet" else job.site_id)
+
+    @staticmethod
+    def _publish(job: TrainingJob) -> None:
+        event_hub.publish("training", {
+            "site_id": job.site_id,
+            "job_id": job.id,
+            "kind": job.kind,
+            "status": job.status,
+            "stage": job.stage,
+            "progress": job.progress,
+        })
+
+    def _reset_executor(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def shutdown(self) -> None:
+        """Havuzu kapatır; kuyruktaki işler iptal edilir."""
+        self._stopping.set()
+        self._reset_executor()
+
+
+# Global eğitim işi yöneticisi
+training_jobs = TrainingJobManager()
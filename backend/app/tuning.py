@@ -0,0 +1,300 @@
+"""
+Hiperparametre araması – ModelConfig üzerinde budamalı Optuna çalışmaları; doğruluk hedefini tutturan en ucuz konfigürasyonu seçer
+"""
+from __future__ import annotations
+
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import replace
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Union
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+from sqlmodel import Session
+
+from .ml_service import MODEL_DIR, _get_model_path, _get_site_data
+
+if TYPE_CHECKING:
+    from .ml_models import ModelConfig
+
+# Çalışma deposu: tüm süreçlerin paylaştığı yerel SQLite dosyası
+TUNING_STORAGE = os.getenv("ML_TUNING_STORAGE", f"sqlite:///{(MODEL_DIR / 'tuning.db').resolve()}")
+TUNING_TRIALS = max(int(os.getenv("ML_TUNING_TRIALS", "20")), 1)
+TUNING_TIMEOUT_SECONDS = float(os.getenv("ML_TUNING_TIMEOUT_SECONDS", "3600"))
+# Havuz ayarları: aynı anda TUNING_WORKERS deneme, her biri TUNING_TRIAL_THREADS thread ile
+TUNING_WORKERS = max(int(os.getenv("ML_TUNING_WORKERS", "2")), 1)
+TUNING_TRIAL_THREADS = max(int(os.getenv("ML_TUNING_TRIAL_THREADS", str((os.cpu_count() or 1) // TUNING_WORKERS))), 1)
+TUNING_PRUNER = os.getenv("ML_TUNING_PRUNER", "median").lower()  # "median", "hyperband" veya "none"
+# Doğruluk hedefi: mutlak MAE verilmezse en iyi denemenin MAE'sinin (1 + tolerans) katı
+TUNING_TARGET_MAE = float(os.getenv("ML_TUNING_TARGET_MAE", "0")) or None
+TUNING_TOLERANCE = float(os.getenv("ML_TUNING_TOLERANCE", "0.05"))
+# Seçilen konfigürasyon model dizinine yazılır; eğitim varsa onu kullanır
+TUNED_CONFIG_FILE = "tuned_config.json"
+TUNED_CONFIG_ENABLED = os.getenv("ML_USE_TUNED_CONFIG", "1").lower() in ("1", "true", "yes")
+
+# Arama uzayı (horizon sabittir; tahmin ufku API sözleşmesidir)
+SEARCH_SPACE = {
+    "input_size": [48, 96, 168],
+    "hidden_size": [32, 64, 128, 256],
+    "batch_size": [16, 32, 64],
+    "max_epochs": [20, 50, 100],
+    "dropout": (0.0, 0.3),
+    "learning_rate": (1e-4, 1e-2),
+}
+
+
+def _import_optuna():
+    try:
+        import optuna
+    except ImportError:
+        logger.warning("Optuna yüklenmedi, hiperparametre araması kullanılamaz.")
+        raise
+    return optuna
+
+
+def _make_pruner(optuna):
+    if TUNING_PRUNER == "hyperband":
+        return optuna.pruners.HyperbandPruner(min_resource=1, reduction_factor=3)
+    if TUNING_PRUNER == "none":
+        return optuna.pruners.NopPruner()
+    return optuna.pruners.MedianPruner(n_startup_trials=3, n_warmup_steps=2)
+
+
+def _storage(optuna):
+    # SQLite eşzamanlı yazımlarda kilitlenebilir; bekleme süresi uzatılır
+    engine_kwargs = {"connect_args": {"timeout": 60}} if TUNING_STORAGE.startswith("sqlite") else {}
+    return optuna.storages.RDBStorage(TUNING_STORAGE, engine_kwargs=engine_kwargs)
+
+
+def suggest_config(trial, time_budget: Optional[float] = None) -> "ModelConfig":
+    """Denemenin önerdiği değerlerle varsayılan konfigürasyonu günceller.
+
+    `time_budget` (saniye) verilirse eğitim süre bütçeleri aramanın kalan
+    süresiyle sınırlanır.
+    """
+    from .ml_models import ModelFactory
+
+    low, high = SEARCH_SPACE["dropout"]
+    lr_low, lr_high = SEARCH_SPACE["learning_rate"]
+    config = replace(
+        ModelFactory.get_default_config(),
+        input_size=trial.suggest_categorical("input_size", SEARCH_SPACE["input_size"]),
+        hidden_size=trial.suggest_categorical("hidden_size", SEARCH_SPACE["hidden_size"]),
+        batch_size=trial.suggest_categorical("batch_size", SEARCH_SPACE["batch_size"]),
+        max_epochs=trial.suggest_categorical("max_epochs", SEARCH_SPACE["max_epochs"]),
+        dropout=trial.suggest_float("dropout", low, high),
+        learning_rate=trial.suggest_float("learning_rate", lr_low, lr_high, log=True),
+    )
+    if time_budget is not None:
+        config = replace(
+            config,
+            job_time_budget=min(config.job_time_budget, time_budget) if config.job_time_budget > 0 else time_budget,
+            model_time_budget=min(config.model_time_budget, time_budget) if config.model_time_budget > 0 else time_budget,
+        )
+    return config
+
+
+def _pruning_callback(trial):
+    """Doğrulama kaybını (ptl/val_loss) denemeye bildiren Lightning callback'i.
+
+    Budama kararında eğitim durdurulur ve bayrak kaldırılır; istisna
+    fırlatılmaz, aksi halde fit() hatayı yakalayıp yedek LSTM'i eğitir.
+    Ensemble'daki modeller (TFT, NBEATS, DeepAR) art arda aynı callback ile
+    eğitildiğinden adım, bildirim sırasıdır; budamadan sonra başlayan
+    eğitimler de ilk adımda durdurulur.
+    """
+    from .ml_models import load_neuralforecast
+
+    class PruningCallback(load_neuralforecast().Callback):
+        def __init__(self):
+            self.step = 0
+            self.pruned = False
+
+        def on_train_start(self, trainer, pl_module):
+            if self.pruned:
+                trainer.should_stop = True
+
+        def on_train_batch_start(self, trainer, pl_module, batch, batch_idx):
+            if self.pruned:
+                trainer.should_stop = True
+                # -1 döndürmek Lightning'de kalan epoch'u atlar
+                return -1
+
+        def on_validation_end(self, trainer, pl_module):
+            if trainer.sanity_checking or self.pruned:
+                return
+            value = trainer.callback_metrics.get("ptl/val_loss")
+            if value is None:
+                return
+            trial.report(float(value), self.step)
+            self.step += 1
+            if trial.should_prune():
+                self.pruned = True
+                trainer.should_stop = True
+
+    return PruningCallback()
+
+
+def _holdout_split(df: pd.DataFrame, horizon: int):
+    """Son `horizon` saati değerlendirme için ayırır."""
+    return df.iloc[:-horizon], df.iloc[-horizon:]
+
+
+def _parameter_count(model) -> int:
+    return int(sum(p.numel() for network in model.nf.models for p in network.parameters()))
+
+
+def _objective(trial, df: pd.DataFrame, target_col: str, deadline: float) -> float:
+    """Adayı eğitip ayrılmış son ufuk üzerindeki MAE'yi döndürür (`deadline`: aramanın bitiş zamanı, epoch)."""
+    optuna = _import_optuna()
+    from .ml_models import ModelFactory
+
+    time_budget = deadline - time.time()
+    if time_budget <= 0:
+        raise optuna.TrialPruned()
+    config = suggest_config(trial, time_budget)
+    train_df, holdout = _holdout_split(df, config.horizon)
+    pruning = _pruning_callback(trial)
+
+    model = ModelFactory.create_model("ensemble", config)
+    started = time.perf_counter()
+    model.fit(train_df, target_col=target_col, callbacks=[pruning])
+    train_seconds = time.perf_counter() - started
+    trial.set_user_attr("train_seconds", train_seconds)
+    # Süre bütçesiyle yarıda kesilen aday tam eğitilmiş adaylarla karşılaştırılmaz
+    if pruning.pruned or time.time() >= deadline:
+        raise optuna.TrialPruned()
+
+    # predict() hedefi MW'a geri çevirir; ayrılan ufuktaki gerçek değerler de MW'dır
+    forecast = model.predict(train_df, target_col=target_col, lean=False)
+    merged = forecast.merge(holdout[["timestamp", target_col]], on="timestamp", how="inner")
+    mae = float(np.mean(np.abs(merged[target_col].to_numpy() - merged["predicted_power_mw"].to_numpy())))
+    trial.set_user_attr("parameters", _parameter_count(model))
+    return mae
+
+
+def _init_trial_worker(torch_threads: int) -> None:
+    """Deneme sürecinin thread sınırlarını ayarlar (eğitim worker'larıyla aynı)."""
+    from .training import _init_worker
+
+    _init_worker(torch_threads, None)
+
+
+def _run_trial(study_name: str, df: pd.DataFrame, target_col: str, deadline: float) -> None:
+    """Worker sürecinde paylaşılan çalışmaya tek bir deneme ekler; arama süresi dolduysa başlamaz."""
+    if time.time() >= deadline:
+        return
+    optuna = _import_optuna()
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    study = optuna.load_study(study_name=study_name, storage=_storage(optuna), pruner=_make_pruner(optuna))
+    study.optimize(lambda trial: _objective(trial, df, target_col, deadline), n_trials=1, catch=(RuntimeError, ValueError, TimeoutError))
+
+
+def select_config(study, target_mae: Optional[float] = TUNING_TARGET_MAE) -> Dict[str, Any]:
+    """Hedef MAE'yi tutturan denemeler arasından eğitimi en kısa süreni seçer.
+
+    Hedef verilmezse en iyi MAE'nin tolerans kadar üstü hedef alınır;
+    hiçbir deneme hedefi tutturamazsa en doğru deneme seçilir.
+    """
+    optuna = _import_optuna()
+    complete = [trial for trial in study.trials if trial.state == optuna.trial.TrialState.COMPLETE and trial.value is not None]
+    if not complete:
+        raise ValueError("Tamamlanan deneme yok")
+
+    best = min(complete, key=lambda trial: trial.value)
+    target = target_mae if target_mae is not None else best.value * (1 + TUNING_TOLERANCE)
+    eligible = [trial for trial in complete if trial.value <= target]
+    chosen = min(eligible, key=lambda trial: (trial.user_attrs.get("train_seconds", float("inf")), trial.value)) if eligible else best
+    return {
+        "params": dict(chosen.params),
+        "trial": chosen.number,
+        "mae": chosen.value,
+        "best_mae": best.value,
+        "target_mae": target,
+        "target_met": bool(eligible),
+        "train_seconds": chosen.user_attrs.get("train_seconds"),
+        "parameters": chosen.user_attrs.get("parameters"),
+    }
+
+
+def load_tuned_config(model_key: Union[int, str]) -> Optional["ModelConfig"]:
+    """Model dizinindeki ayarlanmış konfigürasyonu döndürür (yoksa veya kapalıysa None)."""
+    path = _get_model_path(model_key) / TUNED_CONFIG_FILE
+    if not TUNED_CONFIG_ENABLED or not path.exists():
+        return None
+    from .ml_models import ModelFactory
+
+    try:
+        params = json.loads(path.read_text(encoding="utf-8"))["params"]
+        return replace(ModelFactory.get_default_config(), **params)
+    except (OSError, ValueError, KeyError, TypeError) as exc:
+        logger.warning(f"Ayarlanmış konfigürasyon okunamadı ({path}): {exc}")
+        return None
+
+
+def tune_model(
+    db: Session,
+    site_id: int,
+    progress: Optional[Callable[[str, float], None]] = None,
+    n_trials: int = TUNING_TRIALS,
+) -> Dict[str, Any]:
+    """Saha için Optuna çalışması yürütür ve seçilen konfigürasyonu model dizinine yazar."""
+    optuna = _import_optuna()
+    report = progress or (lambda stage, fraction: None)
+
+    logger.info(f"Hiperparametre araması başlıyor | site_id={site_id} trials={n_trials}")
+    report("loading_data", 0.02)
+    df = _get_site_data(db, site_id)
+
+    study_name = f"{_get_model_path(site_id).name}-{int(time.time())}"
+    study = optuna.create_study(study_name=study_name, storage=_storage(optuna), direction="minimize",
+                                pruner=_make_pruner(optuna))
+
+    # Her deneme ayrı bir iş; havuz eşzamanlılığı ve deneme başına CPU'yu sınırlar.
+    # Bitiş zamanı süreçler arasında paylaşıldığından duvar saatiyle tutulur.
+    deadline = time.time() + TUNING_TIMEOUT_SECONDS
+    expired = False
+    context = multiprocessing.get_context("spawn")
+    executor = ProcessPoolExecutor(max_workers=TUNING_WORKERS, mp_context=context,
+                                   initializer=_init_trial_worker, initargs=(TUNING_TRIAL_THREADS,))
+    try:
+        pending = {executor.submit(_run_trial, study_name, df, "power_mw", deadline) for _ in range(n_trials)}
+        finished = 0
+        while pending:
+            done, pending = wait(pending, timeout=max(deadline - time.time(), 0), return_when=FIRST_COMPLETED)
+            for future in done:
+                finished += 1
+                if future.exception() is not None:
+                    logger.warning(f"Deneme başarısız: {future.exception()}")
+            report("tuning", 0.05 + 0.9 * finished / n_trials)
+            if time.time() >= deadline:
+                expired = True
+                logger.warning(f"Arama süresi doldu ({TUNING_TIMEOUT_SECONDS:.0f}s), kalan denemeler iptal edildi")
+                break
+    finally:
+        # Süre dolduysa çalışan denemeler beklenmez: eğitim bütçeleri aramanın bitişiyle
+        # sınırlı olduğundan kısa sürede kendileri durur ve budanmış sayılır
+        executor.shutdown(wait=not expired, cancel_futures=True)
+
+    study = optuna.load_study(study_name=study_name, storage=_storage(optuna))
+    selection = select_config(study)
+    states = [trial.state.name.lower() for trial in study.trials]
+
+    report("saving", 0.97)
+    save_path = _get_model_path(site_id)
+    save_path.mkdir(parents=True, exist_ok=True)
+    payload = {**selection, "study": study_name, "tuned_at": time.time()}
+    tmp_path = save_path / f"{TUNED_CONFIG_FILE}.tmp"
+    tmp_path.write_text(json.dumps(payload), encoding="utf-8")
+    os.replace(tmp_path, save_path / TUNED_CONFIG_FILE)
+
+    logger.info(f"Hiperparametre araması tamamlandı | site_id={site_id} seçilen={selection['params']} mae={selection['mae']:.4f}")
+    return {
+        **selection,
+        "study": study_name,
+        "trials": {state: states.count(state) for state in set(states)},
+    }
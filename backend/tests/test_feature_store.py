@@ -0,0 +1,114 @@
+"""
+Özellik deposu testleri – artımlı senkronizasyonun tam hesaplamayla aynı özellikleri ürettiğini doğrular
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import delete
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from app.feature_store import FeatureStore, TARGET_COLUMN
+from app.ml_models import AdvancedFeatureEngineer
+from app.ml_service import _get_panel_data
+from app.models import ForecastRecord, Site
+
+SITE_IDS = [1, 2]
+START = datetime(2026, 1, 1)
+HOURS = 24 * 30
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        for site_id in SITE_IDS:
+            session.add(Site(id=site_id, name=f"Saha {site_id}", country="TR", capacity_mw=10,
+                             site_type="wind", latitude=40.0, longitude=30.0))
+        session.commit()
+        _add_hours(session, 0, HOURS)
+        yield session
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FeatureStore(root=tmp_path / "feature_store")
+
+
+def _add_hours(db: Session, first: int, count: int, seed: int = 0) -> None:
+    rng = np.random.default_rng(seed + first)
+    for site_id in SITE_IDS:
+        for hour in range(first, first + count):
+            db.add(ForecastRecord(
+                site_id=site_id,
+                timestamp=START + timedelta(hours=hour),
+                wind_speed=float(rng.uniform(0, 25)),
+                ghi=float(rng.uniform(0, 900)),
+                power_mw=float(rng.uniform(0, 10)),
+                revenue_eur=0.0,
+                co2_saved_kg=0.0,
+                battery_soc=float(rng.uniform(0, 1)) if hour % 5 else None,
+                battery_power_mw=float(rng.uniform(-1, 1)),
+            ))
+    db.commit()
+
+
+def _assert_matches_full_computation(db: Session, store: FeatureStore, deleted: pd.DataFrame) -> None:
+    """Depo okuması, aynı DB verisi üzerinde baştan hesaplanan ham özelliklerle aynı olmalı.
+
+    DB'den silinen eski saatler lag/rolling bağlamı olarak kalan ilk
+    satırları etkilediğinden beklenen değerler silinen satırlar da eklenerek
+    hesaplanır ve yalnızca DB'de kalan satırlarla karşılaştırılır.
+    """
+    current = _get_panel_data(db, SITE_IDS)
+    history = pd.concat([deleted, current], ignore_index=True) if len(deleted) else current
+    expected = AdvancedFeatureEngineer().raw_features(history, [TARGET_COLUMN])
+    keys = pd.MultiIndex.from_frame(current[["site_id", "timestamp"]])
+    expected_keys = pd.MultiIndex.from_frame(expected.frame[["site_id", "timestamp"]].reset_index(drop=True))
+    expected = expected.take(expected_keys.isin(keys))
+
+    df, raw = store.read(db, SITE_IDS)
+
+    pd.testing.assert_frame_equal(df.reset_index(drop=True), current.reset_index(drop=True), check_dtype=False)
+    pd.testing.assert_frame_equal(
+        raw.frame.reset_index(drop=True), expected.frame.reset_index(drop=True), check_dtype=False
+    )
+    assert raw.columns == expected.columns
+    assert raw.order == expected.order
+    np.testing.assert_allclose(np.asarray(raw.matrix), expected.matrix, rtol=1e-5, atol=1e-5, equal_nan=True)
+
+
+def test_incremental_sync_matches_full_feature_computation(db, store):
+    deleted = pd.DataFrame()
+
+    # İlk okuma: tüm geçmiş
+    _assert_matches_full_computation(db, store, deleted)
+
+    # Yeni saatler yalnızca sona eklenir
+    _add_hours(db, HOURS, 48)
+    _assert_matches_full_computation(db, store, deleted)
+
+    # Son saatler yeniden yazılır; önceki okumanın memmap'i değişmeden kalmalı
+    _, before = store.read(db, SITE_IDS)
+    snapshot = np.array(before.matrix)
+    rewritten = START + timedelta(hours=HOURS + 40)
+    for record in db.exec(select(ForecastRecord).where(ForecastRecord.timestamp >= rewritten)).all():
+        record.power_mw += 1.5
+        record.wind_speed = None
+        db.add(record)
+    db.commit()
+    _assert_matches_full_computation(db, store, deleted)
+    np.testing.assert_array_equal(np.asarray(before.matrix), snapshot)
+
+    # Yarıdan fazla eski saat silinir (sıkıştırma tetiklenir), ardından yeni saatler eklenir
+    cutoff = START + timedelta(hours=(HOURS + 48) * 2 // 3)
+    deleted = _get_panel_data(db, SITE_IDS, end=cutoff)
+    db.execute(delete(ForecastRecord).where(ForecastRecord.timestamp < cutoff))
+    db.commit()
+    _assert_matches_full_computation(db, store, deleted)
+    assert store.sync(db, SITE_IDS[0]).rows == HOURS + 48 - (HOURS + 48) * 2 // 3
+
+    _add_hours(db, HOURS + 48, 24)
+    _assert_matches_full_computation(db, store, deleted)